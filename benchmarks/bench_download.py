@@ -0,0 +1,170 @@
+"""
+End-to-end download benchmarks against local mock storage
+
+    $ python benchmarks/bench_download.py
+    $ python benchmarks/bench_download.py --latency 0.05 --bandwidth 20000000 --save baseline.json
+    $ python benchmarks/bench_download.py --baseline baseline.json
+
+Landsat8 and Sentinel2 download every combination of the scene counts, band counts and worker counts from
+servers laid out like the S3 and Google Storage buckets. With a baseline the run fails when a case got slower
+than the tolerance allows or sent more requests than before.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import time
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_storage import MockStorage  # noqa: E402
+from sdownloader import Landsat8, Sentinel2  # noqa: E402
+from sdownloader.common import create_session  # noqa: E402
+
+LANDSAT8_BANDS = [4, 3, 2, 5, 6, 7, 1, 9, 10, 11]
+SENTINEL2_BANDS = [4, 3, 2, 8, 11, 12, 1, 5, 6, 7]
+
+
+def landsat8_scenes(count):
+    return ['LC08_L1TP_{0:03d}029_20170411_20170415_01_T1'.format(i + 1) for i in range(count)]
+
+
+def sentinel2_scenes(count):
+    return ['tiles/34/R/CS/2016/{0}/{1}/0'.format(1 + i // 28, 1 + i % 28) for i in range(count)]
+
+
+def downloader_classes(s3, gcs):
+    """ Landsat8 and Sentinel2 subclasses that download from the mock servers """
+
+    class LocalLandsat8(Landsat8):
+        S3_LANDSAT_BASE_URL = s3.url + 'landsat-pds/c1/'
+        GOOGLE_BASE_URL = gcs.url + 'gcp-public-data-landsat/'
+
+    class LocalSentinel2(Sentinel2):
+        S3_SENTINEL = s3.url + 'sentinel-s2-l1c/'
+
+    return {
+        'landsat8': (LocalLandsat8, landsat8_scenes, LANDSAT8_BANDS),
+        'sentinel2': (LocalSentinel2, sentinel2_scenes, SENTINEL2_BANDS),
+    }
+
+
+def run_case(storages, classes, satellite, scenes, bands, workers, session, connections):
+    """ Downloads the scenes once and measures the run.
+    :returns:
+        (Dict) case name, seconds, MB/s, requests per method and number of failed files
+    """
+    downloader_class, scene_ids, band_ids = classes[satellite]
+    name = '{0} scenes={1} bands={2} workers={3} {4}'.format(
+        satellite, scenes, bands, workers, 'session' if session else 'homura')
+
+    for storage in storages:
+        storage.reset()
+
+    folder = mkdtemp()
+    failures = 0
+    session = create_session(pool_size=max(workers, 10), backoff_factor=0.01) if session else None
+    try:
+        downloader = downloader_class(folder, max_workers=workers, connections=connections, session=session)
+        started = time.time()
+        try:
+            failures = len(downloader.download(scene_ids(scenes), band_ids[:bands]).errors)
+        except Exception as e:
+            sys.stderr.write('{0} failed: {1!r}\n'.format(name, e))
+            failures = -1
+        seconds = time.time() - started
+    finally:
+        if session is not None:
+            # idle keep-alive connections would hold the server threads
+            session.close()
+        shutil.rmtree(folder)
+
+    requests = {}
+    for storage in storages:
+        for method, count in storage.requests.items():
+            requests[method] = requests.get(method, 0) + count
+    received = sum(storage.bytes_sent for storage in storages)
+
+    return {
+        'name': name,
+        'seconds': seconds,
+        'mb_per_second': received / 1048576.0 / seconds if seconds > 0 else 0.0,
+        'requests': requests,
+        'failures': failures,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """ Returns descriptions of the cases that regressed against the baseline results """
+    previous = dict((result['name'], result) for result in baseline)
+    regressions = []
+    for result in results:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        if result['mb_per_second'] < before['mb_per_second'] * (1 - tolerance):
+            regressions.append('{0}: {1:.2f} MB/s, was {2:.2f} MB/s'.format(
+                result['name'], result['mb_per_second'], before['mb_per_second']))
+        if sum(result['requests'].values()) > sum(before['requests'].values()):
+            regressions.append('{0}: {1} requests, was {2}'.format(
+                result['name'], result['requests'], before['requests']))
+    return regressions
+
+
+def _parser():
+    parser = argparse.ArgumentParser(description='Benchmarks downloads against local mock storage.')
+    parser.add_argument('--satellites', nargs='+', default=['landsat8', 'sentinel2'],
+                        choices=['landsat8', 'sentinel2'])
+    parser.add_argument('--scenes', nargs='+', type=int, default=[1, 8], help='Scene counts')
+    parser.add_argument('--bands', nargs='+', type=int, default=[1, 3], help='Band counts')
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 8], help='Worker counts')
+    parser.add_argument('--homura', action='store_true', help='Also run every case without a session')
+    parser.add_argument('--connections', type=int, default=1, help='Parallel range requests per large file')
+    parser.add_argument('--file-size', type=int, default=2 * 1024 * 1024, help='Bytes of every file')
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds before every answer')
+    parser.add_argument('--bandwidth', type=float, help='Bytes per second of a single response')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests answered with 503')
+    parser.add_argument('--s3-missing', nargs='*', default=[],
+                        help='Path patterns S3 answers with 404, e.g. _B4.TIF to exercise the Google fallback')
+    parser.add_argument('--no-ranges', action='store_true', help='Ignore Range headers')
+    parser.add_argument('--save', help='Write the results to a JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed throughput loss against the baseline')
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    options = dict(file_size=args.file_size, latency=args.latency, bandwidth=args.bandwidth,
+                   error_rate=args.error_rate, ranges=not args.no_ranges)
+
+    results = []
+    with MockStorage(missing=args.s3_missing, **options) as s3, MockStorage(**options) as gcs:
+        classes = downloader_classes(s3, gcs)
+        sessions = [True, False] if args.homura else [True]
+        for case in itertools.product(args.satellites, args.scenes, args.bands, args.workers, sessions):
+            result = run_case([s3, gcs], classes, *case, connections=args.connections)
+            results.append(result)
+            sys.stdout.write('{name:<55} {seconds:8.2f} s {mb_per_second:9.2f} MB/s  requests={requests} '
+                             'failures={failures}\n'.format(**result))
+            sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            sys.stdout.write('REGRESSION {0}\n'.format(regression))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Local http server that imitates a public imagery bucket on S3 or Google Storage.
+
+Every path is served as a file of ``file_size`` bytes unless it matches one of the ``missing`` patterns.
+Latency, bandwidth, 503 answers and Range support are configurable, and every request is counted, so
+benchmarks can run offline against realistic conditions.
+"""
+import hashlib
+import random
+import re
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+        self._connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self.connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self.connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        """ Ends idle keep-alive connections, so their threads don't outlive the server """
+        with self._connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        storage = self.server.storage
+        storage._count(self.command)
+        if storage.latency:
+            time.sleep(storage.latency)
+
+        path = self.path.split('?')[0]
+        if storage._fails():
+            return self._empty(503)
+        if any(pattern.search(path) for pattern in storage.missing):
+            return self._empty(404)
+
+        size = storage.file_size
+        start, end = 0, size - 1
+        status = 200
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if match and storage.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', '"{0}"'.format(storage.md5))
+        if storage.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, size))
+        self.end_headers()
+
+        if body:
+            storage._send(self.wfile, start, end + 1)
+
+    def _empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class MockStorage(object):
+    """ Bucket-like http server running in a background thread """
+
+    def __init__(self, file_size=1024 * 1024, latency=0, bandwidth=None, missing=(), error_rate=0, ranges=True,
+                 seed=0):
+        """
+        :param file_size:
+            Size in bytes of every served file
+        :type file_size:
+            int
+        :param latency:
+            Seconds every request waits before it is answered
+        :type latency:
+            float
+        :param bandwidth:
+            Bytes per second a single response is sent at, unlimited by default
+        :type bandwidth:
+            float
+        :param missing:
+            Regular expressions of paths answered with 404
+        :type missing:
+            Iterable
+        :param error_rate:
+            Share of requests answered with 503
+        :type error_rate:
+            float
+        :param ranges:
+            Pass false to ignore Range headers like some proxies do
+        :type ranges:
+            bool
+        """
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.missing = [re.compile(pattern) for pattern in missing]
+        self.error_rate = error_rate
+        self.ranges = ranges
+
+        self._content = (b'0123456789abcdef' * (CHUNK_SIZE // 16 + 1))[:CHUNK_SIZE]
+        self.md5 = self._checksum()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.bytes_sent = 0
+        self._server = None
+        self._thread = None
+
+    def _checksum(self):
+        digest = hashlib.md5()
+        for offset in range(0, self.file_size, CHUNK_SIZE):
+            digest.update(self._content[:min(CHUNK_SIZE, self.file_size - offset)])
+        return digest.hexdigest()
+
+    def _count(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def _fails(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _send(self, stream, start, stop):
+        # the content repeats every CHUNK_SIZE bytes, so any range is a rotation of the same block
+        position = start
+        while position < stop:
+            offset = position % CHUNK_SIZE
+            chunk = self._content[offset:offset + min(CHUNK_SIZE - offset, stop - position)]
+            sent_at = time.time()
+            try:
+                stream.write(chunk)
+            except (IOError, OSError):
+                # the client went away
+                return
+            position += len(chunk)
+            with self._lock:
+                self.bytes_sent += len(chunk)
+            if self.bandwidth:
+                time.sleep(max(len(chunk) / float(self.bandwidth) - (time.time() - sent_at), 0))
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}/'.format(host, port)
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.storage = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.close_connections()
+        self._server.server_close()
+        self._thread.join()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
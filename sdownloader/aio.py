@@ -0,0 +1,345 @@
+"""
+asyncio counterparts of the blocking downloaders.
+
+Requires Python 3.5+ and aiohttp. Thousands of files share a single event loop and a single pooled aiohttp
+session, concurrency is bounded by a semaphore instead of threads.
+"""
+import asyncio
+import logging
+import os
+import os.path as _path
+from os import remove, rename
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .common import RemoteMetadata, PART_SUFFIX, CHUNK_SIZE, check_create_folder, keep_existing_file
+from .download import Scenes, DownloadPlan, AMAZON_S3_STORAGE, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE
+from .errors import RemoteFileDoesntExist
+from .landsat8 import Landsat8, Landsat8DownloaderException
+from .sentinel2 import Sentinel2
+
+logger = logging.getLogger('sdownloader')
+
+DEFAULT_CONCURRENCY = 64
+
+
+def create_session(limit=DEFAULT_CONCURRENCY, limit_per_host=0):
+    """ Creates an aiohttp session with a connection pool. Must be called from a coroutine.
+    :param limit:
+        Maximum number of open connections
+    :type limit:
+        int
+    :param limit_per_host:
+        Maximum number of open connections to a single host, 0 means no limit
+    :type limit_per_host:
+        int
+    :returns:
+        aiohttp.ClientSession
+    """
+    if aiohttp is None:
+        raise ImportError('aiohttp is required for asyncio downloads, install it with `pip install aiohttp`')
+
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host))
+
+
+async def get_remote_metadata(url, session, cache=None):
+    """ Gets status, size, ETag and modification date of a remote file with one HEAD request.
+    :param url:
+        The url that has to be checked.
+    :type url:
+        String
+    :param session:
+        Http session to send the request with.
+    :type session:
+        aiohttp.ClientSession
+    :param cache:
+        Cache of earlier probes, asked before the request is sent
+    :type cache:
+        sdownloader.cache.MetadataCache
+    :returns:
+        RemoteMetadata
+    """
+    if cache is not None:
+        remote = cache.get(url)
+        if remote is not None:
+            return remote
+
+    async with session.head(url) as response:
+        remote = RemoteMetadata.from_headers(url, response.status, response.headers)
+
+    if cache is not None:
+        cache.set(remote)
+    return remote
+
+
+async def get_remote_file_size(url, session):
+    """ Gets the filesize of a remote file.
+    :returns:
+        int
+    """
+    return (await get_remote_metadata(url, session)).content_length
+
+
+async def remote_file_exists(url, session, cache=None):
+    """ Checks whether the remote file exists.
+    :returns:
+        (RemoteMetadata) metadata of the file if it exists, otherwise RemoteFileDoesntExist is raised.
+    """
+    remote = await get_remote_metadata(url, session, cache=cache)
+
+    if remote.exists:
+        return remote
+    else:
+        raise RemoteFileDoesntExist
+
+
+async def fetch(url, path, session, remote=None):
+    """ Downloads a given url to a give path, resuming a partially written file.
+    :param url:
+        The url to be downloaded.
+    :type url:
+        String
+    :param path:
+        The directory path to where the image should be stored
+    :type path:
+        String
+    :param session:
+        Http session to download the file with.
+    :type session:
+        aiohttp.ClientSession
+    :param remote:
+        Metadata of the url from an earlier probe. Saves another HEAD request for files that already exist.
+    :type remote:
+        RemoteMetadata
+    :returns:
+        Downloaded file path
+    """
+    filename = url.split('/')[-1].split('?')[0]
+
+    file_path = _path.join(path, filename)
+    part_path = file_path + PART_SUFFIX
+
+    if _path.exists(file_path):
+        if remote is None:
+            remote = await get_remote_metadata(url, session)
+        if keep_existing_file(file_path, remote):
+            return file_path
+
+    if remote is not None and _path.exists(part_path) and _path.getsize(part_path) == remote.content_length:
+        logger.info('{0} has been completely downloaded before'.format(filename))
+    else:
+        await _stream(url, part_path, session)
+
+    rename(part_path, file_path)
+    logger.info('stored at {0}'.format(path))
+
+    return file_path
+
+
+async def _stream(url, file_path, session):
+    """ Downloads a url to a file, a partially written file is completed with a Range request """
+    offset = _path.getsize(file_path) if _path.exists(file_path) else 0
+    headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 404:
+            raise RemoteFileDoesntExist
+        if response.status == 416:
+            # nothing is left past the offset, the partial file is either complete or stale
+            if response.headers.get('content-range') == 'bytes */{0}'.format(offset):
+                return
+            stale = True
+        else:
+            stale = False
+            response.raise_for_status()
+
+            if response.status != 206:
+                # the server ignored the range, so the file is written from scratch
+                offset = 0
+
+            with open(file_path, 'ab' if offset else 'wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    f.write(chunk)
+
+    if stale:
+        remove(file_path)
+        await _stream(url, file_path, session)
+
+
+class AsyncDownloadMixin(object):
+    """ Coroutine based download of a blocking downloader's scenes """
+
+    def _init_async(self, session, max_concurrency):
+        # aiohttp session, a session is created for every download call if none is given. It is kept apart from
+        # self.session, the requests session of the blocking methods.
+        self._aio_session = session
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    @property
+    def _slots(self):
+        # created lazily, so the semaphore belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _with_session(self, coroutine_function):
+        if self._aio_session is not None:
+            return await coroutine_function(self._aio_session)
+
+        async with create_session(limit=self.max_concurrency) as session:
+            return await coroutine_function(session)
+
+    async def _download_scenes(self, scenes, bands, plan, session):
+        """ Plans and fetches scenes concurrently, scenes missing remotely or failing to be planned are reported
+        in ``Scenes.errors``
+        """
+        catalogued = dict((scene, self._catalogued(scene, bands)) for scene in scenes)
+        pending = [scene for scene in scenes if catalogued[scene] is None]
+
+        planned = await asyncio.gather(*[plan(scene, session) for scene in pending], return_exceptions=True)
+        for scene, result in zip(pending, planned):
+            if isinstance(result, Exception) and not isinstance(result, RemoteFileDoesntExist):
+                logger.error('Failed to plan {0}: {1}'.format(scene, result))
+
+        downloaded = await self._execute_async([p for p in planned if isinstance(p, DownloadPlan)], session)
+
+        scene_objs = Scenes()
+        for scene in scenes:
+            if catalogued[scene] is not None:
+                scene_objs.add(catalogued[scene])
+            elif scene in downloaded:
+                scene_objs.add(downloaded[scene])
+        scene_objs.errors.extend(downloaded.errors)
+
+        for scene, result in zip(pending, planned):
+            if isinstance(result, Exception):
+                scene_objs.errors.append((scene, None, result))
+
+        return scene_objs
+
+    async def _probe_plan(self, scene, bands, url_builder, source, session):
+        """ Checks that every band of the scene exists, all bands are probed concurrently.
+        :returns:
+            DownloadPlan
+        """
+        path = self.scene_interpreter(scene)
+        bands = list(bands)
+
+        remotes = await asyncio.gather(*[self._probe_async(url_builder(path, band), session) for band in bands])
+
+        folder = os.path.join(self.download_dir, self._relative_product_path(path))
+        return DownloadPlan(scene, folder, list(zip(bands, remotes)), source)
+
+    async def _probe_async(self, url, session):
+        async with self._slots:
+            return await remote_file_exists(url, session, cache=self.cache)
+
+    async def _execute_async(self, plans, session):
+        """ Fetches all files of the planned scenes concurrently, failed files are gathered into ``errors`` """
+        scene_objs = Scenes()
+
+        for plan in plans:
+            # create folder
+            check_create_folder(plan.folder)
+            self._catalog_scene(plan)
+
+        jobs = [(plan, band, remote) for plan in plans for band, remote in plan.files]
+        results = iter(await asyncio.gather(*[self._fetch_async(session, *job) for job in jobs],
+                                            return_exceptions=True))
+
+        for plan in plans:
+            scene_files = []
+            scene_bands = []
+            for band, remote in plan.files:
+                result = next(results)
+                if isinstance(result, Exception):
+                    logger.error('Failed to download {0}: {1}'.format(remote.url, result))
+                    scene_objs.errors.append((plan.scene, remote.url, result))
+                else:
+                    scene_files.append(result)
+                    scene_bands.append(band)
+            scene_objs.add_with_files(plan.scene, scene_files, scene_bands)
+
+        return scene_objs
+
+    async def _fetch_async(self, session, plan, band, remote):
+        async with self._slots:
+            path = await fetch(remote.url, plan.folder, session, remote=remote)
+
+        if self.catalog is not None:
+            self.catalog.add_file(plan.scene, band, path, size=remote.content_length, etag=remote.etag,
+                                  source=plan.source or self._url_source(remote.url))
+        return path
+
+
+class AsyncLandsat8(AsyncDownloadMixin, Landsat8):
+    """ Landsat8 downloader with a coroutine download method """
+
+    def __init__(self, download_dir, relative_product_path_builder=None, session=None,
+                 max_concurrency=DEFAULT_CONCURRENCY, catalog=None, cache=None):
+        super(AsyncLandsat8, self).__init__(download_dir, relative_product_path_builder, catalog=catalog,
+                                            cache=cache)
+        self._init_async(session, max_concurrency)
+
+    async def download(self, products, bands=tuple(Landsat8._BAND_MAP.values()),
+                       service_chain=(AMAZON_S3_STORAGE, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)):
+        """
+        Download scenes from Google Storage or Amazon S3, see Landsat8.download.
+        Products that aren't available from any service are reported in ``Scenes.errors``.
+        :returns:
+            Scenes
+        """
+        if not isinstance(products, list):
+            raise ValueError('Expected sceneIDs list')
+
+        bands = self._DEFAULT_BANDS.union(self._band_converter(bands))
+
+        async def plan(product_id, session):
+            for service_designator in service_chain:
+                if service_designator == AMAZON_S3_STORAGE:
+                    url_builder = self.amazon_s3_url
+                elif service_designator == GOOGLE_PUBLIC_DATA_STORAGE_SERVICE:
+                    url_builder = self.google_storage_url
+                else:
+                    raise Landsat8DownloaderException(
+                        '{} - service designator is not supported'.format(service_designator)
+                    )
+                try:
+                    return await self._probe_plan(product_id, bands, url_builder, service_designator, session)
+                except RemoteFileDoesntExist:
+                    pass
+
+            raise RemoteFileDoesntExist
+
+        return await self._with_session(lambda session: self._download_scenes(products, bands, plan, session))
+
+
+class AsyncSentinel2(AsyncDownloadMixin, Sentinel2):
+    """ Sentinel2 downloader with a coroutine download method """
+
+    def __init__(self, download_dir, relative_product_path_builder=None, session=None,
+                 max_concurrency=DEFAULT_CONCURRENCY, catalog=None, cache=None):
+        super(AsyncSentinel2, self).__init__(download_dir, relative_product_path_builder, catalog=catalog,
+                                             cache=cache)
+        self._init_async(session, max_concurrency)
+
+    async def download(self, scenes, bands):
+        """
+        Download scenes from Amazon S3, see Sentinel2.download.
+        Scenes that don't exist are reported in ``Scenes.errors``.
+        :returns:
+            Scenes
+        """
+        if not isinstance(scenes, list):
+            raise ValueError('Expected scene list')
+
+        bands = set(self._band_converter(bands))
+
+        def plan(scene, session):
+            return self._probe_plan(scene, bands, self.amazon_s3_url, AMAZON_S3_STORAGE, session)
+
+        return await self._with_session(lambda session: self._download_scenes(scenes, bands, plan, session))
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .common import RemoteMetadata
+
+logger = logging.getLogger('sdownloader')
+
+
+class MetadataCache(object):
+    """ Bounded cache of HEAD probe results. Remembers missing files as well as existing ones. """
+
+    def __init__(self, maxsize=100000, ttl=24 * 60 * 60, path=None):
+        """
+        :param maxsize:
+            Maximum number of urls kept, the least recently used ones are evicted first
+        :type maxsize:
+            int
+        :param ttl:
+            Seconds after which a probe result expires
+        :type ttl:
+            int
+        :param path:
+            JSON file the cache is loaded from and saved to
+        :type path:
+            String
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, url):
+        """ Returns cached RemoteMetadata of the url or **None** if it is unknown or expired """
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is None:
+                return None
+
+            expires, remote = entry
+            if expires < time.time():
+                return None
+
+            # re-insert to mark the url as the most recently used
+            self._entries[url] = entry
+            return remote
+
+    def set(self, remote):
+        """ Caches a probe result. Server errors are transient and aren't cached. """
+        if remote.status >= 500:
+            return
+
+        with self._lock:
+            self._entries.pop(remote.url, None)
+            self._entries[remote.url] = (time.time() + self.ttl, remote)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self):
+        """ Loads unexpired entries from the cache file """
+        with open(self.path) as f:
+            entries = json.load(f)
+
+        now = time.time()
+        with self._lock:
+            for expires, fields in entries:
+                if expires >= now:
+                    remote = RemoteMetadata(*fields)
+                    self._entries[remote.url] = (expires, remote)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """ Saves the cache to its file, replacing the file atomically """
+        with self._lock:
+            entries = [[expires, list(remote)] for expires, remote in self._entries.values()]
+
+        temp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f)
+        os.rename(temp_path, self.path)
+        logger.info('{0} probe results saved to {1}'.format(len(entries), self.path))
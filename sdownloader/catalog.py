@@ -0,0 +1,152 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from .download import Scene, Scenes
+
+logger = logging.getLogger('sdownloader')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    scene TEXT PRIMARY KEY,
+    satellite TEXT,
+    path TEXT,
+    row TEXT,
+    mgrs TEXT,
+    date TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    scene TEXT NOT NULL,
+    band TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    checksum TEXT,
+    source TEXT,
+    PRIMARY KEY (scene, band)
+);
+CREATE INDEX IF NOT EXISTS scenes_path_row ON scenes (path, row, date);
+CREATE INDEX IF NOT EXISTS scenes_mgrs ON scenes (mgrs, date);
+"""
+
+
+class Catalog(object):
+    """ On-disk index of downloaded scenes and their files """
+
+    DEFAULT_NAME = 'catalog.sqlite'
+
+    def __init__(self, path):
+        """
+        :param path:
+            Path to the SQLite database. If a directory is given, the database is kept inside of it.
+        :type path:
+            String
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, self.DEFAULT_NAME)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add_scene(self, scene, satellite, path=None, row=None, mgrs=None, date=None):
+        """ Records searchable attributes of a scene.
+        :param date:
+            Acquisition date in YYYY-MM-DD format
+        :type date:
+            String
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO scenes (scene, satellite, path, row, mgrs, date) VALUES (?, ?, ?, ?, ?, ?)',
+                (scene, satellite, path, row, mgrs, date)
+            )
+
+    def add_file(self, scene, band, path, size=None, etag=None, checksum=None, source=None):
+        """ Records a downloaded band file of a scene """
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO files (scene, band, path, size, etag, checksum, source) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (scene, str(band), path, size, etag, checksum, source)
+            )
+
+    def files(self, scene):
+        """ Returns (band, path, size, etag, checksum, source) rows of the scene files """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT band, path, size, etag, checksum, source FROM files WHERE scene = ? ORDER BY rowid', (scene,)
+            ).fetchall()
+
+    def scene(self, scene, bands=None):
+        """ Returns a downloaded scene without touching the network.
+        :param scene:
+            Scene name
+        :type scene:
+            String
+        :param bands:
+            Bands the scene must have
+        :type bands:
+            Iterable
+        :returns:
+            Scene if all the requested bands are recorded and still exist on disk, otherwise **None**
+        """
+        rows = self.files(scene)
+        recorded = dict((band, path) for band, path, _, _, _, _ in rows)
+
+        if bands is None:
+            bands = [band for band, _, _, _, _, _ in rows]
+        paths = [recorded.get(str(band)) for band in bands]
+
+        if not paths or not all(path and os.path.exists(path) for path in paths):
+            return None
+
+        return Scene(scene, paths, bands=list(bands))
+
+    def scenes(self, satellite=None, path=None, row=None, mgrs=None, start=None, end=None):
+        """ Finds downloaded scenes.
+        :param path:
+            Landsat WRS path
+        :param row:
+            Landsat WRS row
+        :param mgrs:
+            Sentinel-2 MGRS tile, e.g. 34RCS
+        :param start:
+            First acquisition date (inclusive) in YYYY-MM-DD format
+        :param end:
+            Last acquisition date (inclusive) in YYYY-MM-DD format
+        :returns:
+            Scenes
+        """
+        conditions = []
+        parameters = []
+        for column, value in (('satellite', satellite), ('path', path), ('row', row), ('mgrs', mgrs)):
+            if value is not None:
+                conditions.append('{0} = ?'.format(column))
+                parameters.append(value)
+        if start is not None:
+            conditions.append('date >= ?')
+            parameters.append(str(start))
+        if end is not None:
+            conditions.append('date <= ?')
+            parameters.append(str(end))
+
+        query = 'SELECT scene FROM scenes'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY date, scene'
+
+        with self._lock:
+            names = [name for name, in self._connection.execute(query, parameters).fetchall()]
+
+        scenes = []
+        for name in names:
+            rows = self.files(name)
+            scenes.append(Scene(name, [p for _, p, _, _, _, _ in rows], bands=[b for b, _, _, _, _, _ in rows]))
+        return Scenes(scenes)
@@ -0,0 +1,266 @@
+"""
+Batch downloads from the command line
+
+    $ sdownloader manifest.csv --download-dir ./imagery --workers 8
+
+The manifest lists one scene per row together with the bands to fetch. It is either a CSV file with ``scene``
+and ``bands`` columns, bands separated by spaces, or a JSON lines file (``.jsonl``) of objects like
+{"scene": "tiles/34/R/CS/2016/3/25/0", "bands": [4, 3, 2]}. An optional ``satellite`` column overrides the
+satellite guessed from the scene name.
+
+Every downloaded (scene, band) pair is appended to a journal in the download directory, so running the same
+manifest again after an interruption only fetches the pairs that are missing.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .common import create_session, string_types, DEFAULT_POOL_SIZE
+from .download import download_each
+from .metrics import FETCH
+from .landsat8 import Landsat8
+from .sentinel2 import Sentinel2
+
+logger = logging.getLogger('sdownloader')
+
+JOURNAL_FILENAME = '.sdownloader-journal.jsonl'
+
+SATELLITES = {
+    'landsat8': Landsat8,
+    'sentinel2': Sentinel2,
+}
+
+
+def _parse_band(band):
+    band = str(band).strip()
+    return int(band) if band.isdigit() else band
+
+
+def guess_satellite(scene):
+    """ Landsat8 product IDs are 40 characters long and start with L, everything else is taken for Sentinel2 """
+    if len(scene) == 40 and scene.startswith('L'):
+        return 'landsat8'
+    return 'sentinel2'
+
+
+def read_manifest(path):
+    """ Reads download jobs from a CSV or a JSON lines manifest.
+    :param path:
+        Path to the manifest
+    :type path:
+        String
+    :returns:
+        (List) of (scene, bands, satellite) tuples, satellite is None when the manifest doesn't set it
+    """
+    with open(path) as f:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for row in rows:
+        bands = row.get('bands') or []
+        if isinstance(bands, string_types):
+            bands = bands.replace(';', ' ').split()
+        jobs.append((row['scene'].strip(), [_parse_band(band) for band in bands], row.get('satellite') or None))
+    return jobs
+
+
+class Journal(object):
+    """ Append-only JSON lines record of downloaded (scene, band) pairs """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+
+        ends_with_newline = True
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    ends_with_newline = line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of an interrupted run may be cut short
+                        continue
+                    self._done.add((entry['scene'], str(entry['band'])))
+
+        self._file = open(path, 'a')
+        if not ends_with_newline:
+            self._file.write('\n')
+
+    def __contains__(self, unit):
+        scene, band = unit
+        return (scene, str(band)) in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def record(self, scene, band, path):
+        self._file.write(json.dumps({'scene': scene, 'band': band, 'path': path}) + '\n')
+        self._file.flush()
+        self._done.add((scene, str(band)))
+
+    def close(self):
+        self._file.close()
+
+
+class Summary(object):
+    """ Counts what a batch run downloaded, skipped and failed """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        # (scene, url, exception) triples, url is None when the whole scene failed
+        self.errors = []
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def transferred(self, event):
+        """ Listener of the downloaders, counts the bytes of the fetches """
+        if event.kind == FETCH and event.bytes:
+            with self._lock:
+                self.bytes += event.bytes
+
+    @property
+    def seconds(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """ Bytes per second """
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def report(self, stream=sys.stdout):
+        stream.write('Downloaded {0} files ({1:.1f} MiB) in {2:.1f} s, {3:.2f} MiB/s\n'.format(
+            self.files, self.bytes / 1048576.0, self.seconds, self.throughput / 1048576.0))
+        if self.skipped:
+            stream.write('Skipped {0} files that are already in the journal\n'.format(self.skipped))
+        if self.errors:
+            stream.write('{0} failures:\n'.format(len(self.errors)))
+            for scene, url, error in self.errors:
+                stream.write('  {0} {1}: {2!r}\n'.format(scene, url or '', error))
+
+
+def run(jobs, download_dir, journal, satellite=None, **options):
+    """ Downloads the (scene, band) pairs of the jobs that are not in the journal yet.
+    :param jobs:
+        (scene, bands, satellite) tuples as returned by read_manifest
+    :type jobs:
+        List
+    :param journal:
+        Journal the downloaded pairs are recorded to
+    :type journal:
+        Journal
+    :param satellite:
+        Satellite of the jobs that don't set it, guessed from the scene name by default
+    :type satellite:
+        String
+    :param options:
+        Keyword arguments of the Landsat8 and Sentinel2 constructors
+    :returns:
+        Summary
+    """
+    summary = Summary()
+    downloaders = {}
+
+    # files that are already on disk don't count as downloaded bytes
+    listener = options.pop('listener', None)
+
+    def count(event):
+        summary.transferred(event)
+        if listener is not None:
+            listener(event)
+
+    options['listener'] = count
+
+    # scenes grouped by satellite and by the set of bands they are missing
+    groups = OrderedDict()
+    grouped = set()
+    for index, (scene, bands, scene_satellite) in enumerate(jobs):
+        name = scene_satellite or satellite or guess_satellite(scene)
+        try:
+            if name not in SATELLITES:
+                raise ValueError('{0} - satellite is not supported'.format(name))
+            if not bands:
+                raise ValueError('no bands requested')
+            if name not in downloaders:
+                downloaders[name] = SATELLITES[name](download_dir, **options)
+            downloaders[name].scene_interpreter(scene)
+            wanted = downloaders[name].resolve_bands(bands)
+        except Exception as e:
+            logger.error('Manifest entry {0} ({1}) is skipped: {2}'.format(index, scene, e))
+            summary.errors.append((scene, None, e))
+            continue
+
+        missing = frozenset(band for band in wanted if (scene, band) not in journal)
+        summary.skipped += len(wanted) - len(missing)
+        if missing and (name, missing, scene) not in grouped:
+            grouped.add((name, missing, scene))
+            groups.setdefault((name, missing), []).append(scene)
+
+    for (name, bands), scenes in groups.items():
+        for scene_obj in download_each(downloaders[name], scenes, bands):
+            for path, band in zip(scene_obj.files, scene_obj.bands):
+                if (scene_obj.name, band) not in journal:
+                    journal.record(scene_obj.name, band, path)
+                    summary.files += 1
+            for url, error in scene_obj.errors:
+                logger.error('Failed to download {0} of {1}: {2}'.format(url or 'files', scene_obj.name, error))
+                summary.errors.append((scene_obj.name, url, error))
+
+    summary.finished = time.time()
+    return summary
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='sdownloader', description='Downloads the scenes listed in a manifest.')
+    parser.add_argument('manifest', help='CSV or JSON lines (.jsonl) file with scene and bands columns')
+    parser.add_argument('-d', '--download-dir', default='.', help='Directory the scenes are stored to')
+    parser.add_argument('-s', '--satellite', choices=sorted(SATELLITES),
+                        help='Satellite of the scenes, guessed from the scene names by default')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Number of files downloaded concurrently')
+    parser.add_argument('--connections-per-host', type=int, help='Maximum number of concurrent fetches per host')
+    parser.add_argument('--connections', type=int, default=1, help='Parallel range requests per large file')
+    parser.add_argument('--journal', help='Checkpoint journal, {0} in the download directory by default'.format(
+        JOURNAL_FILENAME))
+    parser.add_argument('--verify', action='store_true', help='Compare checksums of the downloaded files')
+    parser.add_argument('--progress', action='store_true', help='Show progress of every file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log every request')
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    if not os.path.isdir(args.download_dir):
+        os.makedirs(args.download_dir)
+
+    journal = Journal(args.journal or os.path.join(args.download_dir, JOURNAL_FILENAME))
+    try:
+        summary = run(
+            read_manifest(args.manifest), args.download_dir, journal, satellite=args.satellite,
+            show_progress=args.progress, max_workers=args.workers, max_connections_per_host=args.connections_per_host,
+            session=create_session(pool_size=max(args.workers, DEFAULT_POOL_SIZE)), connections=args.connections,
+            verify_checksums=args.verify
+        )
+    finally:
+        journal.close()
+
+    summary.report()
+    return 1 if summary.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
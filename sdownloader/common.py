@@ -1,15 +1,52 @@
+import base64
+import binascii
+import hashlib
 import logging
 import os.path as _path
 import re
-from os import makedirs
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from os import makedirs, remove, rename
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 
 import requests
 from homura import download
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
-from .errors import RemoteFileDoesntExist
+from .errors import RemoteFileDoesntExist, ChecksumMismatch
+from .integrity import update_from_file, hash_file, write_checksum
+from .metrics import PROBE, FETCH, emit, response_retries
+from .throttle import NORMAL
 
 logger = logging.getLogger('sdownloader')
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+SEGMENTS_SUFFIX = '.segments'
+SEGMENT_SIZE = 16 * 1024 * 1024
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    # Python 3
+    string_types = (str,)
+
 
 def check_create_folder(folder_path):
     """ Check whether a folder exists, if not the folder is created.
@@ -26,39 +63,276 @@ def check_create_folder(folder_path):
     return folder_path
 
 
-def get_remote_file_size(url):
+# retries of the request a thread is sending, counted by _CountingRetry
+_retry_count = threading.local()
+
+
+class _CountingRetry(Retry):
+    """ Retry that counts the retries of the request being sent. urllib3 replaces the Retry object of a request
+    on every retry, so the count is kept per thread rather than on the object.
+    """
+
+    def increment(self, *args, **kwargs):
+        _retry_count.value = getattr(_retry_count, 'value', 0) + 1
+        return super(_CountingRetry, self).increment(*args, **kwargs)
+
+
+class _CountingAdapter(HTTPAdapter):
+    """ Adapter that tells the number of retries of a request in the ``retries`` attribute of its response """
+
+    def send(self, request, **kwargs):
+        _retry_count.value = 0
+        response = super(_CountingAdapter, self).send(request, **kwargs)
+        response.retries = _retry_count.value
+        return response
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+                   backoff_factor=DEFAULT_BACKOFF_FACTOR):
+    """ Creates an http session that keeps connections alive and reuses them between requests.
+    :param pool_size:
+        Maximum number of connections kept open to a single host
+    :type pool_size:
+        int
+    :param max_retries:
+        Number of retries of failed connections and 5xx responses
+    :type max_retries:
+        int
+    :param backoff_factor:
+        Retries sleep for backoff_factor * (2 ^ (retry number - 1)) seconds
+    :type backoff_factor:
+        float
+    :returns:
+        (requests.Session) pooled session
+    """
+    retries = _CountingRetry(total=max_retries, backoff_factor=backoff_factor,
+                             status_forcelist=(500, 502, 503, 504))
+    adapter = _CountingAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """ Returns the session shared by all the calls that were not given their own session """
+    global _default_session
+
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = create_session()
+        return _default_session
+
+
+class RemoteMetadata(namedtuple('RemoteMetadata', ['url', 'status', 'content_length', 'etag', 'last_modified',
+                                                   'md5'])):
+    """ Attributes of a remote file answered by a single request """
+
+    __slots__ = ()
+
+    def __new__(cls, url, status, content_length, etag, last_modified, md5=None):
+        return super(RemoteMetadata, cls).__new__(cls, url, status, content_length, etag, last_modified, md5)
+
+    @classmethod
+    def from_response(cls, url, response):
+        return cls.from_headers(url, response.status_code, response.headers)
+
+    @classmethod
+    def from_headers(cls, url, status, headers):
+        content_length = headers.get('content-length')
+        etag = headers.get('etag')
+        etag = etag.strip('"') if etag else None
+        return cls(
+            url=url,
+            status=status,
+            content_length=int(content_length) if content_length is not None else None,
+            etag=etag,
+            last_modified=headers.get('last-modified'),
+            md5=_remote_md5(etag, headers.get('x-goog-hash'))
+        )
+
+    @property
+    def exists(self):
+        return self.status == 200
+
+
+def _remote_md5(etag, goog_hash):
+    """ Hex MD5 of a remote file told by GCS x-goog-hash or a S3 ETag of a single part upload """
+    if goog_hash:
+        for item in goog_hash.split(','):
+            name, _, value = item.strip().partition('=')
+            if name == 'md5':
+                return binascii.hexlify(base64.b64decode(value)).decode('ascii')
+
+    # ETags of multipart uploads contain a dash and aren't checksums of the content
+    if etag and re.match('^[0-9a-f]{32}$', etag):
+        return etag
+
+    return None
+
+
+def get_remote_metadata(url, session=None, cache=None, throttle=None, listener=None):
+    """ Gets status, size, ETag and modification date of a remote file with one HEAD request.
+    :param url:
+        The url that has to be checked.
+    :type url:
+        String
+    :param session:
+        Http session to send the request with. The shared session is used by default.
+    :type session:
+        requests.Session
+    :param cache:
+        Cache of earlier probes, asked before the request is sent
+    :type cache:
+        sdownloader.cache.MetadataCache
+    :param throttle:
+        Rate limiter the request has to pass
+    :type throttle:
+        sdownloader.throttle.Throttle
+    :param listener:
+        Callable that receives a sdownloader.metrics.Event of the request
+    :type listener:
+        Callable
+    :returns:
+        RemoteMetadata
+    """
+    if cache is not None:
+        remote = cache.get(url)
+        if remote is not None:
+            return remote
+
+    if throttle is not None:
+        throttle.request(url)
+
+    started = time.time()
+    try:
+        response = (session or get_session()).head(url)
+    except Exception as e:
+        emit(listener, PROBE, url, started, error=e)
+        raise
+    emit(listener, PROBE, url, started, status=response.status_code, retries=response_retries(response))
+
+    remote = RemoteMetadata.from_response(url, response)
+    if cache is not None:
+        cache.set(remote)
+    return remote
+
+
+def get_remote_file_size(url, session=None):
     """ Gets the filesize of a remote file.
     :param url:
         The url that has to be checked.
     :type url:
         String
+    :param session:
+        Http session to send the request with. The shared session is used by default.
+    :type session:
+        requests.Session
     :returns:
         int
     """
-    headers = requests.head(url).headers
-    return int(headers['content-length'])
+    return get_remote_metadata(url, session=session).content_length
 
 
-def remote_file_exists(url):
+def remote_file_exists(url, session=None, cache=None, throttle=None, listener=None):
         """ Checks whether the remote file exists.
         :param url:
             The url that has to be checked.
         :type url:
             String
+        :param session:
+            Http session to send the request with. The shared session is used by default.
+        :type session:
+            requests.Session
+        :param cache:
+            Cache of earlier probes, asked before the request is sent
+        :type cache:
+            sdownloader.cache.MetadataCache
+        :param throttle:
+            Rate limiter the request has to pass
+        :type throttle:
+            sdownloader.throttle.Throttle
+        :param listener:
+            Callable that receives a sdownloader.metrics.Event of the request
+        :type listener:
+            Callable
         :returns:
-            **True** if remote file exists and **False** if it doesn't exist.
+            (RemoteMetadata) metadata of the file if it exists, otherwise RemoteFileDoesntExist is raised.
         """
-        status = requests.head(url).status_code
+        remote = get_remote_metadata(url, session=session, cache=cache, throttle=throttle, listener=listener)
 
-        if status == 200:
-            return True
+        if remote.exists:
+            return remote
         else:
             raise RemoteFileDoesntExist
 
 
+class HostLimiter(object):
+    """ Limits the number of simultaneous connections to every single host """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @contextmanager
+    def slot(self, url):
+        """ Blocks until a connection slot to the url's host is free.
+        :param url:
+            The url that is going to be requested.
+        :type url:
+            String
+        """
+        if not self.limit:
+            yield
+            return
+
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            semaphore = self._semaphores[host]
+
+        with semaphore:
+            yield
+
+
+# Columns of parsed scene names and (index, message) pairs of the names that couldn't be parsed
+ParsedScenes = namedtuple('ParsedScenes', ['columns', 'errors'])
+
+
+def columns_to_array(columns, dtypes):
+    """ Converts equally long columns to a NumPy structured array. NumPy is only needed by this function.
+    :param columns:
+        Lists of values by column name
+    :type columns:
+        OrderedDict
+    :param dtypes:
+        NumPy dtype of every column, 'U' makes a unicode column as wide as its longest value
+    :type dtypes:
+        dict
+    :returns:
+        numpy.ndarray
+    """
+    import numpy
+
+    fields = []
+    for name, values in columns.items():
+        dtype = dtypes[name]
+        if dtype == 'U':
+            dtype = 'U{0}'.format(max([len(value) for value in values] or [1]))
+        fields.append((name, dtype))
+
+    array = numpy.empty(len(next(iter(columns.values()), [])), dtype=fields)
+    for name, values in columns.items():
+        array[name] = values
+    return array
+
+
 def remove_slash(value):
     """ Removes slash from beginning and end of a string """
-    assert isinstance(value, (str, unicode))
+    assert isinstance(value, string_types)
     return re.sub('(^\/|\/$)', '', value)
 
 
@@ -69,7 +343,9 @@ def url_builder(segments):
     return "/".join([remove_slash(s) for s in segments])
 
 
-def fetch(url, path, show_progress=False):
+def fetch(url, path, show_progress=False, session=None, remote=None, connections=1, segment_size=SEGMENT_SIZE,
+          segment_threshold=SEGMENT_THRESHOLD, verify=False, throttle=None, priority=NORMAL, listener=None,
+          store=None):
     """ Downloads a given url to a give path.
     :param url:
         The url to be downloaded.
@@ -83,6 +359,53 @@ def fetch(url, path, show_progress=False):
         Pass true if you want to observe download progress
     :type show_progress:
         bool
+    :param session:
+        Http session to download the file with. Without a session the file is downloaded by homura.
+    :type session:
+        requests.Session
+    :param remote:
+        Metadata of the url from an earlier probe. Saves another HEAD request for files that already exist.
+        Without it a file that isn't on the system yet is streamed over the session with a GET request alone,
+        a 404 response raises RemoteFileDoesntExist. Downloaders always pass the metadata of their plans.
+    :type remote:
+        RemoteMetadata
+    :param connections:
+        Number of parallel Range requests used to download files larger than segment_threshold.
+        Segmented downloads require a session.
+    :type connections:
+        int
+    :param segment_size:
+        Size in bytes of a single Range request of a segmented download
+    :type segment_size:
+        int
+    :param segment_threshold:
+        Files of this size in bytes and larger are downloaded in segments
+    :type segment_threshold:
+        int
+    :param verify:
+        Pass true to compute the MD5 checksum of the file while it is downloaded, compare it to the remote
+        checksum and store it next to the file (see sdownloader.integrity)
+    :type verify:
+        bool
+    :param throttle:
+        Rate limiter the requests and received bytes have to pass. Files of hosts with a bandwidth limit are
+        streamed over the shared session instead of being downloaded by homura, which can't be limited.
+    :type throttle:
+        sdownloader.throttle.Throttle
+    :param priority:
+        Priority of the file's requests waiting for the throttle, see sdownloader.throttle
+    :type priority:
+        int
+    :param listener:
+        Callable that receives sdownloader.metrics.Event objects of the probe and the transfer.
+        Status and retries of a transfer are only known when the file is streamed over a session.
+    :type listener:
+        Callable
+    :param store:
+        Blob store shared by download directories, a file that is already in the store is linked instead of
+        downloaded, a downloaded file is added to it
+    :type store:
+        sdownloader.store.BlobStore
     :returns:
         Downloaded file path
     """
@@ -93,13 +416,247 @@ def fetch(url, path, show_progress=False):
     # remove query parameters from the filename
     filename = filename.split('?')[0]
 
-    if _path.exists(_path.join(path, filename)):
-        size = _path.getsize(_path.join(path, filename))
-        if size == get_remote_file_size(url):
-            logger.info('{0} already exists on your system'.format(filename))
+    file_path = _path.join(path, filename)
+    options = dict(show_progress=show_progress, session=session, connections=connections, segment_size=segment_size,
+                   segment_threshold=segment_threshold, verify=verify, throttle=throttle, priority=priority,
+                   listener=listener)
+
+    if store is None:
+        return _fetch_file(url, file_path, remote, **options)
+
+    if remote is None:
+        remote = get_remote_metadata(url, session=session, throttle=throttle, listener=listener)
+    if not remote.exists:
+        return _fetch_file(url, file_path, remote, **options)
+
+    with store.lock(remote):
+        if store.link(remote, file_path, verify=verify):
+            logger.info('{0} is linked from the blob store'.format(filename))
+            return file_path
+
+        _fetch_file(url, file_path, remote, **options)
+        store.add(remote, file_path)
+    return file_path
 
+
+def keep_existing_file(file_path, remote):
+    """ Decides whether a file that exists on the system is kept or resumed. A file that is smaller than the
+    remote one is moved to the partial file, so its download is resumed.
+    :param file_path:
+        Path of the existing file
+    :type file_path:
+        String
+    :param remote:
+        Metadata of the remote file
+    :type remote:
+        RemoteMetadata
+    :returns:
+        (bool) True when the file is kept as it is
+    """
+    filename = _path.basename(file_path)
+    part_path = file_path + PART_SUFFIX
+    size = _path.getsize(file_path)
+
+    if size == remote.content_length:
+        logger.info('{0} already exists on your system'.format(filename))
+        return True
+    if not remote.exists or remote.content_length is None or remote.content_length < size:
+        # nothing tells that the local file is incomplete, so it is kept as it is
+        logger.warning('{0} exists on your system and its remote size is unknown or smaller, it is kept'.format(
+            filename))
+        return True
+
+    # a truncated file is resumed like a partial download
+    logger.info('{0} is incomplete, resuming the download'.format(filename))
+    if _path.exists(part_path):
+        remove(file_path)
     else:
-        download(url, path, show_progress=show_progress)
-    logger.info('stored at {0}'.format(path))
+        rename(file_path, part_path)
+    return False
+
+
+def _fetch_file(url, file_path, remote, show_progress, session, connections, segment_size, segment_threshold, verify,
+                throttle, priority, listener):
+    filename = _path.basename(file_path)
+    part_path = file_path + PART_SUFFIX
+
+    if _path.exists(file_path):
+        if remote is None:
+            remote = get_remote_metadata(url, session=session, throttle=throttle, listener=listener)
+        if keep_existing_file(file_path, remote):
+            return file_path
+
+    if session is None and throttle is not None and throttle.limits_bytes(url):
+        session = get_session()
+
+    if session is not None and connections > 1 and remote is None:
+        remote = get_remote_metadata(url, session=session, throttle=throttle, listener=listener)
+    segmented = (session is not None and connections > 1 and remote.content_length is not None and
+                 remote.content_length >= segment_threshold)
+
+    digest = hashlib.md5() if verify else None
+    streamed = False
+
+    offset = _path.getsize(part_path) if _path.exists(part_path) else 0
+    started = time.time()
+    response = None
+
+    try:
+        if remote is not None and _path.exists(part_path) and offset == remote.content_length:
+            logger.info('{0} has been completely downloaded before'.format(filename))
+            started = None
+        elif segmented and _stream_segments(url, part_path, session, remote.content_length, connections,
+                                            segment_size, throttle=throttle, priority=priority, etag=remote.etag):
+            # segments are written to a separate file that replaces the partial one
+            offset = 0
+        elif session is not None:
+            response = _stream(url, part_path, session, show_progress=show_progress, digest=digest,
+                               throttle=throttle, priority=priority)
+            streamed = True
+        else:
+            if throttle is not None:
+                throttle.request(url, priority)
+            # homura resumes a partially written file by itself
+            download(url, part_path, show_progress=show_progress)
+    except Exception as e:
+        emit(listener, FETCH, url, started, error=e)
+        raise
+
+    if started is not None:
+        emit(listener, FETCH, url, started, bytes=max(_path.getsize(part_path) - offset, 0),
+             status=response.status_code if response is not None else None,
+             retries=response_retries(response))
+
+    if verify:
+        # files that weren't streamed through the digest are hashed once they are complete
+        checksum = digest.hexdigest() if streamed else hash_file(part_path)
+        if remote is not None and remote.md5 is not None and checksum != remote.md5:
+            remove(part_path)
+            raise ChecksumMismatch('{0} checksum {1} differs from remote {2}'.format(filename, checksum, remote.md5))
+        write_checksum(file_path, checksum)
+
+    rename(part_path, file_path)
+    logger.info('stored at {0}'.format(_path.dirname(file_path)))
+
+    return file_path
+
+
+def _stream(url, file_path, session, show_progress=False, digest=None, throttle=None, priority=NORMAL):
+    """ Downloads a url to a file over a pooled session connection.
+    A partially written file is completed with a Range request for the missing bytes.
+    Every byte of the file is fed to the digest if one is given.
+    :returns:
+        The response the file was completed by
+    """
+    offset = _path.getsize(file_path) if _path.exists(file_path) else 0
+    headers = {'Range': 'bytes={0}-'.format(offset)} if offset else {}
+
+    if throttle is not None:
+        throttle.request(url, priority)
+    response = session.get(url, stream=True, headers=headers)
+    if response.status_code == 404:
+        raise RemoteFileDoesntExist
+    if response.status_code == 416:
+        # nothing is left past the offset, the partial file is either complete or stale
+        if response.headers.get('content-range') == 'bytes */{0}'.format(offset):
+            if digest is not None:
+                update_from_file(digest, file_path)
+            return response
+        remove(file_path)
+        return _stream(url, file_path, session, show_progress=show_progress, digest=digest, throttle=throttle,
+                       priority=priority)
+    response.raise_for_status()
+
+    if response.status_code != 206:
+        # the server ignored the range, so the file is written from scratch
+        offset = 0
+    elif digest is not None:
+        update_from_file(digest, file_path)
+
+    total = offset + int(response.headers.get('content-length', 0))
+    downloaded = offset
+
+    with open(file_path, 'ab' if offset else 'wb') as f:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            f.write(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            if throttle is not None:
+                throttle.transfer(url, len(chunk), priority)
+            downloaded += len(chunk)
+            if show_progress and total:
+                sys.stderr.write('{0:6d}% {1:>14d} bytes\r'.format(downloaded * 100 // total, downloaded))
+                sys.stderr.flush()
+
+    if show_progress:
+        sys.stderr.write('\n')
+
+    return response
+
+
+def _stream_segments(url, file_path, session, size, connections, segment_size, throttle=None, priority=NORMAL,
+                     etag=None):
+    """ Downloads byte ranges of a url in parallel, writing each at its offset of a preallocated file.
+    With an ETag every range has to come from the same version of the file.
+    :returns:
+        **False** if the server doesn't serve byte ranges, so the file has to be downloaded in one piece.
+    """
+    # a preallocated file can't be resumed by its size, so it is kept apart from partial downloads
+    segments_path = file_path + SEGMENTS_SUFFIX
+    with open(segments_path, 'wb') as f:
+        f.truncate(size)
+
+    ranges = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+    pool = ThreadPool(min(connections, len(ranges)))
+    try:
+        served = pool.map(lambda r: _stream_range(url, segments_path, session, r[0], r[1], throttle, priority, etag),
+                          ranges)
+    except Exception:
+        # the preallocated file is as large as the whole file, it isn't left behind
+        try:
+            remove(segments_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+    if not all(served):
+        remove(segments_path)
+        return False
+
+    rename(segments_path, file_path)
+    return True
+
+
+def _stream_range(url, file_path, session, start, end, throttle=None, priority=NORMAL, etag=None):
+    """ Writes bytes start-end (inclusive) of a url at the same offset of a file """
+    headers = {'Range': 'bytes={0}-{1}'.format(start, end)}
+    if etag:
+        headers['If-Match'] = '"{0}"'.format(etag)
+
+    if throttle is not None:
+        throttle.request(url, priority)
+    response = session.get(url, stream=True, headers=headers)
+    if response.status_code == 404:
+        raise RemoteFileDoesntExist
+    if response.status_code == 412:
+        raise IOError('{0} changed while its segments were downloaded'.format(url))
+    response.raise_for_status()
+    if response.status_code != 206:
+        response.close()
+        return False
+
+    with open(file_path, 'r+b') as f:
+        f.seek(start)
+        for chunk in response.iter_content(CHUNK_SIZE):
+            f.write(chunk)
+            if throttle is not None:
+                throttle.transfer(url, len(chunk), priority)
+
+        if f.tell() != end + 1:
+            raise IOError('Incomplete segment {0}-{1} of {2}'.format(start, end, url))
 
-    return _path.join(path, filename)
+    return True
@@ -1,67 +1,216 @@
 import abc
 import os
 import logging
-
-from .common import remote_file_exists, check_create_folder, fetch
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+
+import requests
+
+from .common import remote_file_exists, check_create_folder, fetch, string_types
+from .integrity import read_checksum
+from .listing import LISTING
+from .metrics import FETCH, FOLDER, emit
+from .remote_file import RemoteFile
+from .throttle import HIGH, NORMAL
 
 logger = logging.getLogger('sdownloader')
 
+AMAZON_S3_STORAGE = 'amazon'
+GOOGLE_PUBLIC_DATA_STORAGE_SERVICE = 'gcloud'
+
+# files are (band, RemoteMetadata) pairs of a scene that are going to be stored in the folder,
+# source is None when files come from different sources
+DownloadPlan = namedtuple('DownloadPlan', ['scene', 'folder', 'files', 'source'])
+
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    # Python 2 interns byte strings only
+    def _intern(value):
+        return intern(value) if type(value) is str else value
+
+# Bands are stored in scenes as indexes of this list
+_band_values = []
+_band_codes = {}
+_band_lock = threading.Lock()
+
+
+def _band_code(band):
+    if band is None:
+        return -1
+
+    code = _band_codes.get(band)
+    if code is None:
+        with _band_lock:
+            code = _band_codes.get(band)
+            if code is None:
+                code = _band_codes[band] = len(_band_values)
+                _band_values.append(band)
+    return code
+
 
 class Scene(object):
+    """ Downloaded files of a scene.
 
-    def __init__(self, name, files=None):
-        self.name = name
-        self.files = []
+    Files that share a folder are kept as an interned parent folder, the folder name and interned file name
+    suffixes, e.g. '_B4.TIF' of 'LC08_..._B4.TIF' when the folder is named like the file prefix. Bands are kept
+    as small ints. ``files`` and ``bands`` build the full lists on access.
+    """
 
-        if isinstance(files, str):
-            self.add(files)
+    __slots__ = ('name', 'errors', '_root', '_folder', '_prefix', '_entries', '_band_ids')
+
+    def __init__(self, name, files=None, errors=None, bands=None):
+        self.name = name
+        # (url, exception) pairs of files that failed to download
+        self.errors = errors or []
+        # parent of the files' folder, None once the files don't share a folder and entries are full paths
+        self._root = ''
+        # folder name, None when it is the scene name
+        self._folder = None
+        # start of every file name that is left out of the entries
+        self._prefix = ''
+        self._entries = []
+        self._band_ids = array('h')
+
+        if isinstance(files, string_types):
+            self.add(files, bands)
         elif isinstance(files, list):
-            for f in files:
-                self.add(f)
+            for f, band in zip(files, bands or [None] * len(files)):
+                self.add(f, band)
+
+    def __getstate__(self):
+        return self.name, self.errors, self.files, self.bands
+
+    def __setstate__(self, state):
+        name, errors, files, bands = state
+        self.__init__(name, files, errors, bands)
+
+    def _folder_path(self):
+        return os.path.join(self._root, self.name if self._folder is None else self._folder)
 
-    def add(self, f):
-        self.files.append(f)
+    @property
+    def files(self):
+        if self._root is None:
+            return list(self._entries)
+
+        folder = self._folder_path()
+        return [os.path.join(folder, self._prefix + entry) for entry in self._entries]
+
+    @property
+    def bands(self):
+        """ Band of every file, None where it is unknown """
+        return [_band_values[code] if code >= 0 else None for code in self._band_ids]
+
+    def add(self, f, band=None):
+        if self._root is not None:
+            folder, filename = os.path.split(f)
+            if not self._entries:
+                root, name = os.path.split(folder)
+                self._root = _intern(root)
+                self._folder = None if name == self.name else name
+                self._prefix = name if name and filename.startswith(name) else ''
+
+            if folder == self._folder_path() and filename.startswith(self._prefix) and \
+                    os.path.join(folder, filename) == f:
+                f = _intern(filename[len(self._prefix):])
+            else:
+                self._entries = self.files
+                self._root = None
+
+        self._entries.append(f)
+        self._band_ids.append(_band_code(band))
 
     def __str__(self):
         return self.name
 
 
 class Scenes(object):
+    """ Scenes in insertion order, also looked up by name.
+
+    Names are indexed lazily on the first lookup after scenes were added, so adding and merging
+    only append references.
+    """
 
     def __init__(self, scenes=[]):
-        self.scenes_dict = {}
-        self.scenes_list = []
+        self._scenes = []
+        # position of the last scene of every name, up to the _indexed first scenes
+        self._positions = {}
+        self._indexed = 0
+        # (scene name, url, exception) triples gathered by concurrent downloads
+        self.errors = []
         for scene in scenes:
             self.add(self.validate(scene))
 
+    @classmethod
+    def concat(cls, scenes_objs):
+        """ Joins many Scenes into one """
+        result = cls()
+        for scenes in scenes_objs:
+            result.merge(scenes)
+        return result
+
+    def _index(self):
+        for position in range(self._indexed, len(self._scenes)):
+            self._positions[self._scenes[position].name] = position
+        self._indexed = len(self._scenes)
+        return self._positions
+
+    @property
+    def scenes_list(self):
+        return self._scenes
+
+    @property
+    def scenes_dict(self):
+        return dict((name, self._scenes[position]) for name, position in self._index().items())
+
     def __getitem__(self, key):
         if isinstance(key, int):
-            return self.scenes_list[key]
-        elif isinstance(key, (str, unicode)):
-            return self.scenes_dict[key]
+            return self._scenes[key]
+        elif isinstance(key, string_types):
+            return self._scenes[self._index()[key]]
         else:
             raise Exception('Key is not supported.')
 
     def __setitem__(self, key, value):
         if isinstance(key, int):
-            self.scenes_list[key] = self.validate(value)
-        elif isinstance(key, str):
-            self.scenes_dict[key] = self.validate(value)
+            if self._scenes[key].name != self.validate(value).name:
+                # the replaced name may be found elsewhere, so everything is indexed again
+                self._positions = {}
+                self._indexed = 0
+            self._scenes[key] = value
+        elif isinstance(key, string_types):
+            positions = self._index()
+            if key in positions:
+                self._scenes[positions[key]] = self.validate(value)
+            else:
+                self.add(value)
         else:
             raise Exception('Key is not supported.')
 
+    def __contains__(self, name):
+        return name in self._index()
+
+    def __iter__(self):
+        return iter(self._scenes)
+
     def __len__(self):
-        return len(self.scenes_dict.keys())
+        return len(self._index())
 
     def __str__(self):
         return '[Scenes]: Includes %s scenes' % len(self)
 
     def add(self, scene):
-        self.scenes_list.append(self.validate(scene))
-        self.scenes_dict[scene.name] = scene
+        self._scenes.append(self.validate(scene))
 
-    def add_with_files(self, name, files):
-        self.add(Scene(name, files))
+    def add_with_files(self, name, files, bands=None):
+        self.add(Scene(name, files, bands=bands))
 
     def validate(self, scene):
         if not isinstance(scene, Scene):
@@ -73,18 +222,61 @@ class Scenes(object):
         if not isinstance(scenes, Scenes):
             raise Exception('scenes must be an instance of Scenes')
 
-        for s in scenes:
-            self.add(s)
+        self._scenes.extend(scenes._scenes)
+        self.errors.extend(scenes.errors)
 
     @property
     def scenes(self):
         return [s.name for s in self]
 
 
+class _Landed(object):
+    """ A file without stages, it is final as soon as it is fetched """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self):
+        return self.path
+
+
+def download_each(downloader, scenes, bands):
+    """ Yields the downloaded scenes of a Landsat8 or Sentinel2 downloader. A scene that fails as a whole is yielded
+    with the error instead of stopping the other scenes.
+    """
+    if downloader.max_workers <= 1:
+        for scene in scenes:
+            yield _download_scene(downloader, scene, bands)
+        return
+
+    yielded = set()
+    try:
+        for scene_obj in downloader.iter_download(scenes, bands):
+            yielded.add(scene_obj.name)
+            yield scene_obj
+    except Exception as e:
+        # the failed scene isn't known, so the scenes that are left are downloaded one by one
+        logger.warning('Concurrent download failed: {0}, the other scenes are downloaded one by one'.format(e))
+        for scene in scenes:
+            if scene not in yielded:
+                yield _download_scene(downloader, scene, bands)
+
+
+def _download_scene(downloader, scene, bands):
+    """ A scene that fails as a whole is returned with the error """
+    try:
+        return next(downloader.iter_download([scene], bands))
+    except Exception as e:
+        return Scene(scene, errors=[(None, e)])
+
+
 class S3DownloadMixin(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # bands fetched with a high priority
+    _PRIORITY_BANDS = frozenset()
+
     def s3(self, scenes, bands):
         """
         Amazon S3 downloader
@@ -92,35 +284,353 @@ class S3DownloadMixin(object):
         if not isinstance(scenes, list):
             raise Exception('Expected scene list')
 
-        scene_objs = Scenes()
-
         logger.info('Source: AWS S3')
-        for scene in scenes:
-            files = []
 
-            path = self.scene_interpreter(scene)
+        catalogued = dict((scene, self._catalogued(scene, bands)) for scene in scenes)
+        pending = [scene for scene in scenes if catalogued[scene] is None]
+
+        if not self._concurrent:
+            downloaded = self._execute([self._s3_plan(scene, bands) for scene in pending])
+            failed = []
+        else:
+            # scenes that can't be planned are reported in Scenes.errors like failed files
+            planned = self._map(lambda scene: self._try_plan(self._s3_plan, scene, bands), pending)
+            downloaded = self._execute([plan for plan, error in planned if error is None])
+            failed = [(scene, error) for scene, (_, error) in zip(pending, planned) if error is not None]
+
+        if len(pending) == len(scenes) and not failed:
+            return downloaded
+
+        scene_objs = Scenes([catalogued[scene] or downloaded[scene] for scene in scenes
+                             if catalogued[scene] is not None or scene in downloaded])
+        scene_objs.errors.extend(downloaded.errors)
+        scene_objs.errors.extend((scene, None, error) for scene, error in failed)
+        return scene_objs
+
+    @staticmethod
+    def _try_plan(plan, scene, bands):
+        """ Plans a scene.
+        :returns:
+            (Tuple) the plan and **None**, or **None** and the exception of the scene
+        """
+        try:
+            return plan(scene, bands), None
+        except Exception as e:
+            logger.error('Failed to plan {0}: {1}'.format(scene, e))
+            return None, e
+
+    def _s3_plan(self, scene, bands):
+        """ Checks that every band of the scene exists on S3. In HEAD discovery mode every band is probed with a
+        HEAD request before anything is fetched, so a scene with a missing band fails before any of its files is
+        downloaded. The metadata is passed on to fetch, which sends no other HEAD request for the file.
+        :returns:
+            DownloadPlan
+        """
+        path = self.scene_interpreter(scene)
 
-            urls = []
+        # get urls for the bands
+        bands = list(bands)
+        urls = [self.amazon_s3_url(path, band) for band in bands]
+        listed = self._listed_files(urls)
 
-            for band in bands:
-                # get url for the band
-                url = self.amazon_s3_url(path, band)
+        files = []
 
+        for band, url in zip(bands, urls):
+            if listed is not None:
+                remote = listed[url]
+            else:
                 # make sure it exist
-                remote_file_exists(url)
-                urls.append(url)
+                remote = remote_file_exists(url, session=self.session, cache=self.cache, throttle=self.throttle,
+                                            listener=self._listener)
+            files.append((band, remote))
+
+        folder = os.path.join(self.download_dir, self._relative_product_path(path))
+        return DownloadPlan(scene, folder, files, AMAZON_S3_STORAGE)
+
+    def open_band(self, scene, band, **options):
+        """ Opens a band on S3 for reading without downloading it, see sdownloader.remote_file.RemoteFile
+        for the options. Only the blocks that are read are fetched.
+        :returns:
+            sdownloader.remote_file.RemoteFile
+        """
+        return self._open_url(self.amazon_s3_url(self.scene_interpreter(scene), band), **options)
+
+    def _open_url(self, url, **options):
+        remote = remote_file_exists(url, session=self.session, cache=self.cache, throttle=self.throttle,
+                                    listener=self._listener)
+        return RemoteFile(url, session=self.session, remote=remote, throttle=self.throttle, listener=self._listener,
+                          **options)
+
+    def list_folder(self, url_prefix):
+        """ Lists every file under a folder of the bucket in bulk, e.g. a Landsat8 path/row folder
+        (Landsat8.S3_LANDSAT_BASE_URL + 'L8/012/029/') or a Sentinel2 tile (Sentinel2.S3_SENTINEL + 'tiles/34/R/CS/').
+        In listing discovery mode plans of scenes inside a listed folder don't send any more requests.
+        :param url_prefix:
+            Url of the folder
+        :type url_prefix:
+            String
+        :returns:
+            (Dict) RemoteMetadata by file url
+        """
+        return self._index.list(url_prefix, session=self.session, throttle=self.throttle, listener=self._listener)
 
-            folder = os.path.join(self.download_dir, self._relative_product_path(path))
-            # create folder
-            check_create_folder(folder)
+    def _listed_files(self, urls):
+        """ RemoteMetadata of the urls from a listing of their folder in listing discovery mode.
+        :returns:
+            (Dict) RemoteMetadata by url or **None** when the files have to be probed one by one
+        """
+        if self.discovery != LISTING:
+            return None
+
+        try:
+            return dict(zip(urls, self._index.files(urls, session=self.session, throttle=self.throttle,
+                                                    listener=self._listener)))
+        except (requests.RequestException, ElementTree.ParseError, ValueError) as e:
+            # buckets that deny listing are probed file by file
+            logger.warning('Listing of {0} failed, probing the files: {1}'.format(urls[0], e))
+            return None
+
+    def _execute(self, plans):
+        """ Fetches the files of planned scenes.
+
+        With ``max_workers`` greater than one all (scene, file) pairs are fetched by a thread pool and
+        failed files are gathered into ``Scenes.errors`` instead of stopping the whole batch.
+        Priority bands of all scenes are fetched first, then the scenes take turns file by file.
+        :param plans:
+            A list of DownloadPlan
+        :type plans:
+            List
+        :returns:
+            Downloaded scenes wrapper
+        """
+        with self._stages_running():
+            return self._execute_plans(plans)
 
-            for url in urls:
-                files.append(fetch(url, folder, show_progress=self.show_progress))
+    def _execute_plans(self, plans):
+        scene_objs = Scenes()
 
-            scene_objs.add_with_files(scene, files)
+        for plan in plans:
+            # create folder
+            self._create_folder(plan.folder)
+            self._catalog_scene(plan)
+
+        if not self._concurrent:
+            for plan in plans:
+                landings = [self._land(plan, band, remote, self._fetch(plan, band, remote))
+                            for band, remote in plan.files]
+                scene_objs.add_with_files(plan.scene, [landing.get() for landing in landings],
+                                          [band for band, _ in plan.files])
+            return scene_objs
+
+        jobs = [(plan, band, remote) for plan in plans for band, remote in plan.files]
+        turns = [(self._priority(band), position, index)
+                 for index, plan in enumerate(plans) for position, (band, _) in enumerate(plan.files)]
+        order = sorted(range(len(jobs)), key=lambda i: turns[i])
+
+        results = [None] * len(jobs)
+        for i, result in zip(order, self._map(self._fetch_job, [jobs[i] for i in order])):
+            results[i] = result
+        results = iter(results)
+
+        for plan in plans:
+            scene_obj = Scene(plan.scene)
+            for band, remote in plan.files:
+                path, error = self._landed(next(results), remote.url)
+                if error is None:
+                    scene_obj.add(path, band)
+                else:
+                    scene_obj.errors.append((remote.url, error))
+                    scene_objs.errors.append((plan.scene, remote.url, error))
+            scene_objs.add(scene_obj)
 
         return scene_objs
 
+    def _iter_download(self, scenes, bands, plan):
+        """ Yields every scene as soon as its files are on disk.
+
+        With ``max_workers`` greater than one scenes are downloaded concurrently and yielded in the order
+        they complete. Failures are then reported in ``Scene.errors`` instead of being raised.
+        :param plan:
+            Function that returns a DownloadPlan of a scene
+        :type plan:
+            Callable
+        """
+        def download_scene(scene):
+            catalogued = self._catalogued(scene, bands)
+            if catalogued is not None:
+                return catalogued
+
+            if not self._concurrent:
+                return self._execute([plan(scene)])[0]
+
+            try:
+                planned = plan(scene)
+            except Exception as e:
+                # one scene that can't be planned doesn't stop the other scenes
+                logger.error('Failed to plan {0}: {1}'.format(scene, e))
+                return Scene(scene, errors=[(None, e)])
+
+            self._create_folder(planned.folder)
+            self._catalog_scene(planned)
+
+            # stages of a file run while the next file of the scene is fetched
+            results = [self._fetch_job((planned, band, remote)) for band, remote in planned.files]
+
+            scene_obj = Scene(planned.scene)
+            for (band, remote), result in zip(planned.files, results):
+                path, error = self._landed(result, remote.url)
+                if error is None:
+                    scene_obj.add(path, band)
+                else:
+                    scene_obj.errors.append((remote.url, error))
+            return scene_obj
+
+        with self._stages_running():
+            if not self._concurrent:
+                for scene in scenes:
+                    yield download_scene(scene)
+                return
+
+            pool = ThreadPool(self.max_workers)
+            try:
+                for scene_obj in pool.imap_unordered(download_scene, scenes):
+                    yield scene_obj
+            finally:
+                # scenes that were not started yet are dropped when the consumer stops early
+                pool.terminate()
+                pool.join()
+
+    @contextmanager
+    def _stages_running(self):
+        """ Keeps the threads of the stages while a download runs """
+        if self._pipeline is None:
+            yield
+        else:
+            with self._pipeline.running():
+                yield
+
+    def _fetch(self, plan, band, remote):
+        with self._host_limiter.slot(remote.url):
+            path = fetch(remote.url, plan.folder, show_progress=self.show_progress, session=self.session,
+                         remote=remote, connections=self.connections, verify=self.verify_checksums,
+                         throttle=self.throttle, priority=self._priority(band), listener=self._fetch_listener,
+                         store=self.store)
+        return path
+
+    def _fetch_listener(self, event):
+        if event.kind == FETCH and event.error is None and event.bytes:
+            self._transferred(event)
+        if self.listener is not None:
+            self._listen(event)
+
+    def _transferred(self, event):
+        """ Called with the FETCH event of every file that was actually downloaded, files found on disk or linked
+        from the blob store aren't reported
+        """
+        pass
+
+    def _land(self, plan, band, remote, path):
+        """ Hands a fetched file to the stages, which run in their own pool while the next files are fetched.
+        :returns:
+            Object whose get() waits for the stages and returns the final path of the file
+        """
+        if self._pipeline is None:
+            self._catalog_file(plan, band, remote, path, path)
+            return _Landed(path)
+
+        def run_stages():
+            final_path = self._pipeline(path, band, plan.scene)
+            self._catalog_file(plan, band, remote, path, final_path)
+            return final_path
+
+        return self._pipeline.submit(run_stages)
+
+    def _landed(self, result, url):
+        """ Waits for the stages of a _fetch_job result.
+        :returns:
+            (Tuple) final path and **None**, or **None** and the exception of the fetch or a stage
+        """
+        landing, error = result
+        if error is not None:
+            return None, error
+
+        try:
+            return landing.get(), None
+        except Exception as e:
+            logger.error('Failed to process {0}: {1}'.format(url, e))
+            return None, e
+
+    def _catalog_file(self, plan, band, remote, path, final_path):
+        if self.catalog is None:
+            return
+
+        if final_path == path:
+            self.catalog.add_file(plan.scene, band, path, size=remote.content_length, etag=remote.etag,
+                                  checksum=read_checksum(path) if self.verify_checksums else None,
+                                  source=plan.source or self._url_source(remote.url))
+        else:
+            # the checksum and size of the remote file don't tell anything about the result of the stages
+            self.catalog.add_file(plan.scene, band, final_path, size=os.path.getsize(final_path),
+                                  etag=remote.etag, source=plan.source or self._url_source(remote.url))
+
+    def _create_folder(self, folder):
+        started = time.time()
+        check_create_folder(folder)
+        emit(self.listener, FOLDER, folder, started)
+
+    @property
+    def _listener(self):
+        """ Listener passed to probes and fetches, **None** when nobody listens """
+        return self._listen if self.listener is not None else None
+
+    def _listen(self, event):
+        self.listener(event._replace(source=self._url_source(event.url)))
+
+    def _priority(self, band):
+        return HIGH if band in self._PRIORITY_BANDS else NORMAL
+
+    def _url_source(self, url):
+        """ Source of a file of a plan that mixes sources """
+        return AMAZON_S3_STORAGE
+
+    def _fetch_job(self, job):
+        plan, band, remote = job
+        try:
+            return self._land(plan, band, remote, self._fetch(plan, band, remote)), None
+        except Exception as e:
+            logger.error('Failed to download {0}: {1}'.format(remote.url, e))
+            return None, e
+
+    def _catalogued(self, scene, bands):
+        """ Returns the scene if the catalog knows all its bands are on disk, otherwise **None** """
+        if self.catalog is None:
+            return None
+
+        scene_obj = self.catalog.scene(scene, bands)
+        if scene_obj is not None:
+            logger.info('{0} is already downloaded'.format(scene))
+        return scene_obj
+
+    def _catalog_scene(self, plan):
+        if self.catalog is not None:
+            self.catalog.add_scene(plan.scene, **self._scene_attributes(plan.scene))
+
+    @property
+    def _concurrent(self):
+        return self.max_workers > 1
+
+    def _map(self, func, items):
+        """ Applies func to every item using a pool of ``max_workers`` threads """
+        if not self._concurrent or len(items) < 2:
+            return [func(item) for item in items]
+
+        pool = ThreadPool(min(self.max_workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
     @classmethod
     @abc.abstractmethod
     def scene_interpreter(cls, scene_id):
@@ -135,6 +645,11 @@ class S3DownloadMixin(object):
     def _relative_product_path(self, scene_id):
         pass
 
+    @abc.abstractmethod
+    def _scene_attributes(self, scene_id):
+        """ Returns satellite, path, row, mgrs and date of a scene to be searched by in the catalog """
+        pass
+
     @abc.abstractproperty
     def download_dir(self):
         pass
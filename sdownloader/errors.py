@@ -3,6 +3,11 @@ class RemoteFileDoesntExist(Exception):
     pass
 
 
+class ChecksumMismatch(Exception):
+    """ Exception to be used when a downloaded file doesn't match its remote checksum """
+    pass
+
+
 class IncorrectLandsat8SceneId(Exception):
     """ Exception to be used when Landsat 8 scene id is incorrect """
     pass
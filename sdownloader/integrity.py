@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import mmap
+import os
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger('sdownloader')
+
+CHECKSUM_SUFFIX = '.md5'
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def update_from_file(digest, path):
+    """ Feeds the content of a file to a hashlib object using a memory-mapped read """
+    if os.path.getsize(path) == 0:
+        return digest
+
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(0, len(mapped), BLOCK_SIZE):
+                digest.update(mapped[offset:offset + BLOCK_SIZE])
+        finally:
+            mapped.close()
+
+    return digest
+
+
+def hash_file(path):
+    """ Returns the hex MD5 checksum of a file """
+    return update_from_file(hashlib.md5(), path).hexdigest()
+
+
+def checksum_path(path):
+    return path + CHECKSUM_SUFFIX
+
+
+def write_checksum(path, checksum):
+    """ Stores the checksum next to the file in md5sum format """
+    with open(checksum_path(path), 'w') as f:
+        f.write('{0}  {1}\n'.format(checksum, os.path.basename(path)))
+
+
+def read_checksum(path):
+    """ Returns the checksum stored next to the file or **None** """
+    try:
+        with open(checksum_path(path)) as f:
+            return f.read().split()[0]
+    except (IOError, OSError, IndexError):
+        return None
+
+
+def verify(download_dir, workers=4):
+    """ Re-hashes every file of a download tree that has a stored checksum.
+    :param download_dir:
+        Root of the tree to audit
+    :type download_dir:
+        String
+    :param workers:
+        Number of files hashed in parallel
+    :type workers:
+        int
+    :returns:
+        (List) paths of files that don't match their checksums
+    """
+    paths = []
+    for root, _, filenames in os.walk(download_dir):
+        for filename in filenames:
+            if filename.endswith(CHECKSUM_SUFFIX) and filename[:-len(CHECKSUM_SUFFIX)] in filenames:
+                paths.append(os.path.join(root, filename[:-len(CHECKSUM_SUFFIX)]))
+
+    def matches(path):
+        return hash_file(path) == read_checksum(path)
+
+    pool = ThreadPool(workers)
+    try:
+        results = pool.map(matches, paths)
+    finally:
+        pool.close()
+        pool.join()
+
+    corrupted = [path for path, ok in zip(paths, results) if not ok]
+    for path in corrupted:
+        logger.warning('{0} does not match its checksum'.format(path))
+    return corrupted
@@ -1,18 +1,32 @@
+import datetime
 import logging
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
 
-from sdownloader.common import url_builder
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from sdownloader.common import url_builder, string_types, ParsedScenes, columns_to_array
 from sdownloader.errors import IncorrectLandsat8SceneId
 
-from .download import S3DownloadMixin, Scenes, Scene
-from .common import check_create_folder, fetch, remote_file_exists
+from .download import (S3DownloadMixin, Scenes, DownloadPlan, AMAZON_S3_STORAGE,
+                       GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)
+from .common import check_create_folder, remote_file_exists, HostLimiter
 
 from .errors import RemoteFileDoesntExist
+from .listing import BucketIndex, HEAD, LISTING
+from .stages import Pipeline, DEFAULT_STAGE_WORKERS
+from .sources import SourceRanker, FIXED_ORDER, RANKED, RACE
 
 logger = logging.getLogger('sdownloader')
 
-AMAZON_S3_STORAGE = 'amazon'
-GOOGLE_PUBLIC_DATA_STORAGE_SERVICE = 'gcloud'
+# e.g. LC08_L1TP_012029_20170411_20170415_01_T1
+_PRODUCT_ID_PATTERN = re.compile(r'^L([A-Z])(\d{2})_\w{4}_(\d{3})(\d{3})_(\d{4})(\d{2})(\d{2})_\d{8}_\d{2}_\w{2}$')
 
 
 class Landsat8DownloaderException(Exception):
@@ -41,22 +55,87 @@ class Landsat8(S3DownloadMixin):
     }
 
     _DEFAULT_BANDS = {'QA', 'MTL', 'ANG'}
-
-    def __init__(self, download_dir, relative_product_path_builder=None, show_progress=False):
+    # small metadata files are fetched ahead of large images, so scenes become usable sooner
+    _PRIORITY_BANDS = _DEFAULT_BANDS
+
+    # NumPy dtypes of the scene_interpreter_batch columns
+    _BATCH_DTYPES = dict(index='i8', product_id='U', sensor='U1', landsat_number='i1', path='i2', row='i2',
+                         date='datetime64[D]')
+
+    def __init__(self, download_dir, relative_product_path_builder=None, show_progress=False,
+                 max_workers=1, max_connections_per_host=None, session=None, connections=1,
+                 catalog=None, cache=None, verify_checksums=False, throttle=None, source_selection=FIXED_ORDER,
+                 mixed_sources=False, ranker=None, listener=None, discovery=HEAD, stages=None,
+                 stage_workers=DEFAULT_STAGE_WORKERS, store=None):
         self._download_dir = download_dir
         self._relative_product_path_builder = relative_product_path_builder
 
         self.show_progress = show_progress
 
+        # Files are fetched concurrently when more than one worker is requested
+        self.max_workers = max_workers
+        self._host_limiter = HostLimiter(max_connections_per_host)
+
+        # Http session shared by all probes and fetches, see common.create_session
+        self.session = session
+        # Parallel Range requests per large file, used only with a session
+        self.connections = connections
+        # sdownloader.catalog.Catalog of downloaded files, lets finished scenes be skipped without network calls
+        self.catalog = catalog
+        # sdownloader.cache.MetadataCache of HEAD probe results
+        self.cache = cache
+        # Checksums of fetched files are compared to the remote ones and stored next to the files
+        self.verify_checksums = verify_checksums
+        # sdownloader.throttle.Throttle shared by all probes and fetches
+        self.throttle = throttle
+        # Callable that receives a sdownloader.metrics.Event for every probe, fetch and folder creation,
+        # e.g. sdownloader.metrics.Metrics
+        self.listener = listener
+
+        # Files of a scene are found either by a HEAD request per file or by one listing of the scene's folder
+        if discovery not in (HEAD, LISTING):
+            raise Landsat8DownloaderException('{} - discovery mode is not supported'.format(discovery))
+        self.discovery = discovery
+        self._index = BucketIndex()
+
+        # Callables that process every file as soon as it is fetched, run by a pool of stage_workers threads,
+        # e.g. sdownloader.stages.CloudOptimizedGeoTIFF
+        self._pipeline = Pipeline(stages, stage_workers) if stages else None
+        # sdownloader.store.BlobStore shared with other download directories, files in it aren't downloaded again
+        self.store = store
+
+        # How the service chain is ordered for every product: as given, ranked by measured performance
+        # or by racing a HEAD request against all the services. With mixed_sources every band is pulled
+        # from the first service in that order that has it.
+        if source_selection not in (FIXED_ORDER, RANKED, RACE):
+            raise Landsat8DownloaderException('{} - source selection is not supported'.format(source_selection))
+        self.source_selection = source_selection
+        self.mixed_sources = mixed_sources
+        self.ranker = ranker or SourceRanker()
+
         # Make sure download directory exist
         check_create_folder(self.download_dir)
 
+    @property
+    def _adaptive(self):
+        return self.source_selection != FIXED_ORDER or self.mixed_sources
+
     def _relative_product_path(self, sat):
         if self._relative_product_path_builder:
             return self._relative_product_path_builder(sat)
 
         return sat['product_id']
 
+    def _scene_attributes(self, product_id):
+        sat = self.scene_interpreter(product_id)
+        date = product_id[17:25]
+        return dict(
+            satellite='landsat8',
+            path=sat['path'],
+            row=sat['row'],
+            date='{0}-{1}-{2}'.format(date[:4], date[4:6], date[6:])
+        )
+
     @property
     def download_dir(self):
         return self._download_dir
@@ -66,6 +145,10 @@ class Landsat8(S3DownloadMixin):
             for band_name_or_id in bands:
                 yield self._BAND_MAP[band_name_or_id] if band_name_or_id in self._BAND_MAP else band_name_or_id
 
+    def resolve_bands(self, bands):
+        """ Returns the set of band ids that are downloaded for the requested band names or ids """
+        return self._DEFAULT_BANDS.union(self._band_converter(bands))
+
     def download(self, products, bands=tuple(_BAND_MAP.values()),
                  service_chain=(AMAZON_S3_STORAGE, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)):
         """
@@ -87,11 +170,22 @@ class Landsat8(S3DownloadMixin):
             (List) includes downloaded scenes as key and source as value (aws or google)
         """
         if isinstance(products, list):
-            scene_objs = Scenes()
+            bands = self.resolve_bands(bands)
 
-            bands = self._DEFAULT_BANDS.union(self._band_converter(bands))
+            if self._concurrent:
+                return self._download_concurrently(products, bands, service_chain)
+
+            scene_objs = Scenes()
 
             for product_id in products:
+                catalogued = self._catalogued(product_id, bands)
+                if catalogued is not None:
+                    scene_objs.add(catalogued)
+                    continue
+
+                if self._adaptive:
+                    scene_objs.merge(self._execute([self._plan(product_id, bands, service_chain)]))
+                    continue
 
                 for service_designator in service_chain:
                     try:
@@ -113,6 +207,182 @@ class Landsat8(S3DownloadMixin):
 
         raise ValueError('Expected sceneIDs list')
 
+    def iter_download(self, products, bands=tuple(_BAND_MAP.values()),
+                      service_chain=(AMAZON_S3_STORAGE, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)):
+        """
+        Download scenes like download does, but yield every scene as soon as its files are on disk.
+        When max_workers is greater than one scenes are yielded in completion order.
+        :param products:
+            A list of products IDs
+        :type products:
+            Iterable
+        :param bands:
+            A list of bands.
+        :type products:
+            List
+        :param service_chain:
+            A list of service designators to be used for images downloading.
+            Also specifies the order.
+        :type service_chain:
+            Iterable
+        :returns:
+            (Generator) of downloaded scenes
+        """
+        bands = self.resolve_bands(bands)
+        return self._iter_download(products, bands, lambda product_id: self._plan(product_id, bands, service_chain))
+
+    def _download_concurrently(self, products, bands, service_chain):
+        """
+        Resolves the source of every product and fetches all (scene, band) pairs using a pool of threads.
+        Products that are not available from any service or can't be planned are reported in ``Scenes.errors``.
+        """
+        catalogued = dict((product_id, self._catalogued(product_id, bands)) for product_id in products)
+        pending = [product_id for product_id in products if catalogued[product_id] is None]
+
+        def plan(product_id, product_bands):
+            return self._plan(product_id, product_bands, service_chain)
+
+        planned = self._map(lambda product_id: self._try_plan(plan, product_id, bands), pending)
+        downloaded = self._execute([p for p, error in planned if error is None])
+
+        scene_objs = Scenes()
+        for product_id in products:
+            if catalogued[product_id] is not None:
+                scene_objs.add(catalogued[product_id])
+            elif product_id in downloaded:
+                scene_objs.add(downloaded[product_id])
+        scene_objs.errors.extend(downloaded.errors)
+
+        for product_id, (_, error) in zip(pending, planned):
+            if error is not None:
+                scene_objs.errors.append((product_id, None, error))
+
+        return scene_objs
+
+    def _plan(self, product_id, bands, service_chain):
+        """ Returns a download plan of the product from the first service in the chain that has all the bands """
+        if self._adaptive:
+            return self._adaptive_plan(product_id, bands, service_chain)
+
+        for service_designator in service_chain:
+            try:
+                if service_designator == AMAZON_S3_STORAGE:
+                    return self._s3_plan(product_id, bands)
+                elif service_designator == GOOGLE_PUBLIC_DATA_STORAGE_SERVICE:
+                    return self._google_plan(product_id, bands)
+                else:
+                    raise Landsat8DownloaderException(
+                        '{} - service designator is not supported'.format(service_designator)
+                    )
+            except RemoteFileDoesntExist:
+                pass
+
+        raise RemoteFileDoesntExist
+
+    def _adaptive_plan(self, product_id, bands, service_chain):
+        """ Plans the product download from the services ordered by the source selection mode """
+        sat = self.scene_interpreter(product_id)
+        bands = sorted(bands, key=str)
+
+        if self.source_selection == RANKED:
+            service_chain = self.ranker.rank(service_chain)
+        elif self.source_selection == RACE:
+            winner = self._race(sat, bands[0], service_chain)
+            service_chain = [winner] + [s for s in service_chain if s != winner]
+
+        folder = os.path.join(self.download_dir, self._relative_product_path(sat))
+
+        if not self.mixed_sources:
+            for service_designator in service_chain:
+                try:
+                    files = [(band, self._probe(service_designator, self._service_url(service_designator, sat, band)))
+                             for band in bands]
+                    return DownloadPlan(sat['product_id'], folder, files, service_designator)
+                except RemoteFileDoesntExist:
+                    pass
+
+            raise RemoteFileDoesntExist
+
+        files = []
+        for band in bands:
+            for service_designator in service_chain:
+                try:
+                    files.append((band, self._probe(service_designator,
+                                                    self._service_url(service_designator, sat, band))))
+                    break
+                except RemoteFileDoesntExist:
+                    pass
+            else:
+                raise RemoteFileDoesntExist
+
+        # the source of every file is told by its url
+        return DownloadPlan(sat['product_id'], folder, files, None)
+
+    def _race(self, sat, band, service_chain):
+        """ Sends HEAD requests for the band to all the services at once and returns the first that has it """
+        answers = Queue()
+
+        def probe(service_designator):
+            try:
+                self._probe(service_designator, self._service_url(service_designator, sat, band))
+                answers.put((service_designator, True))
+            except Exception:
+                answers.put((service_designator, False))
+
+        for service_designator in service_chain:
+            thread = threading.Thread(target=probe, args=(service_designator,))
+            thread.daemon = True
+            thread.start()
+
+        for _ in service_chain:
+            service_designator, found = answers.get()
+            if found:
+                return service_designator
+
+        raise RemoteFileDoesntExist
+
+    def _probe(self, service_designator, url):
+        """ Checks that the url exists and measures the request for the source ranking """
+        start = time.time()
+        try:
+            remote = remote_file_exists(url, session=self.session, cache=self.cache, throttle=self.throttle,
+                                        listener=self._listener)
+        except RemoteFileDoesntExist:
+            self.ranker.record_probe(service_designator, time.time() - start, False)
+            raise
+
+        self.ranker.record_probe(service_designator, time.time() - start, True)
+        return remote
+
+    def _service_url(self, service_designator, sat, band):
+        if service_designator == AMAZON_S3_STORAGE:
+            return self.amazon_s3_url(sat, band)
+        elif service_designator == GOOGLE_PUBLIC_DATA_STORAGE_SERVICE:
+            return self.google_storage_url(sat, band)
+
+        raise Landsat8DownloaderException('{} - service designator is not supported'.format(service_designator))
+
+    def open_band(self, scene, band, source=AMAZON_S3_STORAGE, **options):
+        """ Opens a band on S3 or Google Storage for reading without downloading it, see
+        sdownloader.remote_file.RemoteFile for the options.
+        :param source:
+            AMAZON_S3_STORAGE or GOOGLE_PUBLIC_DATA_STORAGE_SERVICE
+        :type source:
+            String
+        :returns:
+            sdownloader.remote_file.RemoteFile
+        """
+        return self._open_url(self._service_url(source, self.scene_interpreter(scene), band), **options)
+
+    def _url_source(self, url):
+        if url.startswith(self.GOOGLE_BASE_URL):
+            return GOOGLE_PUBLIC_DATA_STORAGE_SERVICE
+        return AMAZON_S3_STORAGE
+
+    def _transferred(self, event):
+        if self._adaptive:
+            self.ranker.record_transfer(self._url_source(event.url), event.bytes, event.seconds)
+
     def _google(self, product_id, bands):
         """
         Google Storage Downloader.
@@ -123,23 +393,34 @@ class Landsat8(S3DownloadMixin):
         :returns:
             Downloaded scenes wrapper
         """
+        return self._execute([self._google_plan(product_id, bands)])[0]
+
+    def _google_plan(self, product_id, bands):
+        """ Checks that every band of the product exists on Google Storage, like S3DownloadMixin._s3_plan.
+        The HEAD probes of HEAD discovery mode are what lets the service chain fall back to the next service.
+        :returns:
+            DownloadPlan
+        """
         sat = self.scene_interpreter(product_id)
 
-        urls = []
+        # get urls for the bands
+        bands = list(bands)
+        urls = [self.google_storage_url(sat, band) for band in bands]
+        listed = self._listed_files(urls)
 
-        for band in bands:
-            # get url for the band
-            url = self.google_storage_url(sat, band)
+        files = []
 
-            # make sure it exist
-            remote_file_exists(url)
-            urls.append(url)
+        for band, url in zip(bands, urls):
+            if listed is not None:
+                remote = listed[url]
+            else:
+                # make sure it exist
+                remote = remote_file_exists(url, session=self.session, cache=self.cache, throttle=self.throttle,
+                                            listener=self._listener)
+            files.append((band, remote))
 
         folder = os.path.join(self.download_dir, self._relative_product_path(sat))
-        # create folder
-        check_create_folder(folder)
-
-        return Scene(sat['product_id'], [fetch(url, folder, show_progress=self.show_progress) for url in urls])
+        return DownloadPlan(sat['product_id'], folder, files, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)
 
     @classmethod
     def amazon_s3_url(cls, sat, band_id):
@@ -209,7 +490,7 @@ class Landsat8(S3DownloadMixin):
         :returns:
             dict
         """
-        if isinstance(product_id, (str, unicode)) and len(product_id) == 40:
+        if isinstance(product_id, string_types) and len(product_id) == 40:
             return dict(
                 path=product_id[10:13],
                 row=product_id[13:16],
@@ -219,3 +500,60 @@ class Landsat8(S3DownloadMixin):
             )
         else:
             raise IncorrectLandsat8SceneId('Received incorrect scene')
+
+    @classmethod
+    def shard_key(cls, product_id):
+        """ Path and row of the product, e.g. 012029, scenes of the same path/row share a bucket folder """
+        sat = cls.scene_interpreter(product_id)
+        return sat['path'] + sat['row']
+
+    @classmethod
+    def scene_interpreter_batch(cls, product_ids, as_array=False):
+        """ Parses many product IDs at once.
+        :param product_ids:
+            The product IDs
+        :type product_ids:
+            Iterable
+        :param as_array:
+            Pass true to get the columns as a NumPy structured array
+        :type as_array:
+            bool
+        :returns:
+            ParsedScenes with index, product_id, sensor, landsat_number, path, row and date columns of the valid IDs,
+            where index is the position of the ID in product_ids, and (index, message) pairs of the invalid IDs
+        """
+        columns = OrderedDict((name, []) for name in ('index', 'product_id', 'sensor', 'landsat_number', 'path',
+                                                      'row', 'date'))
+        index, product_id_column, sensor_column, number_column, path_column, row_column, date_column = \
+            columns.values()
+        errors = []
+        match = _PRODUCT_ID_PATTERN.match
+        # inventories repeat acquisition dates a lot, so every date is parsed once
+        dates = {}
+
+        for i, product_id in enumerate(product_ids):
+            parsed = match(product_id) if isinstance(product_id, string_types) else None
+            if parsed is None:
+                errors.append((i, 'Received incorrect scene {0!r}'.format(product_id)))
+                continue
+
+            sensor, landsat_number, path, row, year, month, day = parsed.groups()
+            date = dates.get(product_id[17:25])
+            if date is None:
+                try:
+                    date = dates[product_id[17:25]] = datetime.date(int(year), int(month), int(day))
+                except ValueError as e:
+                    errors.append((i, '{0}: {1}'.format(product_id, e)))
+                    continue
+
+            index.append(i)
+            product_id_column.append(product_id)
+            sensor_column.append(sensor)
+            number_column.append(int(landsat_number))
+            path_column.append(int(path))
+            row_column.append(int(row))
+            date_column.append(date)
+
+        if as_array:
+            columns = columns_to_array(columns, cls._BATCH_DTYPES)
+        return ParsedScenes(columns, errors)
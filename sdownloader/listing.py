@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from xml.etree import ElementTree
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from .common import RemoteMetadata, get_session
+from .errors import RemoteFileDoesntExist
+from .metrics import LIST, emit, response_retries
+
+logger = logging.getLogger('sdownloader')
+
+# How downloaders find out that the files of a scene exist
+HEAD = 'head'
+LISTING = 'listing'
+
+GOOGLE_STORAGE_HOST = 'storage.googleapis.com'
+
+
+def split_s3_url(url):
+    """ Splits a S3 url into the bucket url and the key, both path style and virtual hosted style urls are accepted.
+    :returns:
+        (Tuple) bucket url, key
+    """
+    parsed = urlparse(url)
+    path = parsed.path.lstrip('/')
+    if parsed.netloc.startswith('s3.') or parsed.netloc.startswith('s3-'):
+        bucket, _, key = path.partition('/')
+        return '{0}://{1}/{2}/'.format(parsed.scheme, parsed.netloc, bucket), key
+    return '{0}://{1}/'.format(parsed.scheme, parsed.netloc), path
+
+
+def _name(element):
+    # S3 answers are namespaced, compatible servers don't always bother
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def _children(element):
+    return dict((_name(child), child.text) for child in element)
+
+
+def list_s3(url_prefix, session=None, throttle=None, listener=None):
+    """ Lists objects of a S3 bucket with ListObjectsV2 requests, 1000 objects per request.
+    :returns:
+        (Dict) RemoteMetadata of every object url that starts with url_prefix
+    """
+    bucket_url, prefix = split_s3_url(url_prefix)
+    session = session or get_session()
+
+    objects = {}
+    params = {'list-type': '2', 'prefix': prefix}
+    while True:
+        if throttle is not None:
+            throttle.request(bucket_url)
+        started = time.time()
+        response = session.get(bucket_url, params=params)
+        emit(listener, LIST, bucket_url, started, status=response.status_code, retries=response_retries(response))
+        response.raise_for_status()
+
+        root = ElementTree.fromstring(response.content)
+        for element in root:
+            if _name(element) == 'Contents':
+                item = _children(element)
+                url = bucket_url + item['Key']
+                objects[url] = RemoteMetadata.from_headers(url, 200, {
+                    'content-length': item.get('Size'),
+                    'etag': item.get('ETag'),
+                    'last-modified': item.get('LastModified'),
+                })
+
+        result = _children(root)
+        if result.get('IsTruncated') != 'true':
+            return objects
+        params['continuation-token'] = result['NextContinuationToken']
+
+
+def list_google_storage(url_prefix, session=None, throttle=None, listener=None):
+    """ Lists objects of a Google Storage bucket with the JSON API, 1000 objects per request.
+    :returns:
+        (Dict) RemoteMetadata of every object url that starts with url_prefix
+    """
+    parsed = urlparse(url_prefix)
+    bucket, _, prefix = parsed.path.lstrip('/').partition('/')
+    api_url = '{0}://{1}/storage/v1/b/{2}/o'.format(parsed.scheme, parsed.netloc, bucket)
+    session = session or get_session()
+
+    objects = {}
+    params = {'prefix': prefix}
+    while True:
+        if throttle is not None:
+            throttle.request(api_url)
+        started = time.time()
+        response = session.get(api_url, params=params)
+        emit(listener, LIST, api_url, started, status=response.status_code, retries=response_retries(response))
+        response.raise_for_status()
+
+        page = response.json()
+        for item in page.get('items', []):
+            url = '{0}://{1}/{2}/{3}'.format(parsed.scheme, parsed.netloc, bucket, item['name'])
+            remote = RemoteMetadata.from_headers(url, 200, {
+                'content-length': item.get('size'),
+                'last-modified': item.get('updated'),
+                'x-goog-hash': 'md5=' + item['md5Hash'] if item.get('md5Hash') else None,
+            })
+            # the etag of the JSON API is a generation tag, the files are served with the hex MD5 as their ETag,
+            # it is the one If-Match requests have to send
+            objects[url] = remote._replace(etag=remote.md5)
+
+        if not page.get('nextPageToken'):
+            return objects
+        params['pageToken'] = page['nextPageToken']
+
+
+def list_objects(url_prefix, session=None, throttle=None, listener=None):
+    """ Lists every object whose url starts with url_prefix, in as few requests as the storage allows.
+    :param url_prefix:
+        Url of a folder, e.g. a Landsat8 path/row or a Sentinel2 tile folder
+    :type url_prefix:
+        String
+    :returns:
+        (Dict) RemoteMetadata by object url
+    """
+    if urlparse(url_prefix).netloc == GOOGLE_STORAGE_HOST:
+        return list_google_storage(url_prefix, session=session, throttle=throttle, listener=listener)
+    return list_s3(url_prefix, session=session, throttle=throttle, listener=listener)
+
+
+def folder_url(urls):
+    """ The deepest folder that contains all the urls """
+    prefix = urls[0]
+    for url in urls[1:]:
+        while not url.startswith(prefix):
+            prefix = prefix[:-1]
+    return prefix[:prefix.rfind('/') + 1]
+
+
+class BucketIndex(object):
+    """ Metadata of listed folders, so every folder is listed once per downloader """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # RemoteMetadata by object url of every listed prefix
+        self._listings = {}
+        # events of the prefixes that are being listed
+        self._pending = {}
+
+    @staticmethod
+    def _find(prefixes, url_prefix):
+        """ The longest prefix of url_prefix in prefixes, **None** if there is none """
+        for end in range(len(url_prefix), 0, -1):
+            if url_prefix[:end] in prefixes:
+                return url_prefix[:end]
+        return None
+
+    def _ensure(self, url_prefix, session, throttle, listener):
+        """ Lists the prefix unless a listing covers it already or is under way.
+        :returns:
+            (Tuple) the covering prefix and its listing
+        """
+        while True:
+            with self._lock:
+                prefix = self._find(self._listings, url_prefix)
+                if prefix is not None:
+                    return prefix, self._listings[prefix]
+
+                prefix = self._find(self._pending, url_prefix)
+                if prefix is None:
+                    listed = self._pending[url_prefix] = threading.Event()
+                    break
+                listed = self._pending[prefix]
+
+            # another thread lists a folder that covers this one, it is listed here only if that fails
+            listed.wait()
+
+        objects = None
+        try:
+            objects = list_objects(url_prefix, session=session, throttle=throttle, listener=listener)
+        finally:
+            with self._lock:
+                if objects is not None:
+                    self._listings[url_prefix] = objects
+                del self._pending[url_prefix]
+            listed.set()
+        return url_prefix, objects
+
+    def list(self, url_prefix, session=None, throttle=None, listener=None):
+        """ Lists the folder unless it is inside an already listed one.
+        :returns:
+            (Dict) RemoteMetadata by object url of the files under the prefix
+        """
+        prefix, objects = self._ensure(url_prefix, session, throttle, listener)
+        if prefix == url_prefix:
+            return dict(objects)
+        return dict((url, remote) for url, remote in objects.items() if url.startswith(url_prefix))
+
+    def files(self, urls, session=None, throttle=None, listener=None):
+        """ Returns the RemoteMetadata of every url from a listing of their folder.
+        RemoteFileDoesntExist is raised if any of them is missing.
+        """
+        _, objects = self._ensure(folder_url(urls), session, throttle, listener)
+        remotes = [objects.get(url) for url in urls]
+
+        missing = [url for url, remote in zip(urls, remotes) if remote is None]
+        if missing:
+            logger.info('{0} are not listed'.format(', '.join(missing)))
+            raise RemoteFileDoesntExist
+        return remotes
@@ -0,0 +1,152 @@
+import json
+import math
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# Kinds of instrumented operations
+PROBE = 'probe'
+LIST = 'list'
+FETCH = 'fetch'
+FOLDER = 'folder'
+
+# Upper bounds in seconds of the exported duration histogram buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Event(namedtuple('Event', ['kind', 'url', 'seconds', 'bytes', 'status', 'retries', 'source', 'error'])):
+    """ A single timed operation reported to a listener.
+
+    ``url`` is the folder path of FOLDER events, ``status`` is **None** when no http response was seen
+    and ``error`` holds the exception of a failed operation.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, kind, url, seconds, bytes=0, status=None, retries=0, source=None, error=None):
+        return super(Event, cls).__new__(cls, kind, url, seconds, bytes, status, retries, source, error)
+
+    @property
+    def host(self):
+        return urlparse(self.url).netloc
+
+
+def emit(listener, kind, url, started, **kwargs):
+    """ Sends an event of an operation that began at the started timestamp, if there is a listener """
+    if listener is not None:
+        listener(Event(kind, url, time.time() - started, **kwargs))
+
+
+def response_retries(response):
+    """ Number of retries urllib3 made before the response was received. Sessions of create_session count them,
+    other sessions tell them only with urllib3 versions that keep the retry history.
+    """
+    retries = getattr(response, 'retries', None)
+    if isinstance(retries, int):
+        return retries
+    history = getattr(getattr(getattr(response, 'raw', None), 'retries', None), 'history', None)
+    return len(history) if isinstance(history, tuple) else 0
+
+
+def percentile(values, q):
+    """ Nearest-rank percentile of sorted values, q is between 0 and 100 """
+    if not values:
+        return None
+    rank = int(math.ceil(q / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class _Series(object):
+
+    def __init__(self):
+        self.durations = []
+        self.bytes = 0
+        self.errors = 0
+        self.retries = 0
+        self.sources = set()
+
+
+class Metrics(object):
+    """ Listener that aggregates events per operation kind and host.
+
+    Pass an instance as the ``listener`` of Landsat8 or Sentinel2 and read the numbers with ``summary``,
+    ``to_json`` or ``to_prometheus`` once the download is done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def __call__(self, event):
+        host = event.host if event.kind != FOLDER else ''
+        with self._lock:
+            series = self._series.setdefault((event.kind, host), _Series())
+            series.durations.append(event.seconds)
+            series.bytes += event.bytes or 0
+            series.retries += event.retries or 0
+            if event.error is not None:
+                series.errors += 1
+            if event.source is not None:
+                series.sources.add(event.source)
+
+    def summary(self):
+        """ Aggregated numbers of every (kind, host) pair.
+        :returns:
+            (Dict) {kind: {host: {count, errors, retries, bytes, seconds, p50, p99, mb_per_second, sources}}}
+            where mb_per_second is the average transfer rate of a single request
+        """
+        result = {}
+        with self._lock:
+            for (kind, host), series in sorted(self._series.items()):
+                durations = sorted(series.durations)
+                seconds = sum(durations)
+                result.setdefault(kind, {})[host] = {
+                    'count': len(durations),
+                    'errors': series.errors,
+                    'retries': series.retries,
+                    'bytes': series.bytes,
+                    'seconds': seconds,
+                    'p50': percentile(durations, 50),
+                    'p99': percentile(durations, 99),
+                    'mb_per_second': series.bytes / 1048576.0 / seconds if seconds > 0 else 0.0,
+                    'sources': sorted(series.sources),
+                }
+        return result
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """ Renders the metrics in the Prometheus text exposition format """
+        lines = [
+            '# HELP sdownloader_request_seconds Duration of probes, listings, fetches and folder creations.',
+            '# TYPE sdownloader_request_seconds histogram',
+        ]
+        counters = []
+
+        with self._lock:
+            for (kind, host), series in sorted(self._series.items()):
+                labels = 'kind="{0}",host="{1}"'.format(kind, host)
+                for bound in BUCKETS:
+                    count = len([d for d in series.durations if d <= bound])
+                    lines.append('sdownloader_request_seconds_bucket{{{0},le="{1}"}} {2}'.format(labels, bound, count))
+                lines.append('sdownloader_request_seconds_bucket{{{0},le="+Inf"}} {1}'.format(
+                    labels, len(series.durations)))
+                lines.append('sdownloader_request_seconds_sum{{{0}}} {1}'.format(labels, sum(series.durations)))
+                lines.append('sdownloader_request_seconds_count{{{0}}} {1}'.format(labels, len(series.durations)))
+                counters.append((labels, series.bytes, series.errors, series.retries))
+
+        for index, name, description in ((1, 'bytes', 'Bytes received.'),
+                                          (2, 'errors', 'Failed operations.'),
+                                          (3, 'retries', 'Retried http requests.')):
+            lines.append('# HELP sdownloader_{0}_total {1}'.format(name, description))
+            lines.append('# TYPE sdownloader_{0}_total counter'.format(name))
+            for counter in counters:
+                lines.append('sdownloader_{0}_total{{{1}}} {2}'.format(name, counter[0], counter[index]))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,285 @@
+"""
+Seekable files read from a remote band with HTTP Range requests
+
+A RemoteFile fetches only the blocks that are read, so a raster library that reads the header and the few
+tiles that cover an area of interest transfers a small part of a band instead of the whole file.
+
+    >>> f = Landsat8('./imagery').open_band('LC08_L1TP_012029_20170411_20170415_01_T1', 4)
+    >>> with rasterio.open(f.name, opener=f.open) as src:
+    ...     window = src.read(1, window=Window(4000, 4000, 256, 256))
+"""
+import errno
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .common import get_session, get_remote_metadata
+from .errors import RemoteFileDoesntExist
+from .metrics import FETCH, emit, response_retries
+
+logger = logging.getLogger('sdownloader')
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+DEFAULT_CACHE_BLOCKS = 64
+# blocks fetched past a read that continues the previous one
+DEFAULT_READ_AHEAD = 4
+
+
+class RemoteFile(io.RawIOBase):
+    """ Read-only file of a url, read in blocks that are kept in a LRU cache.
+
+    Missing blocks next to each other are fetched with a single Range request. A read that continues where
+    the previous read stopped fetches read_ahead more blocks with it, so sequential reads take few requests.
+    The ETag of the file is sent with every request, a file that is replaced meanwhile raises IOError
+    instead of mixing the blocks of two versions.
+    """
+
+    def __init__(self, url, session=None, remote=None, block_size=DEFAULT_BLOCK_SIZE,
+                 cache_blocks=DEFAULT_CACHE_BLOCKS, read_ahead=DEFAULT_READ_AHEAD, throttle=None, listener=None):
+        """
+        :param url:
+            Url of the file
+        :type url:
+            String
+        :param session:
+            Http session to send the requests with. The shared session is used by default.
+        :type session:
+            requests.Session
+        :param remote:
+            Metadata of the file, it is requested with a HEAD request when it isn't given
+        :type remote:
+            sdownloader.common.RemoteMetadata
+        :param block_size:
+            Number of bytes fetched and cached together
+        :type block_size:
+            int
+        :param cache_blocks:
+            Number of blocks kept in memory
+        :type cache_blocks:
+            int
+        :param read_ahead:
+            Number of blocks fetched past a sequential read, 0 disables read-ahead
+        :type read_ahead:
+            int
+        :param throttle:
+            Rate limiter the requests have to pass
+        :type throttle:
+            sdownloader.throttle.Throttle
+        :param listener:
+            Callable that receives a sdownloader.metrics.Event of every request
+        :type listener:
+            Callable
+        """
+        super(RemoteFile, self).__init__()
+        if block_size < 1 or cache_blocks < 1 or read_ahead < 0:
+            raise ValueError('block_size and cache_blocks must be positive, read_ahead must not be negative')
+
+        self.url = url
+        self.session = session or get_session()
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.read_ahead = read_ahead
+        self.throttle = throttle
+        self._listener = listener
+
+        if remote is None:
+            remote = get_remote_metadata(url, session=self.session, throttle=throttle, listener=listener)
+        if not remote.exists:
+            raise RemoteFileDoesntExist
+        if remote.content_length is None:
+            raise IOError('{0} has an unknown size, it can\'t be read in ranges'.format(url))
+
+        self.remote = remote
+        self.size = remote.content_length
+        # number of requests sent and bytes received, for the transfer savings to be measured
+        self.requests = 0
+        self.bytes_fetched = 0
+
+        self._position = 0
+        self._blocks = OrderedDict()
+        # end of the previous read, a read that starts there is sequential
+        self._read_end = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<RemoteFile {0}>'.format(self.url)
+
+    @property
+    def name(self):
+        return self.url
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError('{0} - whence is not supported'.format(whence))
+
+        if position < 0:
+            raise ValueError('negative seek position {0}'.format(position))
+        self._position = position
+        return position
+
+    def readinto(self, b):
+        data = self.read_range(self._position, len(b))
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read_range(self, offset, size):
+        """ Reads size bytes at offset without moving the position of the file, fewer at the end of the file.
+        :returns:
+            (bytes) The data
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b''
+
+        first = offset // self.block_size
+        last = (end - 1) // self.block_size
+        with self._lock:
+            blocks = self._get_blocks(first, last, offset == self._read_end)
+            self._read_end = end
+        data = b''.join(blocks)
+        start = offset - first * self.block_size
+        return data[start:start + end - offset]
+
+    def open(self, path, mode='rb'):
+        """ Opener for rasterio 1.4 and later, rasterio.open(f.name, opener=f.open) reads the file through GDAL.
+        GDAL asks for side-car files of the dataset too, they don't exist. rasterio closes the file with the
+        dataset.
+        """
+        if path != self.name or 'r' not in mode:
+            raise IOError(errno.ENOENT, 'No such file or directory', path)
+        return self
+
+    def close(self):
+        self._blocks.clear()
+        super(RemoteFile, self).close()
+
+    def _get_blocks(self, first, last, sequential):
+        found = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self._blocks.get(index)
+            if block is None:
+                missing.append(index)
+            else:
+                self._blocks[index] = self._blocks.pop(index)
+                found[index] = block
+
+        if missing or sequential:
+            fetch_last = last
+            if sequential and self.read_ahead:
+                # blocks past the read are fetched with the missing ones unless they are cached already
+                last_block = (self.size - 1) // self.block_size
+                while fetch_last < min(last + self.read_ahead, last_block) and fetch_last + 1 not in self._blocks:
+                    fetch_last += 1
+                if fetch_last > last:
+                    missing.extend(range(last + 1, fetch_last + 1))
+
+            for start, stop in _runs(missing):
+                for index, block in self._fetch_blocks(start, stop):
+                    if index <= last:
+                        found[index] = block
+                    self._cache(index, block)
+
+        return [found[index] for index in range(first, last + 1)]
+
+    def _cache(self, index, block):
+        self._blocks[index] = block
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def _fetch_blocks(self, first, last):
+        """ Fetches blocks first-last (inclusive) with one Range request.
+        :returns:
+            (List) (index, bytes) pairs
+        """
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+        headers = {'Range': 'bytes={0}-{1}'.format(start, end)}
+        if self.remote.etag:
+            headers['If-Match'] = '"{0}"'.format(self.remote.etag)
+
+        if self.throttle is not None:
+            self.throttle.request(self.url)
+        started = time.time()
+        try:
+            response = self.session.get(self.url, headers=headers, stream=True)
+            if response.status_code == 404:
+                raise RemoteFileDoesntExist
+            if response.status_code == 412:
+                raise IOError('{0} changed while it was read'.format(self.url))
+            response.raise_for_status()
+
+            if response.status_code != 206:
+                # the server ignored the range and sends the file from its beginning
+                logger.warning('{0} is not served in ranges'.format(self.url))
+            data = _read_response(response, 0 if response.status_code == 206 else start, end - start + 1)
+        except Exception as e:
+            emit(self._listener, FETCH, self.url, started, error=e)
+            raise
+        emit(self._listener, FETCH, self.url, started, bytes=len(data), status=response.status_code,
+             retries=response_retries(response))
+
+        if self.throttle is not None:
+            self.throttle.transfer(self.url, len(data))
+        if len(data) != end - start + 1:
+            raise IOError('Incomplete range {0}-{1} of {2}'.format(start, end, self.url))
+
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        return [(index, data[(index - first) * self.block_size:(index - first + 1) * self.block_size])
+                for index in range(first, last + 1)]
+
+
+def _runs(indexes):
+    """ Groups sorted block indexes into (first, last) runs of consecutive blocks """
+    runs = []
+    for index in sorted(indexes):
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return runs
+
+
+def _read_response(response, skip, size):
+    """ Reads size bytes of a streamed response after skipping the first bytes, then closes the response """
+    chunks = []
+    received = 0
+    try:
+        for chunk in response.iter_content(DEFAULT_BLOCK_SIZE):
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            chunks.append(chunk[:size - received])
+            received += len(chunks[-1])
+            if received >= size:
+                break
+    finally:
+        response.close()
+    return b''.join(chunks)
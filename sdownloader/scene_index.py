@@ -0,0 +1,259 @@
+"""
+Local index of the Landsat-8 products listed in the public scene lists
+
+The index is built from the scene list CSV of the AWS bucket (scene_list.gz) or the Google Storage bucket
+(index.csv.gz), either downloaded or read from a local copy, and kept as memory-mapped NumPy columns sorted
+by path, row and acquisition date. Every query is a couple of binary searches per path/row.
+
+    >>> index = SceneIndex('./landsat-index')
+    >>> index.update('scene_list.gz')
+    >>> product_ids = index.query([(12, 29), (13, 29)], datetime.date(2017, 4, 1), datetime.date(2017, 6, 30))
+    >>> Landsat8('./imagery').download(product_ids, [4, 3, 2])
+
+Scene lists only grow, so update reads the rows that were added since the previous update.
+"""
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+
+from .common import check_create_folder, fetch
+from .landsat8 import Landsat8
+
+logger = logging.getLogger('sdownloader')
+
+SCENE_LIST_URL = 'https://s3-us-west-2.amazonaws.com/landsat-pds/c1/L8/scene_list.gz'
+
+# product ID and cloud cover columns of the AWS and the Google Storage scene lists
+PRODUCT_ID_COLUMNS = ('productId', 'PRODUCT_ID')
+CLOUD_COVER_COLUMNS = ('cloudCover', 'CLOUD_COVER')
+
+STATE_FILENAME = 'state.json'
+COLUMNS = ('keys', 'product_ids', 'cloud_cover')
+
+# parsed rows are merged into the index in chunks of this size
+CHUNK_ROWS = 100000
+
+_EPOCH = datetime.date(1970, 1, 1)
+# days since 1970 are stored in the lowest bits of a key, above them path * 1000 + row
+_DAY_BITS = 20
+
+
+def index_key(path, row, date):
+    """ Sort key of a product, products are ordered by path, row and date """
+    return ((int(path) * 1000 + int(row)) << _DAY_BITS) | (date - _EPOCH).days
+
+
+def _open_csv(path):
+    """ Opens a CSV file the way the csv module of the running Python reads it """
+    if str is bytes:
+        # Python 2 csv reads bytes
+        return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    return io.open(path, encoding='utf-8', newline='')
+
+
+def _column(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+class SceneIndex(object):
+    """ Landsat-8 product IDs by path, row and acquisition date. Requires NumPy. """
+
+    def __init__(self, path):
+        """
+        :param path:
+            Directory the columns are stored in, an index stored there before is memory-mapped
+        :type path:
+            String
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('SceneIndex requires numpy, install sdownloader[numpy]')
+
+        self._numpy = numpy
+        self.path = path
+        # source the index was built from and the number of its rows that were read
+        self.source = None
+        self.rows = 0
+
+        check_create_folder(path)
+        self._load()
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def _load(self):
+        numpy = self._numpy
+        state_path = os.path.join(self.path, STATE_FILENAME)
+        if not os.path.exists(state_path):
+            self._keys = numpy.empty(0, dtype='i8')
+            self._product_ids = numpy.empty(0, dtype='S40')
+            self._cloud_cover = numpy.empty(0, dtype='f4')
+            return
+
+        with open(state_path) as f:
+            state = json.load(f)
+        self.source = state['source']
+        self.rows = state['rows']
+        self._keys, self._product_ids, self._cloud_cover = [
+            numpy.load(self._column_path(name), mmap_mode='r') for name in COLUMNS]
+
+    def _save(self):
+        numpy = self._numpy
+        for name, column in zip(COLUMNS, (self._keys, self._product_ids, self._cloud_cover)):
+            temp_path = self._column_path(name) + '.tmp'
+            with open(temp_path, 'wb') as f:
+                numpy.save(f, column)
+            os.rename(temp_path, self._column_path(name))
+
+        state_path = os.path.join(self.path, STATE_FILENAME)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump({'source': self.source, 'rows': self.rows}, f)
+        os.rename(state_path + '.tmp', state_path)
+
+        self._load()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, source=SCENE_LIST_URL, session=None):
+        """ Adds the products of a scene list that are not in the index yet.
+        :param source:
+            Url or path of a scene list CSV, gzipped when it ends with .gz. Urls are downloaded to the index
+            directory first.
+        :type source:
+            String
+        :param session:
+            Http session the scene list is downloaded with
+        :type session:
+            requests.Session
+        :returns:
+            (int) Number of added products
+        """
+        path = source
+        if source.startswith('http://') or source.startswith('https://'):
+            local_path = os.path.join(self.path, source.rsplit('/', 1)[-1])
+            if os.path.exists(local_path):
+                # the list grew since it was downloaded
+                os.remove(local_path)
+            path = fetch(source, self.path, session=session)
+
+        skip = self.rows if source == self.source else 0
+        if skip == 0 and len(self):
+            logger.info('{0} is not the source of the index, the index is built again'.format(source))
+            self._keys = self._keys[:0]
+            self._product_ids = self._product_ids[:0]
+            self._cloud_cover = self._cloud_cover[:0]
+
+        added = 0
+        rows = 0
+        with _open_csv(path) as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            product_id_column = _column(header, PRODUCT_ID_COLUMNS)
+            cloud_cover_column = _column(header, CLOUD_COVER_COLUMNS)
+            if product_id_column is None:
+                raise ValueError('{0} has none of the {1} columns'.format(source, ', '.join(PRODUCT_ID_COLUMNS)))
+
+            if skip:
+                # rows that are in the index already aren't parsed
+                rows = sum(1 for _ in itertools.islice(reader, skip))
+                if rows < skip:
+                    logger.warning('{0} is shorter than when it was indexed, the index is built again'.format(source))
+                    return self._rebuild(source, session)
+
+            while True:
+                chunk = list(itertools.islice(reader, CHUNK_ROWS))
+                if not chunk:
+                    break
+                rows += len(chunk)
+                added += self._add(chunk, product_id_column, cloud_cover_column)
+
+        self.source = source
+        self.rows = rows
+        self._save()
+        logger.info('{0} products are added to the index, {1} in total'.format(added, len(self)))
+        return added
+
+    def _rebuild(self, source, session):
+        self.source = None
+        self.rows = 0
+        return self.update(source, session)
+
+    def _add(self, chunk, product_id_column, cloud_cover_column):
+        numpy = self._numpy
+        product_ids = [row[product_id_column] if len(row) > product_id_column else None for row in chunk]
+        parsed = Landsat8.scene_interpreter_batch(product_ids)
+        columns = parsed.columns
+
+        selected = [i for i, number in enumerate(columns['landsat_number']) if number == 8]
+        if not selected:
+            return 0
+
+        keys = numpy.array([index_key(columns['path'][i], columns['row'][i], columns['date'][i]) for i in selected],
+                           dtype='i8')
+        ids = numpy.array([columns['product_id'][i].encode('ascii') for i in selected], dtype='S40')
+        cloud_cover = numpy.array([self._cloud_cover_value(chunk[columns['index'][i]], cloud_cover_column)
+                                   for i in selected], dtype='f4')
+
+        order = numpy.argsort(keys, kind='mergesort')
+        keys, ids, cloud_cover = keys[order], ids[order], cloud_cover[order]
+
+        # the new rows are merged into the sorted columns
+        positions = numpy.searchsorted(self._keys, keys, side='right')
+        self._keys = numpy.insert(self._keys, positions, keys)
+        self._product_ids = numpy.insert(self._product_ids, positions, ids)
+        self._cloud_cover = numpy.insert(self._cloud_cover, positions, cloud_cover)
+        return len(keys)
+
+    @staticmethod
+    def _cloud_cover_value(row, column):
+        try:
+            return float(row[column])
+        except (TypeError, IndexError, ValueError):
+            return float('nan')
+
+    def query(self, path_rows, start=None, end=None, max_cloud_cover=None):
+        """ Finds the products of the path/rows acquired between two dates.
+        :param path_rows:
+            (path, row) pairs
+        :type path_rows:
+            Iterable
+        :param start:
+            First acquisition date, inclusive
+        :type start:
+            datetime.date
+        :param end:
+            Last acquisition date, inclusive
+        :type end:
+            datetime.date
+        :param max_cloud_cover:
+            Products with more clouds, or without a known cloud cover, are left out
+        :type max_cloud_cover:
+            float
+        :returns:
+            (List) product IDs ordered by path, row and date
+        """
+        first_day = (start - _EPOCH).days if start is not None else 0
+        last_day = (end - _EPOCH).days if end is not None else (1 << _DAY_BITS) - 1
+
+        product_ids = []
+        for path, row in path_rows:
+            tile = (int(path) * 1000 + int(row)) << _DAY_BITS
+            low = self._keys.searchsorted(tile | first_day)
+            high = self._keys.searchsorted(tile | last_day, side='right')
+            found = self._product_ids[low:high]
+            if max_cloud_cover is not None:
+                found = found[self._cloud_cover[low:high] <= max_cloud_cover]
+            product_ids.extend(product_id.decode('ascii') for product_id in found)
+        return product_ids
@@ -1,15 +1,93 @@
 import datetime
+import json
 import logging
+import os
 import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
 
 from wordpad import pad
 
-from sdownloader.errors import IncorrectSentine2SceneId
-from .download import S3DownloadMixin
-from .common import check_create_folder
+# strptime imports this module lazily, which fails when threads call it for the first time at once on Python 2
+import _strptime  # noqa: F401
+
+from sdownloader.errors import IncorrectSentine2SceneId, RemoteFileDoesntExist
+from .download import S3DownloadMixin, Scenes
+from .common import (check_create_folder, get_session, url_builder, HostLimiter, string_types, ParsedScenes,
+                     columns_to_array)
+from .metrics import FETCH, emit, response_retries
+from .listing import BucketIndex, HEAD, LISTING
+from .stages import Pipeline, DEFAULT_STAGE_WORKERS
 
 logger = logging.getLogger('sdownloader')
 
+_MGRS_PATTERN = re.compile(r'(\d+)([A-Z])([A-Z]{2})')
+_TILE_PATH_PATTERN = re.compile(
+    r'tiles/(?P<utm>\d{1,2})/(?P<lat_band>[C-X])/(?P<square>[A-Z]{2})/'
+    r'(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<seq>\d{1,2})'
+)
+
+# e.g. S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.01
+_SCENE_ID_PATTERN = re.compile(r'_(\d{4})(\d{2})(\d{2})T\d{6}_[^_]+_T(\d{2})([A-Z])([A-Z]{2})_N\d+\.(\d+)$')
+# e.g. S2A_tile_20160530_56WNV_0
+_TILE_ID_PATTERN = re.compile(r'^[^_]+_[^_]+_(\d{4})(\d{2})(\d{2})_(\d+)([A-Z])([A-Z]{2})_(\d+)$')
+
+# e.g. B01.jp2 or B8A.jp2 in a tile folder
+_BAND_FILE_PATTERN = re.compile(r'B(\d{2}|8A)\.jp2$')
+
+# tileInfo.json files are kept in this folder of the download directory
+TILE_INFO_DIR = '.tileinfo'
+# tileInfo.json files and listings are small, so more of them are requested at once than files are fetched
+TILE_INFO_WORKERS = 16
+# tile paths of every listed month are kept in this folder of the download directory
+TILE_INDEX_DIR = '.tileindex'
+# days after the end of a month when its tiles are taken as complete and the month listing is cached
+MONTH_COMPLETE_AFTER = 30
+
+
+def _write_json(path, data):
+    check_create_folder(os.path.dirname(path))
+    temp_path = '{0}.{1}-{2}'.format(path, os.getpid(), threading.current_thread().ident)
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.rename(temp_path, path)
+
+
+def _months(start, end):
+    """ (year, month) pairs from the month of start to the month of end """
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _map_metadata(func, items):
+    """ Applies func to every item, metadata requests are small so many of them are sent at once """
+    if len(items) < 2:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(min(TILE_INFO_WORKERS, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class TileInfo(namedtuple('TileInfo', ['path', 'timestamp', 'data_coverage', 'cloud_cover', 'product_name',
+                                       'bands'])):
+    """ Metadata of a tile from its tileInfo.json. Coverages are percentages, **None** when tileInfo.json doesn't
+    tell them, and bands is **None** unless the bands of the tile were discovered.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, path, info, bands=None):
+        return cls(path, info.get('timestamp'), info.get('dataCoveragePercentage'), info.get('cloudyPixelPercentage'),
+                   info.get('productName'), bands)
+
 
 class Sentinel2(S3DownloadMixin):
     """ Sentinel2 downloader class """
@@ -25,12 +103,51 @@ class Sentinel2(S3DownloadMixin):
         'swir2': 12
     }
 
-    def __init__(self, download_dir, relative_product_path_builder=None, show_progress=False):
+    # NumPy dtypes of the scene_interpreter_batch columns
+    _BATCH_DTYPES = dict(index='i8', scene='U', path='U', utm='i1', latitude_band='U1', grid_square='U2',
+                         date='datetime64[D]', sequence='i2')
+
+    def __init__(self, download_dir, relative_product_path_builder=None, show_progress=False,
+                 max_workers=1, max_connections_per_host=None, session=None, connections=1,
+                 catalog=None, cache=None, verify_checksums=False, throttle=None, listener=None, discovery=HEAD,
+                 stages=None, stage_workers=DEFAULT_STAGE_WORKERS, store=None):
         self._download_dir = download_dir
         self._relative_product_path_builder = relative_product_path_builder
 
         self.show_progress = show_progress
 
+        # Files are fetched concurrently when more than one worker is requested
+        self.max_workers = max_workers
+        self._host_limiter = HostLimiter(max_connections_per_host)
+
+        # Http session shared by all probes and fetches, see common.create_session
+        self.session = session
+        # Parallel Range requests per large file, used only with a session
+        self.connections = connections
+        # sdownloader.catalog.Catalog of downloaded files, lets finished scenes be skipped without network calls
+        self.catalog = catalog
+        # sdownloader.cache.MetadataCache of HEAD probe results
+        self.cache = cache
+        # Checksums of fetched files are compared to the remote ones and stored next to the files
+        self.verify_checksums = verify_checksums
+        # sdownloader.throttle.Throttle shared by all probes and fetches
+        self.throttle = throttle
+        # Callable that receives a sdownloader.metrics.Event for every probe, fetch and folder creation,
+        # e.g. sdownloader.metrics.Metrics
+        self.listener = listener
+
+        # Files of a scene are found either by a HEAD request per file or by one listing of the scene's folder
+        if discovery not in (HEAD, LISTING):
+            raise ValueError('{} - discovery mode is not supported'.format(discovery))
+        self.discovery = discovery
+        self._index = BucketIndex()
+
+        # Callables that process every file as soon as it is fetched, run by a pool of stage_workers threads,
+        # e.g. sdownloader.stages.CloudOptimizedGeoTIFF
+        self._pipeline = Pipeline(stages, stage_workers) if stages else None
+        # sdownloader.store.BlobStore shared with other download directories, files in it aren't downloaded again
+        self.store = store
+
         # Make sure download directory exist
         check_create_folder(self.download_dir)
 
@@ -44,14 +161,26 @@ class Sentinel2(S3DownloadMixin):
 
         return amazon_s3_path.replace('/', '_')
 
+    def _scene_attributes(self, scene):
+        utm, latitude_band, grid_square, date, _ = self.parse_amazon_s3_tile_path(self.scene_interpreter(scene))
+        return dict(
+            satellite='sentinel2',
+            mgrs='{0}{1}{2}'.format(utm, latitude_band, grid_square),
+            date=date.isoformat()
+        )
+
     def _band_converter(self, bands=None):
         if bands:
             for band_name_or_id in bands:
                 yield self._BAND_MAP[band_name_or_id] if band_name_or_id in self._BAND_MAP else band_name_or_id
 
-    def download(self, scenes, bands):
+    def resolve_bands(self, bands):
+        """ Returns the set of band ids that are downloaded for the requested band names or ids """
+        return set(self._band_converter(bands))
+
+    def download(self, scenes, bands=None, max_cloud_cover=None, min_data_coverage=None):
         """
-        Download scenes Amazon S3. Bands must be provided
+        Download scenes Amazon S3.
 
         The scenes could either be a scene_id used by sentinel-api or a s3 path (e.g. tiles/34/R/CS/2016/3/25/0)
 
@@ -60,17 +189,203 @@ class Sentinel2(S3DownloadMixin):
         :type scenes:
             List
         :param bands:
-            A list of bands. Default value is None.
+            A list of bands. Without bands every band a tile has is downloaded, see available_bands.
         :type scenes:
             List
+        :param max_cloud_cover:
+            Tiles whose tileInfo.json reports a larger cloudy pixel percentage are skipped. Tiles without
+            tileInfo.json are reported in ``Scenes.errors`` when a filter is given.
+        :type max_cloud_cover:
+            float
+        :param min_data_coverage:
+            Tiles whose tileInfo.json reports a smaller data coverage percentage are skipped
+        :type min_data_coverage:
+            float
         :returns:
             (List) includes downloaded scenes as key and source as value (aws or google)
         """
-        if isinstance(scenes, list):
-            return self.s3(scenes, set(self._band_converter(bands)))
-        else:
+        if not isinstance(scenes, list):
             raise ValueError('Expected scene list')
 
+        if bands is not None and max_cloud_cover is None and min_data_coverage is None:
+            return self.s3(scenes, self.resolve_bands(bands))
+
+        errors = []
+        if max_cloud_cover is None and min_data_coverage is None:
+            kept = scenes
+        else:
+            # tiles are filtered by their metadata before any band is probed
+            kept = []
+            for scene, info in self.tile_info(scenes).items():
+                if info is None:
+                    logger.error('{0} has no tileInfo.json'.format(scene))
+                    errors.append((scene, None, RemoteFileDoesntExist('{0} has no tileInfo.json'.format(scene))))
+                    continue
+                if max_cloud_cover is not None and info.cloud_cover is not None and \
+                        info.cloud_cover > max_cloud_cover:
+                    logger.info('{0} is skipped, {1}% is cloudy'.format(scene, info.cloud_cover))
+                    continue
+                if min_data_coverage is not None and info.data_coverage is not None and \
+                        info.data_coverage < min_data_coverage:
+                    logger.info('{0} is skipped, {1}% is covered by data'.format(scene, info.data_coverage))
+                    continue
+                kept.append(scene)
+
+        groups = OrderedDict()
+        if bands is not None:
+            groups[frozenset(self.resolve_bands(bands))] = kept
+        else:
+            for scene, available in zip(kept, _map_metadata(self.available_bands, kept)):
+                if not available:
+                    logger.error('{0} has no bands'.format(scene))
+                    errors.append((scene, None, RemoteFileDoesntExist('{0} has no bands'.format(scene))))
+                    continue
+                groups.setdefault(frozenset(available), []).append(scene)
+
+        downloaded = Scenes.concat(self.s3(group, set(wanted)) for wanted, group in groups.items())
+
+        scene_objs = Scenes([downloaded[scene] for scene in scenes if scene in downloaded])
+        scene_objs.errors.extend(errors)
+        scene_objs.errors.extend(downloaded.errors)
+        return scene_objs
+
+    def tile_info(self, scenes, discover_bands=False):
+        """ Fetches tileInfo.json of many tiles at once. The files are kept in the TILE_INFO_DIR folder of the
+        download directory, so every tile's metadata is downloaded once.
+        :param scenes:
+            A list of scenes
+        :type scenes:
+            List
+        :param discover_bands:
+            Pass true to find the bands of every tile with a listing of its folder
+        :type discover_bands:
+            bool
+        :returns:
+            (OrderedDict) TileInfo by scene, **None** for tiles that don't exist
+        """
+        return OrderedDict(zip(scenes, _map_metadata(lambda scene: self._tile_info(scene, discover_bands), scenes)))
+
+    def _tile_info(self, scene, discover_bands):
+        path = self.scene_interpreter(scene)
+        cache_path = os.path.join(self.download_dir, TILE_INFO_DIR, path.replace('/', '_') + '.json')
+
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                info = json.load(f)
+        else:
+            info = self._get_json(url_builder([self.S3_SENTINEL, path, 'tileInfo.json']))
+            if info is None:
+                return None
+
+            _write_json(cache_path, info)
+
+        return TileInfo.from_json(path, info, self.available_bands(scene) if discover_bands else None)
+
+    def _get_json(self, url):
+        """ Returns the decoded JSON document or **None** when it doesn't exist """
+        session = self.session or get_session()
+        with self._host_limiter.slot(url):
+            if self.throttle is not None:
+                self.throttle.request(url)
+            started = time.time()
+            try:
+                response = session.get(url)
+            except Exception as e:
+                emit(self._listener, FETCH, url, started, error=e)
+                raise
+        emit(self._listener, FETCH, url, started, bytes=len(response.content), status=response.status_code,
+             retries=response_retries(response))
+
+        # the bucket answers 403 instead of 404 to anonymous requests of missing keys
+        if response.status_code in (403, 404):
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def find_tiles(self, mgrs_tiles, start, end):
+        """ Finds the tile paths that exist for the MGRS tiles between two dates. Every tile is listed once per month
+        instead of probing candidate paths, the months are listed concurrently and the listings of past months are
+        kept in the TILE_INDEX_DIR folder of the download directory.
+        :param mgrs_tiles:
+            MGRS tiles, e.g. ['34RCS', '37TBG']
+        :type mgrs_tiles:
+            List
+        :param start:
+            First acquisition date
+        :type start:
+            datetime.date
+        :param end:
+            Last acquisition date
+        :type end:
+            datetime.date
+        :returns:
+            (List) tile paths like tiles/34/R/CS/2016/3/25/0 ordered by tile, date and sequence, ready for download
+        """
+        months = [(mgrs, year, month) for mgrs in mgrs_tiles for year, month in _months(start, end)]
+
+        paths = []
+        for month_paths in _map_metadata(lambda job: self._month_tiles(*job), months):
+            for path in month_paths:
+                if start <= self.parse_amazon_s3_tile_path(path)[3] <= end:
+                    paths.append(path)
+        return paths
+
+    def _month_tiles(self, mgrs, year, month):
+        """ Tile paths of an MGRS tile acquired in a month """
+        match = _MGRS_PATTERN.match(mgrs)
+        if match is None or match.end() != len(mgrs):
+            raise IncorrectSentine2SceneId('Incorrect MGRS tile {0} provided'.format(mgrs))
+
+        prefix = 'tiles/{0}/{1}/{2}/{3}/{4}/'.format(int(match.group(1)), match.group(2), match.group(3), year, month)
+        cache_path = os.path.join(self.download_dir, TILE_INDEX_DIR, prefix.strip('/').replace('/', '_') + '.json')
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                return json.load(f)
+
+        found = {}
+        for url in self.list_folder(self.S3_SENTINEL + prefix):
+            parsed = _TILE_PATH_PATTERN.match(url[len(self.S3_SENTINEL):])
+            if parsed is not None:
+                found[parsed.group(0)] = (int(parsed.group('day')), int(parsed.group('seq')))
+        paths = sorted(found, key=found.get)
+
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        if (datetime.date.today() - next_month).days >= MONTH_COMPLETE_AFTER:
+            _write_json(cache_path, paths)
+        return paths
+
+    def available_bands(self, scene):
+        """ Finds the bands of a tile with a single listing of its folder instead of a HEAD request per band.
+        :returns:
+            (List) band ids, e.g. [1, 2, 3, 4, 5, 6, 7, 8, '8A', 9, 10, 11, 12]
+        """
+        prefix = url_builder([self.S3_SENTINEL, self.scene_interpreter(scene)]) + '/'
+        bands = []
+        for url in self.list_folder(prefix):
+            match = _BAND_FILE_PATTERN.match(url[len(prefix):])
+            if match:
+                band = match.group(1)
+                bands.append(int(band) if band.isdigit() else band)
+        return sorted(bands, key=lambda band: (int(str(band).rstrip('A')), str(band)))
+
+    def iter_download(self, scenes, bands):
+        """
+        Download scenes like download does, but yield every scene as soon as its files are on disk.
+        When max_workers is greater than one scenes are yielded in completion order.
+        :param scenes:
+            A list of scenes
+        :type scenes:
+            Iterable
+        :param bands:
+            A list of bands.
+        :type scenes:
+            List
+        :returns:
+            (Generator) of downloaded scenes
+        """
+        bands = self.resolve_bands(bands)
+        return self._iter_download(scenes, bands, lambda scene: self._s3_plan(scene, bands))
+
     @classmethod
     def parse_sentinel_scene_id(cls, scene_id):
         splitted = scene_id.split('_')
@@ -87,8 +402,7 @@ class Sentinel2(S3DownloadMixin):
             else:
                 sequence = int(splitted[-1])
                 date = datetime.datetime.strptime(splitted[2], '%Y%m%d')
-                pattern = re.compile('(\d+)([A-Z])([A-Z]{2})')
-                mgrs = pattern.match(splitted[3])
+                mgrs = _MGRS_PATTERN.match(splitted[3])
 
                 if mgrs:
                     utm = int(mgrs.group(1))
@@ -103,12 +417,7 @@ class Sentinel2(S3DownloadMixin):
 
     @classmethod
     def parse_amazon_s3_tile_path(cls, path):
-        match = re.match(
-            re.compile(
-                r'tiles/(?P<utm>\d{2})/(?P<lat_band>[C-X])/(?P<square>[A-Z]{2})/(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<seq>\d{1,2})'
-            ),
-            path
-        )
+        match = _TILE_PATH_PATTERN.match(path)
         if match:
             date = datetime.date(int(match.group('year')), int(match.group('month')), int(match.group('day')))
             return match.group('utm'), match.group('lat_band'), match.group('square'), date, match.group('seq')
@@ -123,7 +432,7 @@ class Sentinel2(S3DownloadMixin):
         :param scene_name:
         :returns:
         """
-        assert isinstance(scene_name, (str, unicode))
+        assert isinstance(scene_name, string_types)
 
         if '/' in scene_name and 'tiles' in scene_name:
             return scene_name
@@ -140,6 +449,87 @@ class Sentinel2(S3DownloadMixin):
             sequence
         )
 
+    @classmethod
+    def shard_key(cls, scene_name):
+        """ MGRS tile of the scene, e.g. 34RCS, scenes of the same tile share a bucket folder """
+        utm, latitude_band, grid_square, _, _ = cls.parse_amazon_s3_tile_path(cls.scene_interpreter(scene_name))
+        return '{0}{1}{2}'.format(utm, latitude_band, grid_square)
+
+    @classmethod
+    def scene_interpreter_batch(cls, scene_names, as_array=False):
+        """ Parses many scene IDs or AWS S3 tile paths at once.
+        :param scene_names:
+            Scene IDs like S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.01 or S2A_tile_20160530_56WNV_0,
+            or tile paths like tiles/34/R/CS/2016/3/25/0
+        :type scene_names:
+            Iterable
+        :param as_array:
+            Pass true to get the columns as a NumPy structured array
+        :type as_array:
+            bool
+        :returns:
+            ParsedScenes with index, scene, path, utm, latitude_band, grid_square, date and sequence columns of the
+            valid names, where index is the position of the name in scene_names and path is the AWS S3 tile path,
+            and (index, message) pairs of the invalid names
+        """
+        columns = OrderedDict((name, []) for name in ('index', 'scene', 'path', 'utm', 'latitude_band', 'grid_square',
+                                                      'date', 'sequence'))
+        index, scene_column, path_column, utm_column, band_column, square_column, date_column, sequence_column = \
+            columns.values()
+        errors = []
+        tile_path_match = _TILE_PATH_PATTERN.match
+        scene_id_search = _SCENE_ID_PATTERN.search
+        tile_id_match = _TILE_ID_PATTERN.match
+        # inventories repeat acquisition dates a lot, so every date is parsed once
+        dates = {}
+
+        for i, name in enumerate(scene_names):
+            if not isinstance(name, string_types):
+                errors.append((i, 'Incorrect Scene for Sentinel-2 provided: {0!r}'.format(name)))
+                continue
+
+            if '/' in name and 'tiles' in name:
+                parsed = tile_path_match(name)
+                if parsed is not None:
+                    utm, latitude_band, grid_square, year, month, day, sequence = parsed.groups()
+            else:
+                parsed = scene_id_search(name)
+                if parsed is not None:
+                    year, month, day, utm, latitude_band, grid_square, sequence = parsed.groups()
+                    sequence = int(sequence) - 1
+                else:
+                    parsed = tile_id_match(name)
+                    if parsed is not None:
+                        year, month, day, utm, latitude_band, grid_square, sequence = parsed.groups()
+
+            if parsed is None:
+                errors.append((i, 'Incorrect Scene for Sentinel-2 provided: {0!r}'.format(name)))
+                continue
+
+            date = dates.get((year, month, day))
+            if date is None:
+                try:
+                    date = dates[year, month, day] = datetime.date(int(year), int(month), int(day))
+                except ValueError as e:
+                    errors.append((i, '{0}: {1}'.format(name, e)))
+                    continue
+
+            utm = int(utm)
+            sequence = int(sequence)
+            index.append(i)
+            scene_column.append(name)
+            path_column.append(name if '/' in name else 'tiles/{0}/{1}/{2}/{3}/{4}/{5}/{6}'.format(
+                utm, latitude_band, grid_square, date.year, date.month, date.day, sequence))
+            utm_column.append(utm)
+            band_column.append(latitude_band)
+            square_column.append(grid_square)
+            date_column.append(date)
+            sequence_column.append(sequence)
+
+        if as_array:
+            columns = columns_to_array(columns, cls._BATCH_DTYPES)
+        return ParsedScenes(columns, errors)
+
     @classmethod
     def amazon_s3_url(cls, path, band, suffix='B', frmt='jp2'):
         """
@@ -0,0 +1,289 @@
+"""
+Sharded downloads across processes and hosts
+
+A single process saturates one core well before the network when it runs hundreds of concurrent
+streams. download_sharded splits the scenes into shards by a stable hash of their bucket folder (path/row
+for Landsat8, MGRS tile for Sentinel2), downloads every shard in a worker process and merges the resulting
+Scenes back in the parent.
+
+With a shard directory on a shared file system several hosts split the same download: every host
+runs download_sharded with the same scenes, the first one writes the manifest, and a shard is taken by
+whoever creates its lock file first.
+
+    >>> scenes = download_sharded(Landsat8, product_ids, [4, 3, 2], '/data/imagery', processes=8,
+    ...                           shard_dir='/shared/run-1', max_workers=16)
+"""
+import errno
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import time
+
+from .download import Scenes, download_each
+
+logger = logging.getLogger('sdownloader')
+
+MANIFEST_FILENAME = 'manifest.json'
+# results are read by hosts that may run another Python version
+PICKLE_PROTOCOL = 2
+
+
+def shard_index(key, shards):
+    """ Shard of a key, the same in every process and on every host unlike the builtin hash """
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16) % shards
+
+
+def partition(downloader_class, scenes, shards):
+    """ Splits the scenes by the shard_key of the downloader class.
+    :param downloader_class:
+        Landsat8, Sentinel2 or a subclass
+    :param scenes:
+        Scene names
+    :type scenes:
+        List
+    :param shards:
+        Number of shards
+    :type shards:
+        int
+    :returns:
+        (List) of scene lists, one per shard, scenes keep their order within a shard
+    """
+    parts = [[] for _ in range(shards)]
+    for scene in scenes:
+        try:
+            key = downloader_class.shard_key(scene)
+        except Exception:
+            # the worker reports the invalid scene
+            key = scene
+        parts[shard_index(key, shards)].append(scene)
+    return parts
+
+
+class ShardDirectory(object):
+    """ Directory shared by the hosts of a sharded download.
+
+    It keeps the manifest, a lock file of every taken shard and the pickled Scenes of every finished one.
+    """
+
+    def __init__(self, path, stale_after=None):
+        """
+        :param path:
+            Directory on a file system every host can write to
+        :type path:
+            String
+        :param stale_after:
+            Seconds after which the lock of a shard that doesn't make progress can be taken over,
+            locks are never taken over by default
+        :type stale_after:
+            float
+        """
+        self.path = path
+        self.stale_after = stale_after
+
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    def _file(self, shard, suffix):
+        return os.path.join(self.path, 'shard-{0:05d}{1}'.format(shard, suffix))
+
+    def manifest(self, scenes, shards):
+        """ Writes the manifest unless another host already did.
+        :returns:
+            (Dict) scenes and shards of the manifest, the same on every host
+        :raises ValueError:
+            When the manifest lists other scenes
+        """
+        path = os.path.join(self.path, MANIFEST_FILENAME)
+        temp_path = '{0}.{1}-{2}'.format(path, socket.gethostname(), os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'scenes': scenes, 'shards': shards}, f)
+
+        try:
+            # linking fails when the manifest exists, so it is never seen half written
+            os.link(temp_path, path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        finally:
+            os.remove(temp_path)
+
+        with open(path) as f:
+            manifest = json.load(f)
+
+        if manifest['scenes'] != list(scenes):
+            raise ValueError('{0} lists other scenes'.format(path))
+        return manifest
+
+    def claim(self, shard):
+        """ Takes the shard unless it is done or another process holds its lock.
+        :returns:
+            (bool) True when the shard is taken
+        """
+        if self.done(shard):
+            return False
+
+        lock_path = self._file(shard, '.lock')
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+                if not self._take_over(lock_path):
+                    return False
+                continue
+
+            os.write(fd, '{0} {1} {2}\n'.format(socket.gethostname(), os.getpid(), time.time()).encode('utf-8'))
+            os.close(fd)
+            return True
+        return False
+
+    def _take_over(self, lock_path):
+        """ Moves a stale lock aside, only one of the processes that try succeeds """
+        try:
+            if self.stale_after is None or time.time() - os.path.getmtime(lock_path) < self.stale_after:
+                return False
+            os.rename(lock_path, '{0}.stale-{1}-{2}'.format(lock_path, socket.gethostname(), os.getpid()))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return False
+
+        logger.warning('{0} was stale and is taken over'.format(lock_path))
+        return True
+
+    def touch(self, shard):
+        """ Tells the other hosts that the shard still makes progress """
+        os.utime(self._file(shard, '.lock'), None)
+
+    def release(self, shard):
+        """ Removes the lock of an unfinished shard, so another process can take it """
+        os.remove(self._file(shard, '.lock'))
+
+    def done(self, shard):
+        return os.path.exists(self._file(shard, '.pickle'))
+
+    def complete(self, shard, scenes):
+        """ Stores the Scenes of a finished shard """
+        path = self._file(shard, '.pickle')
+        temp_path = '{0}.{1}-{2}'.format(path, socket.gethostname(), os.getpid())
+        with open(temp_path, 'wb') as f:
+            pickle.dump(scenes, f, PICKLE_PROTOCOL)
+        os.rename(temp_path, path)
+
+    def results(self, shards):
+        """ Merges the Scenes of the finished shards of all the hosts """
+        scenes_objs = []
+        for shard in range(shards):
+            if self.done(shard):
+                with open(self._file(shard, '.pickle'), 'rb') as f:
+                    scenes_objs.append(pickle.load(f))
+        return Scenes.concat(scenes_objs)
+
+
+def _download_shard(task):
+    """ Downloads the scenes of a shard in a worker process.
+    :returns:
+        Scenes or **None** when another process took the shard
+    """
+    downloader_class, download_dir, shard, scenes, bands, shard_dir, options = task
+
+    if shard_dir is not None and not shard_dir.claim(shard):
+        return None
+
+    logger.info('Shard {0}: {1} scenes'.format(shard, len(scenes)))
+    try:
+        downloader = downloader_class(download_dir, **options)
+
+        scene_objs = Scenes()
+        for scene_obj in download_each(downloader, scenes, bands):
+            if scene_obj.files or any(url is not None for url, _ in scene_obj.errors):
+                scene_objs.add(scene_obj)
+            scene_objs.errors.extend((scene_obj.name, url, error) for url, error in scene_obj.errors)
+            if shard_dir is not None:
+                shard_dir.touch(shard)
+    except BaseException:
+        if shard_dir is not None:
+            shard_dir.release(shard)
+        raise
+
+    if shard_dir is not None:
+        shard_dir.complete(shard, scene_objs)
+    return scene_objs
+
+
+def download_sharded(downloader_class, scenes, bands, download_dir, processes=None, shards=None, shard_dir=None,
+                     stale_after=None, **options):
+    """ Downloads the scenes with a pool of processes, every process downloads whole shards.
+    :param downloader_class:
+        Landsat8, Sentinel2 or a subclass defined at module level, so the processes can import it
+    :param scenes:
+        Scene names
+    :type scenes:
+        List
+    :param bands:
+        Bands of every scene
+    :type bands:
+        List
+    :param processes:
+        Number of worker processes, the number of CPUs by default. With one process the shards are downloaded
+        in the calling process.
+    :type processes:
+        int
+    :param shards:
+        Number of shards, four per process by default so that uneven shards are spread over the processes.
+        With a shard directory that already has a manifest the number of the manifest is used.
+    :type shards:
+        int
+    :param shard_dir:
+        Directory shared by all the hosts that take part in the download
+    :type shard_dir:
+        String
+    :param stale_after:
+        Seconds after which a shard of a host that stopped making progress is taken over
+    :type stale_after:
+        float
+    :param options:
+        Keyword arguments of the downloader constructor, every process creates its own downloader,
+        so they have to be picklable
+    :returns:
+        Scenes of the shards downloaded by this host merged in shard order. The scenes of all the hosts are
+        returned by ShardDirectory(shard_dir).results(shards) once every shard is done.
+    """
+    if not isinstance(scenes, list):
+        raise ValueError('Expected scene list')
+
+    processes = processes or multiprocessing.cpu_count()
+    shards = shards or processes * 4
+
+    directory = None
+    if shard_dir is not None:
+        directory = ShardDirectory(shard_dir, stale_after=stale_after)
+        shards = directory.manifest(scenes, shards)['shards']
+
+    tasks = [(downloader_class, download_dir, shard, part, bands, directory, options)
+             for shard, part in enumerate(partition(downloader_class, scenes, shards)) if part]
+
+    if processes == 1:
+        results = [_download_shard(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(min(processes, len(tasks)) or 1)
+        try:
+            results = pool.map(_download_shard, tasks, chunksize=1)
+        except BaseException:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    return Scenes.concat(result for result in results if result is not None)
@@ -0,0 +1,85 @@
+import threading
+
+# Landsat8 source selection modes
+FIXED_ORDER = 'fixed'
+RANKED = 'ranked'
+RACE = 'race'
+
+# Transfer size the expected cost of a source is estimated for
+TYPICAL_FILE_SIZE = 50 * 1024 * 1024
+
+
+class _SourceStats(object):
+
+    def __init__(self):
+        self.probes = 0
+        self.misses = 0
+        self.latency = None
+        self.throughput = None
+
+
+class SourceRanker(object):
+    """ Ranks download sources by latency, throughput and miss rate measured across a session """
+
+    def __init__(self, smoothing=0.3):
+        """
+        :param smoothing:
+            Weight of the newest measurement in the moving averages of latency and throughput
+        :type smoothing:
+            float
+        """
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _average(self, current, measurement):
+        if current is None:
+            return measurement
+        return self.smoothing * measurement + (1 - self.smoothing) * current
+
+    def record_probe(self, source, seconds, found):
+        """ Records a HEAD request to the source and whether the file was there """
+        with self._lock:
+            stats = self._stats.setdefault(source, _SourceStats())
+            stats.probes += 1
+            if not found:
+                stats.misses += 1
+            stats.latency = self._average(stats.latency, seconds)
+
+    def record_transfer(self, source, size, seconds):
+        """ Records a download of size bytes from the source """
+        if seconds <= 0 or not size:
+            return
+
+        with self._lock:
+            stats = self._stats.setdefault(source, _SourceStats())
+            stats.throughput = self._average(stats.throughput, size / float(seconds))
+
+    def score(self, source, default_throughput=None):
+        """ Expected seconds to get a typical file from the source, misses included. Unmeasured sources score 0.
+        :param default_throughput:
+            Bytes per second assumed for a source nothing was downloaded from yet
+        :type default_throughput:
+            float
+        """
+        with self._lock:
+            stats = self._stats.get(source)
+            if stats is None or not stats.probes:
+                return 0.0
+
+            cost = stats.latency
+            throughput = stats.throughput or default_throughput
+            if throughput:
+                cost += TYPICAL_FILE_SIZE / throughput
+            hit_rate = 1 - stats.misses / float(stats.probes)
+
+        return cost / max(hit_rate, 0.01)
+
+    def rank(self, sources):
+        """ Returns the sources ordered from the cheapest, ties keep their original order """
+        with self._lock:
+            measured = [self._stats[s].throughput for s in sources if s in self._stats and self._stats[s].throughput]
+
+        # sources without transfers are assumed to be as fast as the average of the others
+        default_throughput = sum(measured) / len(measured) if measured else None
+        return sorted(sources, key=lambda source: self.score(source, default_throughput))
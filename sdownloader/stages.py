@@ -0,0 +1,200 @@
+"""
+Stages that process every file as soon as it is downloaded
+
+A stage is a callable stage(path, band, scene) that returns the path of the file that replaces the
+downloaded one, usually the same path. Landsat8 and Sentinel2 run their stages in a pool of threads
+while the next files are fetched, so every file is processed while it is still in the page cache.
+
+    >>> Sentinel2('./imagery', stages=[CloudOptimizedGeoTIFF()], stage_workers=4)
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from .common import PART_SUFFIX
+from .integrity import checksum_path
+
+logger = logging.getLogger('sdownloader')
+
+DEFAULT_STAGE_WORKERS = 2
+
+
+class Pipeline(object):
+    """ Stages run one after another on every file, files are processed by a pool of threads.
+    The threads exist while downloads run, see running.
+    """
+
+    def __init__(self, stages, workers=DEFAULT_STAGE_WORKERS):
+        """
+        :param stages:
+            Callables that receive the path, band and scene of a file and return the path of the result
+        :type stages:
+            List
+        :param workers:
+            Number of files processed at once
+        :type workers:
+            int
+        """
+        self.stages = list(stages)
+        self.workers = workers
+        self._pool = None
+        # number of downloads that use the pool
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, path, band, scene):
+        for stage in self.stages:
+            path = stage(path, band, scene)
+        return path
+
+    def submit(self, func, *args):
+        """ Runs func in the pool.
+        :returns:
+            multiprocessing.pool.AsyncResult
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+        return self._pool.apply_async(func, args)
+
+    @contextmanager
+    def running(self):
+        """ Keeps the pool for a download, it is closed when the last download that uses it finishes """
+        with self._lock:
+            self._users += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._users -= 1
+                pool = None
+                if self._users == 0:
+                    pool, self._pool = self._pool, None
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def close(self):
+        """ Waits for the submitted files and stops the threads """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+class CloudOptimizedGeoTIFF(object):
+    """ Converts JPEG2000 and GeoTIFF bands to internally tiled, compressed GeoTIFFs with overviews.
+
+    The raster is copied strip by strip into a tiled GeoTIFF next to the output where the overviews are built,
+    then written with the overviews ahead of the image data, the layout cloud-optimized GeoTIFF readers expect.
+    Only a strip of blocksize rows is held in memory. GDAL releases the GIL while it decodes and compresses,
+    so the pool threads convert files in parallel.
+    Requires rasterio.
+    """
+
+    EXTENSIONS = ('.jp2', '.tif', '.tiff')
+
+    def __init__(self, blocksize=512, compress='deflate', overview_resampling='average', min_overview_size=256,
+                 suffix='.cog.tif', keep_original=False):
+        """
+        :param blocksize:
+            Width and height of the tiles, a multiple of 16
+        :type blocksize:
+            int
+        :param compress:
+            GDAL compression, e.g. deflate, lzw or zstd
+        :type compress:
+            String
+        :param overview_resampling:
+            Name of a rasterio.enums.Resampling method
+        :type overview_resampling:
+            String
+        :param min_overview_size:
+            Overviews are halved until their shorter side would get below this number of pixels
+        :type min_overview_size:
+            int
+        :param suffix:
+            Replaces the extension of the converted file, e.g. B04.jp2 becomes B04.cog.tif
+        :type suffix:
+            String
+        :param keep_original:
+            Pass true to keep the downloaded file next to the converted one. Without the original (or a
+            sdownloader.catalog.Catalog) the next download of the scene fetches the file again.
+        :type keep_original:
+            bool
+        """
+        try:
+            import rasterio  # noqa: F401
+        except ImportError:
+            raise ImportError('CloudOptimizedGeoTIFF requires rasterio, install sdownloader[cog]')
+
+        if blocksize % 16:
+            raise ValueError('blocksize must be a multiple of 16')
+
+        self.blocksize = blocksize
+        self.compress = compress
+        self.overview_resampling = overview_resampling
+        self.min_overview_size = min_overview_size
+        self.suffix = suffix
+        self.keep_original = keep_original
+
+    def overview_factors(self, width, height):
+        factors = []
+        factor = 2
+        while min(width, height) // factor >= self.min_overview_size:
+            factors.append(factor)
+            factor *= 2
+        return factors
+
+    def __call__(self, path, band, scene):
+        if path.endswith(self.suffix) or not path.lower().endswith(self.EXTENSIONS):
+            return path
+
+        import rasterio
+        import rasterio.shutil
+        from rasterio.enums import Resampling
+        from rasterio.windows import Window
+
+        output = os.path.splitext(path)[0] + self.suffix
+        if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path):
+            # converted by an earlier download that kept the original
+            return output
+
+        part_path = output + PART_SUFFIX
+        # the overviews are built in a tiled copy, the output gets them ahead of the image data
+        tiles_path = output + '.tiles' + PART_SUFFIX
+        options = dict(tiled=True, blockxsize=self.blocksize, blockysize=self.blocksize, compress=self.compress)
+
+        try:
+            with rasterio.open(path) as src:
+                profile = src.profile
+                profile.update(driver='GTiff', BIGTIFF='IF_SAFER', **options)
+                factors = self.overview_factors(src.width, src.height)
+
+                with rasterio.open(tiles_path, 'w', **profile) as dataset:
+                    for row in range(0, src.height, self.blocksize):
+                        window = Window(0, row, src.width, min(self.blocksize, src.height - row))
+                        dataset.write(src.read(window=window), window=window)
+                    dataset.update_tags(**src.tags())
+                    if factors:
+                        dataset.build_overviews(factors, Resampling[self.overview_resampling])
+                        dataset.update_tags(ns='rio_overview', resampling=self.overview_resampling)
+
+            rasterio.shutil.copy(tiles_path, part_path, driver='GTiff', copy_src_overviews=True, BIGTIFF='IF_SAFER',
+                                 **options)
+        finally:
+            if os.path.exists(tiles_path):
+                os.remove(tiles_path)
+
+        os.rename(part_path, output)
+        logger.info('{0} is converted to {1}'.format(path, output))
+
+        if not self.keep_original:
+            os.remove(path)
+            if os.path.exists(checksum_path(path)):
+                # the checksum is of the removed file
+                os.remove(checksum_path(path))
+        return output
@@ -0,0 +1,213 @@
+"""
+Blob store shared by download directories
+
+Downloaders with different download directories or relative_product_path_builder layouts on the same volume
+download a file only once when they share a BlobStore: the first fetch adds the file to the store and every
+later fetch of the same object links it into its own layout.
+
+    >>> store = BlobStore('/data/blobs')
+    >>> Landsat8('/data/team-a', store=store)
+    >>> Landsat8('/data/team-b', relative_product_path_builder=by_path_row, store=store)
+"""
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import socket
+import threading
+from contextlib import contextmanager
+
+from .common import check_create_folder
+from .integrity import CHECKSUM_SUFFIX, hash_file, read_checksum, write_checksum, checksum_path
+
+logger = logging.getLogger('sdownloader')
+
+# How files are materialized from the store
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+SYMLINK = 'symlink'
+COPY = 'copy'
+
+# ioctl that clones a file on copy-on-write file systems like btrfs and XFS
+_FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    import fcntl
+
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _place(source, target, mode):
+    """ Makes target a link or a copy of source, copies when the file system can't link """
+    try:
+        if mode == HARDLINK:
+            os.link(source, target)
+        elif mode == REFLINK:
+            _reflink(source, target)
+        elif mode == SYMLINK:
+            os.symlink(os.path.abspath(source), target)
+        else:
+            shutil.copyfile(source, target)
+        return
+    except (OSError, IOError, ImportError) as e:
+        if mode == COPY:
+            raise
+        logger.warning('{0} of {1} failed, copying it: {2}'.format(mode, source, e))
+
+    if os.path.lexists(target):
+        os.remove(target)
+    shutil.copyfile(source, target)
+
+
+class BlobStore(object):
+    """ Downloaded files by content.
+
+    A file is keyed by the MD5 of its content when the remote metadata tells it, so the same file from S3 and
+    Google Storage is stored once, otherwise by its url, ETag, size and modification time.
+    """
+
+    def __init__(self, path, link=HARDLINK):
+        """
+        :param path:
+            Directory of the store, hard links and reflinks need it on the same volume as the download directories
+        :type path:
+            String
+        :param link:
+            How files are materialized in download directories: hardlink, reflink (copy-on-write clone), symlink
+            or copy. Links fall back to copies across volumes. Hard linked files share their content with the
+            store, so they have to be replaced rather than modified in place.
+        :type link:
+            String
+        """
+        if link not in (HARDLINK, REFLINK, SYMLINK, COPY):
+            raise ValueError('{0} - link mode is not supported'.format(link))
+
+        self.path = path
+        self.link_mode = link
+        # lock and number of users of every key fetched at the moment
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+        check_create_folder(path)
+
+    @staticmethod
+    def key(remote):
+        if remote.md5 is not None:
+            return 'md5', remote.md5
+
+        identity = '{0} {1} {2} {3}'.format(remote.url, remote.etag, remote.content_length, remote.last_modified)
+        return 'url', hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def blob_path(self, remote):
+        kind, digest = self.key(remote)
+        return os.path.join(self.path, kind, digest[:2], digest)
+
+    @contextmanager
+    def lock(self, remote):
+        """ Keeps other threads from fetching the same file at the same time """
+        key = self.key(remote)
+        with self._locks_lock:
+            lock, users = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (lock, users + 1)
+
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
+
+    def link(self, remote, file_path, verify=False):
+        """ Materializes a stored file at file_path.
+        :param verify:
+            Pass true to check the stored file against the remote checksum and store the checksum next to
+            file_path, see sdownloader.integrity
+        :type verify:
+            bool
+        :returns:
+            (bool) False when the file isn't in the store
+        """
+        blob = self.blob_path(remote)
+        if not os.path.exists(blob):
+            return False
+        if remote.content_length is not None and os.path.getsize(blob) != remote.content_length:
+            logger.warning('{0} has the wrong size, it is downloaded again'.format(blob))
+            return False
+
+        checksum = None
+        if verify:
+            checksum = read_checksum(blob) or hash_file(blob)
+            if remote.md5 is not None and checksum != remote.md5:
+                logger.warning('{0} does not match its checksum, it is downloaded again'.format(blob))
+                return False
+
+        if not (os.path.exists(file_path) and os.path.samefile(blob, file_path)):
+            temp_path = '{0}.{1}-{2}'.format(file_path, socket.gethostname(), os.getpid())
+            _place(blob, temp_path, self.link_mode)
+            self._replace(temp_path, file_path)
+
+        if checksum is not None:
+            write_checksum(file_path, checksum)
+        return True
+
+    def add(self, remote, file_path):
+        """ Adds a downloaded file to the store.
+        :returns:
+            (String) Path of the stored file
+        """
+        blob = self.blob_path(remote)
+        if os.path.exists(blob):
+            # another process stored it meanwhile
+            return blob
+
+        check_create_folder(os.path.dirname(blob))
+        temp_path = '{0}.{1}-{2}'.format(blob, socket.gethostname(), os.getpid())
+        # the stored file is never a symbolic link to a download directory
+        _place(file_path, temp_path, HARDLINK if self.link_mode == SYMLINK else self.link_mode)
+        self._replace(temp_path, blob)
+
+        checksum = read_checksum(file_path)
+        if checksum is not None:
+            write_checksum(blob, checksum)
+        return blob
+
+    @staticmethod
+    def _replace(temp_path, path):
+        try:
+            os.rename(temp_path, path)
+        except OSError as exc:
+            # Windows doesn't rename over existing files
+            if exc.errno != errno.EEXIST:
+                raise
+            os.remove(path)
+            os.rename(temp_path, path)
+
+    def prune(self):
+        """ Removes stored files that no download directory links to anymore. Only hard links can be counted,
+        so the store has to use the hardlink mode.
+        :returns:
+            (int) Number of removed files
+        """
+        if self.link_mode != HARDLINK:
+            raise ValueError('Files can be pruned in the {0} mode only'.format(HARDLINK))
+
+        removed = 0
+        for root, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if filename.endswith(CHECKSUM_SUFFIX) or os.stat(path).st_nlink > 1:
+                    continue
+
+                os.remove(path)
+                if os.path.exists(checksum_path(path)):
+                    os.remove(checksum_path(path))
+                removed += 1
+        return removed
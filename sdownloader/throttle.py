@@ -0,0 +1,122 @@
+import heapq
+import itertools
+import threading
+import time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# Priorities of requests waiting for a bucket, lower goes first
+HIGH = 0
+NORMAL = 1
+
+
+class TokenBucket(object):
+    """ Token bucket that hands out tokens to waiting threads by priority and then in arrival order """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate:
+            Tokens added per second
+        :type rate:
+            float
+        :param capacity:
+            Maximum number of tokens the bucket saves up for a burst, one second worth of tokens by default
+        :type capacity:
+            float
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount=1, priority=NORMAL):
+        """ Blocks until the tokens are available.
+        Amounts larger than the capacity are granted once the bucket is full and leave the bucket in debt.
+        """
+        needed = min(amount, self.capacity)
+
+        with self._condition:
+            waiter = (priority, next(self._counter))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] != waiter:
+                        # a more urgent or an earlier request is served first
+                        self._condition.wait()
+                    elif self._tokens >= needed:
+                        self._tokens -= amount
+                        return
+                    else:
+                        self._condition.wait((needed - self._tokens) / self.rate)
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+
+class Throttle(object):
+    """ Limits bytes and requests per second to every host, shared by all fetches and probes """
+
+    def __init__(self, bytes_per_second=None, requests_per_second=None, hosts=None):
+        """
+        :param bytes_per_second:
+            Default bandwidth limit of a host
+        :type bytes_per_second:
+            float
+        :param requests_per_second:
+            Default request rate limit of a host
+        :type requests_per_second:
+            float
+        :param hosts:
+            Limits of particular hosts, e.g. {'sentinel-s2-l1c.s3.amazonaws.com': {'requests_per_second': 50}}
+        :type hosts:
+            dict
+        """
+        self.bytes_per_second = bytes_per_second
+        self.requests_per_second = requests_per_second
+        self.hosts = hosts or {}
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _host_buckets(self, url):
+        host = urlparse(url).netloc
+
+        with self._lock:
+            if host not in self._buckets:
+                limits = self.hosts.get(host, {})
+                bytes_per_second = limits.get('bytes_per_second', self.bytes_per_second)
+                requests_per_second = limits.get('requests_per_second', self.requests_per_second)
+                self._buckets[host] = (
+                    TokenBucket(bytes_per_second) if bytes_per_second else None,
+                    TokenBucket(requests_per_second) if requests_per_second else None
+                )
+            return self._buckets[host]
+
+    def limits_bytes(self, url):
+        """ Whether the bytes received from the url's host are limited """
+        bytes_bucket, _ = self._host_buckets(url)
+        return bytes_bucket is not None
+
+    def request(self, url, priority=NORMAL):
+        """ Blocks until a request to the url's host is allowed """
+        _, requests_bucket = self._host_buckets(url)
+        if requests_bucket is not None:
+            requests_bucket.consume(1, priority)
+
+    def transfer(self, url, size, priority=NORMAL):
+        """ Blocks until size more bytes may be received from the url's host """
+        bytes_bucket, _ = self._host_buckets(url)
+        if bytes_bucket is not None:
+            bytes_bucket.consume(size, priority)
@@ -42,6 +42,14 @@ setup(
     include_package_data=True,
     author='Alireza J (scisco)',
     install_requires=install_requires,
+    entry_points={
+        'console_scripts': ['sdownloader=sdownloader.cli:main'],
+    },
+    extras_require={
+        'async': ['aiohttp'],
+        'numpy': ['numpy'],
+        'cog': ['rasterio'],
+    },
     dependency_links=dependency_links,
     author_email='alireza@developmentseed.org',
     setup_requires=['pytest-runner'],
@@ -0,0 +1,119 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+import unittest
+from tempfile import mkdtemp
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from sdownloader.download import Scenes
+
+
+@unittest.skipIf(sys.version_info < (3, 5) or aiohttp is None, 'asyncio downloads require Python 3.5+ and aiohttp')
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        import asyncio
+        from functools import partial
+        from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+        from sdownloader import aio
+
+        self.aio = aio
+        self.loop = asyncio.new_event_loop()
+        self.temp_folder = mkdtemp()
+        self.remote_folder = mkdtemp()
+        self.paths = ['tiles/34/R/CS/2016/3/25/0', 'tiles/37/T/BG/2016/3/20/0']
+
+        for path in self.paths:
+            os.makedirs(os.path.join(self.remote_folder, path))
+            for band in ('B02', 'B03', 'B04'):
+                with open(os.path.join(self.remote_folder, path, band + '.jp2'), 'wb') as f:
+                    f.write(band.encode() * 100)
+
+        handler = partial(SimpleHTTPRequestHandler, directory=self.remote_folder)
+        handler.log_message = lambda *args: None
+        self.server = HTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever).start()
+
+        class LocalSentinel2(aio.AsyncSentinel2):
+            S3_SENTINEL = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+
+        self.downloader = LocalSentinel2(download_dir=self.temp_folder, max_concurrency=4)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.loop.close()
+        for folder in (self.temp_folder, self.remote_folder):
+            try:
+                shutil.rmtree(folder)
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+
+    def test_download(self):
+        results = self.loop.run_until_complete(self.downloader.download(self.paths, [4, 3, 2]))
+
+        self.assertTrue(isinstance(results, Scenes))
+        self.assertEqual(results.scenes, self.paths)
+        self.assertEqual(results.errors, [])
+        for scene in results:
+            self.assertEqual(len(scene.files), 3)
+            for path in scene.files:
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), os.path.basename(path)[:3].encode() * 100)
+
+    def test_download_missing_scene(self):
+        missing = 'tiles/1/C/AA/2016/1/1/0'
+        results = self.loop.run_until_complete(self.downloader.download(self.paths[:1] + [missing], [4]))
+
+        self.assertEqual(results.scenes, self.paths[:1])
+        self.assertEqual(results.errors[0][0], missing)
+
+    def test_download_completes_truncated_file(self):
+        folder = os.path.join(self.temp_folder, self.paths[0].replace('/', '_'))
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'B04.jp2'), 'wb') as f:
+            f.write(b'B04' * 10)
+
+        results = self.loop.run_until_complete(self.downloader.download(self.paths[:1], [4]))
+
+        with open(results[0].files[0], 'rb') as f:
+            self.assertEqual(f.read(), b'B04' * 100)
+
+    def test_landsat8_probe_is_not_shadowed(self):
+        from sdownloader.landsat8 import Landsat8
+
+        self.assertIs(self.aio.AsyncLandsat8._probe, Landsat8._probe)
+
+    def test_download_reports_unplannable_scene(self):
+        results = self.loop.run_until_complete(self.downloader.download(self.paths[:1] + ['not a scene'], [4]))
+
+        self.assertEqual(results.scenes, self.paths[:1])
+        self.assertEqual(len(results.errors), 1)
+        self.assertEqual(results.errors[0][:2], ('not a scene', None))
+
+    def test_download_keeps_larger_file(self):
+        folder = os.path.join(self.temp_folder, self.paths[0].replace('/', '_'))
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'B04.jp2'), 'wb') as f:
+            f.write(b'B04' * 200)
+
+        results = self.loop.run_until_complete(self.downloader.download(self.paths[:1], [4]))
+
+        with open(results[0].files[0], 'rb') as f:
+            self.assertEqual(f.read(), b'B04' * 200)
+        self.assertFalse(os.path.exists(results[0].files[0] + '.part'))
+
+    def test_aiohttp_session_is_kept_apart(self):
+        session = object()
+        downloader = self.aio.AsyncSentinel2(download_dir=self.temp_folder, session=session)
+
+        self.assertIs(downloader._aio_session, session)
+        self.assertIsNot(downloader.session, session)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader import common, errors
+from sdownloader.cache import MetadataCache
+from sdownloader.common import RemoteMetadata
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.url = 'https://s3-us-west-2.amazonaws.com/landsat-pds/c1/L8/012/019/' + \
+                   'LC08_L1TP_012019_20170411_20170415_01_T1/LC08_L1TP_012019_20170411_20170415_01_T1_B4.TIF'
+
+    def _session(self, status):
+        session = mock.Mock()
+        session.head.return_value.status_code = status
+        session.head.return_value.headers = {'content-length': '10'} if status == 200 else {}
+        return session
+
+    def test_negative_results_are_cached(self):
+        cache = MetadataCache()
+        session = self._session(404)
+
+        for _ in range(3):
+            with self.assertRaises(errors.RemoteFileDoesntExist):
+                common.remote_file_exists(self.url, session=session, cache=cache)
+
+        self.assertEqual(session.head.call_count, 1)
+
+    def test_server_errors_are_not_cached(self):
+        cache = MetadataCache()
+        session = self._session(503)
+
+        for _ in range(2):
+            common.get_remote_metadata(self.url, session=session, cache=cache)
+
+        self.assertEqual(session.head.call_count, 2)
+
+    def test_lru_eviction(self):
+        cache = MetadataCache(maxsize=2)
+        for i in range(3):
+            cache.set(RemoteMetadata('url{0}'.format(i), 200, i, None, None))
+            # keep the first url recently used
+            cache.get('url0')
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get('url0'))
+        self.assertIsNone(cache.get('url1'))
+        self.assertIsNotNone(cache.get('url2'))
+
+    @mock.patch('sdownloader.cache.time')
+    def test_ttl(self, fake_time):
+        fake_time.time.return_value = 1000
+        cache = MetadataCache(ttl=10)
+        cache.set(RemoteMetadata(self.url, 200, 10, None, None))
+
+        fake_time.time.return_value = 1010
+        self.assertIsNotNone(cache.get(self.url))
+        fake_time.time.return_value = 1011
+        self.assertIsNone(cache.get(self.url))
+
+    def test_persistence(self):
+        temp_folder = mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_folder)
+        path = os.path.join(temp_folder, 'probes.json')
+
+        remote = RemoteMetadata(self.url, 404, None, None, None)
+        cache = MetadataCache(path=path)
+        cache.set(remote)
+        cache.save()
+
+        self.assertEqual(MetadataCache(path=path).get(self.url), remote)
@@ -0,0 +1,79 @@
+import errno
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.catalog import Catalog
+from sdownloader.common import RemoteMetadata
+from sdownloader.download import Scenes
+from sdownloader.landsat8 import Landsat8
+from sdownloader.sentinel2 import Sentinel2
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.products = ['LC08_L1TP_012019_20170411_20170415_01_T1', 'LC08_L1TP_136030_20140713_20170421_01_T1']
+        self.paths = ['tiles/34/R/CS/2016/3/25/0', 'tiles/37/T/BG/2016/3/20/0']
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _fake_fetch(self, url, path, **kwargs):
+        file_path = os.path.join(path, os.path.basename(url))
+        open(file_path, 'w').close()
+        return file_path
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_download_skips_catalogued_scenes(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = self._fake_fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 10, 'etag', None)
+
+        catalog = Catalog(self.temp_folder)
+        l = Landsat8(download_dir=self.temp_folder, catalog=catalog)
+        first = l.download(self.products, [4])
+        self.assertEqual(fake_fetch.call_count, 8)
+
+        fake_fetch.reset_mock()
+        fake_remote_file_exists.reset_mock()
+        second = l.download(self.products, [4])
+
+        self.assertFalse(fake_fetch.called)
+        self.assertFalse(fake_remote_file_exists.called)
+        self.assertEqual(second.scenes, first.scenes)
+        self.assertEqual(sorted(second[self.products[0]].files), sorted(first[self.products[0]].files))
+
+        # a deleted file is downloaded again
+        os.remove(first[self.products[1]].files[0])
+        l.download(self.products, [4])
+        self.assertEqual(fake_fetch.call_count, 4)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_query(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = self._fake_fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 10, 'etag', None)
+
+        catalog = Catalog(os.path.join(self.temp_folder, 'index.sqlite'))
+        Landsat8(download_dir=self.temp_folder, catalog=catalog).download(self.products, [4])
+        Sentinel2(download_dir=self.temp_folder, catalog=catalog).download(self.paths, [4, 3])
+
+        results = catalog.scenes(path='012', row='019')
+        self.assertTrue(isinstance(results, Scenes))
+        self.assertEqual(results.scenes, self.products[:1])
+        self.assertEqual(len(results[0].files), 4)
+
+        self.assertEqual(catalog.scenes(satellite='landsat8', start='2014-01-01', end='2014-12-31').scenes,
+                         self.products[1:])
+        self.assertEqual(catalog.scenes(mgrs='37TBG').scenes, self.paths[1:])
+        self.assertEqual(catalog.scenes(satellite='sentinel2').scenes, list(reversed(self.paths)))
+        self.assertEqual(catalog.files(self.paths[0])[0][2:], (10, 'etag', None, 'amazon'))
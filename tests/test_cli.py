@@ -0,0 +1,117 @@
+import errno
+import json
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+import requests
+
+from sdownloader import cli
+from sdownloader.common import RemoteMetadata
+from sdownloader.metrics import Event, FETCH
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.download_dir = os.path.join(self.temp_folder, 'imagery')
+        self.scenes = ['tiles/34/R/CS/2016/3/25/0', 'tiles/37/T/BG/2016/3/20/0']
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _manifest(self, name, content):
+        path = os.path.join(self.temp_folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    @staticmethod
+    def _fake_fetch(url, path, **kwargs):
+        file_path = os.path.join(path, url.split('/')[-1])
+        with open(file_path, 'w') as f:
+            f.write('band')
+        return file_path
+
+    def test_read_manifest(self):
+        csv_manifest = self._manifest('scenes.csv', 'scene,bands\n{0},4 3\n{1},red\n'.format(*self.scenes))
+        jsonl_manifest = self._manifest('scenes.jsonl', '{"scene": "LC08", "bands": [4], "satellite": "landsat8"}\n')
+
+        self.assertEqual(cli.read_manifest(csv_manifest),
+                         [(self.scenes[0], [4, 3], None), (self.scenes[1], ['red'], None)])
+        self.assertEqual(cli.read_manifest(jsonl_manifest), [('LC08', [4], 'landsat8')])
+        self.assertEqual(cli.guess_satellite('LC08_L1TP_012019_20170411_20170415_01_T1'), 'landsat8')
+        self.assertEqual(cli.guess_satellite(self.scenes[0]), 'sentinel2')
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_restart_skips_journaled_bands(self, fake_fetch, fake_remote_file_exists):
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 4, None, None)
+        manifest = self._manifest('scenes.csv', 'scene,bands\n{0},4 3\n{1},4 3\n'.format(*self.scenes))
+
+        def interrupted_fetch(url, path, **kwargs):
+            if url.endswith('37/T/BG/2016/3/20/0/B03.jp2'):
+                raise IOError('connection reset')
+            return self._fake_fetch(url, path)
+
+        fake_fetch.side_effect = interrupted_fetch
+        self.assertEqual(cli.main([manifest, '-d', self.download_dir, '-w', '2']), 1)
+
+        journal = os.path.join(self.download_dir, cli.JOURNAL_FILENAME)
+        with open(journal) as f:
+            self.assertEqual(len([json.loads(line) for line in f]), 3)
+
+        fake_fetch.reset_mock()
+        fake_fetch.side_effect = self._fake_fetch
+        self.assertEqual(cli.main([manifest, '-d', self.download_dir, '-w', '1']), 0)
+
+        fetched = [c[0][0] for c in fake_fetch.call_args_list]
+        self.assertEqual(len(fetched), 1)
+        self.assertTrue(fetched[0].endswith('37/T/BG/2016/3/20/0/B03.jp2'))
+
+    def test_invalid_entries_are_reported(self):
+        journal = cli.Journal(os.path.join(self.temp_folder, 'journal.jsonl'))
+        try:
+            jobs = [('LC08_broken', [4], 'landsat8'), (self.scenes[0], [], None)]
+            summary = cli.run(jobs, self.download_dir, journal)
+        finally:
+            journal.close()
+
+        self.assertEqual(len(summary.errors), 2)
+        self.assertEqual(summary.files, 0)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_concurrent_scene_failures_are_recorded(self, fake_fetch, fake_remote_file_exists):
+        def probe(url, **kwargs):
+            if self.scenes[0] in url:
+                raise requests.ConnectionError('connection refused')
+            return RemoteMetadata(url, 200, 4, None, None)
+
+        def fetch(url, path, listener=None, **kwargs):
+            file_path = self._fake_fetch(url, path)
+            if not url.endswith('B03.jp2'):
+                # B03 is on disk already, nothing is transferred
+                listener(Event(FETCH, url, 0.1, bytes=4))
+            return file_path
+
+        fake_remote_file_exists.side_effect = probe
+        fake_fetch.side_effect = fetch
+        journal = cli.Journal(os.path.join(self.temp_folder, 'journal.jsonl'))
+        try:
+            jobs = [(scene, [4, 3, 2], None) for scene in self.scenes]
+            summary = cli.run(jobs, self.download_dir, journal, max_workers=4)
+        finally:
+            journal.close()
+
+        self.assertEqual([(scene, url) for scene, url, _ in summary.errors], [(self.scenes[0], None)])
+        self.assertEqual(summary.files, 3)
+        self.assertEqual(summary.bytes, 8)
+        self.assertEqual(len(journal), 3)
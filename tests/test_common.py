@@ -1,5 +1,7 @@
 import os
+import shutil
 import unittest
+from tempfile import mkdtemp
 
 from mock import mock
 from sdownloader.common import fetch
@@ -17,9 +19,164 @@ class Tests(unittest.TestCase):
 
     @mock.patch('sdownloader.common.download')
     def test_fetch(self, mock_download):
-        download_dir = 'dir'
-        self.assertTrue(fetch(self.file_url, download_dir))
-        mock_download.assert_called_with(self.file_url, download_dir, show_progress=mock.ANY)
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        mock_download.side_effect = lambda url, path, show_progress=False: open(path, 'wb').close()
+
+        path = fetch(self.file_url, download_dir)
+        self.assertTrue(os.path.exists(path))
+        mock_download.assert_called_with(self.file_url, path + common.PART_SUFFIX, show_progress=mock.ANY)
+
+    def test_fetch_with_session(self):
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+
+        session = mock.Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {'content-length': '6'}
+        session.get.return_value.iter_content.return_value = [b'abc', b'def']
+
+        path = fetch(self.file_url, download_dir, session=session)
+
+        session.get.assert_called_with(self.file_url, stream=True, headers={})
+        self.assertFalse(session.head.called)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+        # without metadata of an earlier probe the GET response tells that the file is missing
+        session.get.return_value.status_code = 404
+        with self.assertRaises(errors.RemoteFileDoesntExist):
+            fetch(self.file_url.replace('.TIF', '_missing.TIF'), download_dir, session=session)
+        self.assertFalse(session.head.called)
+
+    def test_fetch_resumes_truncated_file(self):
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        file_path = os.path.join(download_dir, os.path.basename(self.file_url))
+        with open(file_path, 'wb') as f:
+            f.write(b'abc')
+
+        session = mock.Mock()
+        session.get.return_value.status_code = 206
+        session.get.return_value.headers = {'content-length': '3'}
+        session.get.return_value.iter_content.return_value = [b'def']
+        remote = common.RemoteMetadata(self.file_url, 200, 6, None, None)
+
+        self.assertEqual(fetch(self.file_url, download_dir, session=session, remote=remote), file_path)
+
+        session.get.assert_called_with(self.file_url, stream=True, headers={'Range': 'bytes=3-'})
+        self.assertFalse(os.path.exists(file_path + common.PART_SUFFIX))
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+    def test_fetch_keeps_file_without_known_remote_size(self):
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        file_path = os.path.join(download_dir, os.path.basename(self.file_url))
+        with open(file_path, 'wb') as f:
+            f.write(b'abcdef')
+
+        session = mock.Mock()
+        for remote in (common.RemoteMetadata(self.file_url, 404, 9, None, None),
+                       common.RemoteMetadata(self.file_url, 200, None, None, None),
+                       common.RemoteMetadata(self.file_url, 200, 3, None, None)):
+            self.assertEqual(fetch(self.file_url, download_dir, session=session, remote=remote), file_path)
+
+        self.assertFalse(session.get.called)
+        self.assertFalse(os.path.exists(file_path + common.PART_SUFFIX))
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdef')
+
+    def test_fetch_segmented(self):
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        content = bytes(bytearray(range(256))) * 4
+
+        def get(url, stream=False, headers=None):
+            start, end = [int(b) for b in headers['Range'].split('=')[1].split('-')]
+            response = mock.Mock(status_code=206)
+            response.iter_content.return_value = [content[start:end + 1]]
+            return response
+
+        session = mock.Mock()
+        session.get.side_effect = get
+        remote = common.RemoteMetadata(self.file_url, 200, len(content), None, None)
+
+        path = fetch(self.file_url, download_dir, session=session, remote=remote, connections=3, segment_size=100,
+                     segment_threshold=512)
+
+        self.assertEqual(session.get.call_count, 11)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_fetch_segmented_versions(self):
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        content = bytes(bytearray(range(256))) * 4
+        etags = []
+
+        def get(url, stream=False, headers=None):
+            etags.append(headers.get('If-Match'))
+            start, end = [int(b) for b in headers['Range'].split('=')[1].split('-')]
+            # the file is replaced while its last segment is requested
+            return mock.Mock(status_code=412 if end == len(content) - 1 else 206,
+                             iter_content=mock.Mock(return_value=[content[start:end + 1]]))
+
+        session = mock.Mock()
+        session.get.side_effect = get
+        remote = common.RemoteMetadata(self.file_url, 200, len(content), '0123456789abcdef', None)
+
+        with self.assertRaises(IOError):
+            fetch(self.file_url, download_dir, session=session, remote=remote, connections=3, segment_size=100,
+                  segment_threshold=512)
+
+        self.assertEqual(set(etags), set(['"0123456789abcdef"']))
+        self.assertEqual(os.listdir(download_dir), [])
+
+    @mock.patch('sdownloader.common.download')
+    def test_fetch_existing_file_with_metadata(self, mock_download):
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+        with open(os.path.join(download_dir, 'LC08_L1TP_175037_20170503_20170503_01_RT_B11.TIF'), 'wb') as f:
+            f.write(b'abcdef')
+
+        session = mock.Mock()
+        remote = common.RemoteMetadata(self.file_url, 200, 6, 'etag', None)
+        fetch(self.file_url, download_dir, session=session, remote=remote)
+
+        self.assertFalse(session.head.called)
+        self.assertFalse(session.get.called)
+        self.assertFalse(mock_download.called)
+
+    def test_remote_metadata(self):
+        session = mock.Mock()
+        session.head.return_value.status_code = 200
+        session.head.return_value.headers = {'content-length': '44129543', 'etag': '"abc"',
+                                             'last-modified': 'Wed, 03 May 2017 13:42:12 GMT'}
+
+        remote = common.remote_file_exists(self.file_url, session=session)
+        self.assertEqual(remote, common.RemoteMetadata(self.file_url, 200, self.file_size, 'abc',
+                                                       'Wed, 03 May 2017 13:42:12 GMT'))
+        self.assertEqual(session.head.call_count, 1)
+
+        session.head.return_value.status_code = 404
+        with self.assertRaises(errors.RemoteFileDoesntExist):
+            common.remote_file_exists(self.file_url, session=session)
+
+    def test_create_session(self):
+        session = common.create_session(pool_size=4, max_retries=2)
+        adapter = session.get_adapter(self.file_url)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIs(common.get_session(), common.get_session())
+
+    def test_host_limiter(self):
+        limiter = common.HostLimiter(1)
+        with limiter.slot(self.file_url):
+            # another host is not blocked
+            with limiter.slot(sdownloader.Landsat8.S3_LANDSAT_BASE_URL):
+                pass
+            self.assertFalse(limiter._semaphores['storage.googleapis.com'].acquire(False))
 
     def test_remote_file_size(self):
         size = common.get_remote_file_size(self.file_url)
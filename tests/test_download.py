@@ -0,0 +1,52 @@
+import os
+import pickle
+import unittest
+
+from sdownloader.download import Scene, Scenes
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = os.path.join('data', 'LC08_L1TP_012029_20170411_20170415_01_T1')
+        self.files = [os.path.join(self.folder, 'LC08_L1TP_012029_20170411_20170415_01_T1_B{0}.TIF'.format(band))
+                      for band in (4, 3)]
+
+    def test_scene_files(self):
+        scene = Scene('LC08_L1TP_012029_20170411_20170415_01_T1', self.files, bands=[4, 3])
+        scene.add(os.path.join(self.folder, 'LC08_L1TP_012029_20170411_20170415_01_T1_MTL.txt'), 'MTL')
+
+        self.assertEqual(scene.files[:2], self.files)
+        self.assertEqual(scene.bands, [4, 3, 'MTL'])
+
+        # files outside of the scene folder are kept as they are
+        scene.add('file.tif')
+        self.assertEqual(scene.files, self.files + [scene.files[2], 'file.tif'])
+        self.assertEqual(scene.bands, [4, 3, 'MTL', None])
+
+        copy = pickle.loads(pickle.dumps(scene, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((copy.name, copy.files, copy.bands), (scene.name, scene.files, scene.bands))
+
+    def test_scenes_lookup(self):
+        scenes = Scenes([Scene('a', ['a.tif']), Scene('b', ['b.tif'])])
+        self.assertEqual(len(scenes), 2)
+        self.assertEqual(scenes['b'].files, ['b.tif'])
+
+        other = Scenes([Scene('c'), Scene('a', ['a2.tif'])])
+        other.errors.append(('d', None, IOError()))
+        scenes.merge(other)
+
+        self.assertEqual([s.name for s in scenes], ['a', 'b', 'c', 'a'])
+        self.assertEqual(len(scenes), 3)
+        self.assertEqual(scenes['a'].files, ['a2.tif'])
+        self.assertTrue('c' in scenes)
+        self.assertEqual(len(scenes.errors), 1)
+
+        scenes[1] = Scene('e')
+        self.assertFalse('b' in scenes)
+        self.assertEqual(scenes['e'], scenes[1])
+        self.assertEqual(sorted(scenes.scenes_dict), ['a', 'c', 'e'])
+
+    def test_concat(self):
+        scenes = Scenes.concat([Scenes([Scene(str(i))]) for i in range(5)])
+        self.assertEqual(scenes.scenes, ['0', '1', '2', '3', '4'])
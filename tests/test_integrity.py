@@ -0,0 +1,77 @@
+import base64
+import errno
+import hashlib
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader import integrity
+from sdownloader.common import fetch, RemoteMetadata
+from sdownloader.errors import ChecksumMismatch
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.url = 'http://sentinel-s2-l1c.s3.amazonaws.com/tiles/34/R/CS/2016/3/25/0/B04.jp2'
+        self.content = b'sentinel' * 1000
+        self.md5 = hashlib.md5(self.content).hexdigest()
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _session(self, content):
+        session = mock.Mock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {'content-length': str(len(content))}
+        session.get.return_value.iter_content.return_value = [content[:100], content[100:]]
+        return session
+
+    def test_remote_md5(self):
+        headers = {'etag': '"{0}"'.format(self.md5)}
+        self.assertEqual(RemoteMetadata.from_headers(self.url, 200, headers).md5, self.md5)
+
+        headers = {'etag': '"{0}-3"'.format(self.md5)}
+        self.assertIsNone(RemoteMetadata.from_headers(self.url, 200, headers).md5)
+
+        goog_hash = 'crc32c=n03x6A==,md5=' + base64.b64encode(hashlib.md5(self.content).digest()).decode('ascii')
+        headers = {'etag': 'CJyq8/mT/NMCEAE=', 'x-goog-hash': goog_hash}
+        self.assertEqual(RemoteMetadata.from_headers(self.url, 200, headers).md5, self.md5)
+
+    def test_fetch_verifies_streamed_checksum(self):
+        remote = RemoteMetadata(self.url, 200, len(self.content), self.md5, None, self.md5)
+
+        path = fetch(self.url, self.temp_folder, session=self._session(self.content), remote=remote, verify=True)
+
+        self.assertEqual(integrity.read_checksum(path), self.md5)
+        self.assertEqual(integrity.verify(self.temp_folder), [])
+
+    def test_fetch_rejects_corrupted_file(self):
+        remote = RemoteMetadata(self.url, 200, len(self.content), self.md5, None, self.md5)
+        corrupted = b'S' + self.content[1:]
+
+        with self.assertRaises(ChecksumMismatch):
+            fetch(self.url, self.temp_folder, session=self._session(corrupted), remote=remote, verify=True)
+
+        self.assertEqual(os.listdir(self.temp_folder), [])
+
+    def test_verify_finds_corrupted_files(self):
+        folder = os.path.join(self.temp_folder, 'scene')
+        os.makedirs(folder)
+        for name in ('B01.jp2', 'B02.jp2'):
+            path = os.path.join(folder, name)
+            with open(path, 'wb') as f:
+                f.write(self.content)
+            integrity.write_checksum(path, integrity.hash_file(path))
+        with open(os.path.join(folder, 'B02.jp2'), 'r+b') as f:
+            f.write(b'S')
+
+        self.assertEqual(integrity.verify(self.temp_folder, workers=2), [os.path.join(folder, 'B02.jp2')])
@@ -1,3 +1,4 @@
+import datetime
 import errno
 import shutil
 import tarfile
@@ -5,7 +6,9 @@ import unittest
 from tempfile import mkdtemp
 
 import mock
+import requests
 
+from sdownloader.common import RemoteMetadata
 from sdownloader.download import Scenes, Scene
 from sdownloader.errors import IncorrectLandsat8SceneId, RemoteFileDoesntExist
 from sdownloader.landsat8 import Landsat8, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE
@@ -58,6 +61,52 @@ class Tests(unittest.TestCase):
         self.assertEqual(self.s3_products, results.scenes)
         self.assertEqual(len(results[self.s3_products[0]].files), 6)
 
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_concurrent_download(self, fake_fetch, fake_remote_file_exists):
+        """ Test that concurrent download fetches every band and gathers per-file errors """
+
+        def _fetch(url, path, **kwargs):
+            if url.endswith('_B3.TIF') and self.s3_products[1] in url:
+                raise IOError('Connection reset')
+            return url
+
+        fake_fetch.side_effect = _fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 1, None, None)
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4, max_connections_per_host=2)
+        results = l.download(self.s3_products, [4, 3, 2])
+
+        self.assertTrue(isinstance(results, Scenes))
+        self.assertEqual(self.s3_products, results.scenes)
+        self.assertEqual(fake_fetch.call_count, len(self.s3_products) * 6)
+        self.assertEqual(len(results[self.s3_products[0]].files), 6)
+        self.assertEqual(len(results[self.s3_products[1]].files), 5)
+        self.assertEqual(len(results.errors), 1)
+        self.assertEqual(results.errors[0][0], self.s3_products[1])
+
+    @mock.patch('sdownloader.landsat8.remote_file_exists')
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_concurrent_download_reports_unplannable_products(self, fake_fetch, fake_remote_file_exists,
+                                                              fake_google_remote_file_exists):
+        def remote_file_exists(url, **kwargs):
+            if self.s3_products[0] in url:
+                raise requests.ConnectionError('connection refused')
+            return RemoteMetadata(url, 200, 1, None, None)
+
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+        fake_remote_file_exists.side_effect = remote_file_exists
+        fake_google_remote_file_exists.side_effect = remote_file_exists
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=4)
+        results = l.download(self.s3_products + ['LC08_broken'], [4])
+
+        self.assertEqual(results.scenes, self.s3_products[1:])
+        self.assertEqual([product_id for product_id, _, _ in results.errors], [self.s3_products[0], 'LC08_broken'])
+        self.assertTrue(isinstance(results.errors[0][2], requests.ConnectionError))
+        self.assertTrue(isinstance(results.errors[1][2], IncorrectLandsat8SceneId))
+
     @mock.patch('sdownloader.common.download')
     def test_google(self, fake_download):
         fake_download.side_effect = self._landsat_download
@@ -77,6 +126,7 @@ class Tests(unittest.TestCase):
                 self.assertTrue(band_filepath.startswith(self.temp_folder))
 
     def _landsat_download(self, _, path, show_progress=False):
+        open(path, 'wb').close()
         return path
 
     @mock.patch('sdownloader.landsat8.Landsat8.s3')
@@ -118,3 +168,25 @@ class Tests(unittest.TestCase):
 
         # Test with incorrect input
         self.assertRaises(Exception, Landsat8.scene_interpreter, 'LC80030172015001LGN')
+
+    def test_scene_interpreter_batch(self):
+        product_ids = [self.product_id, 'LC80030172015001LGN', None, 'LC08_L1TP_174037_20171326_20170502_01_T1']
+        parsed = Landsat8.scene_interpreter_batch(product_ids)
+
+        self.assertEqual(parsed.columns['index'], [0])
+        self.assertEqual(parsed.columns['path'], [174])
+        self.assertEqual(parsed.columns['row'], [37])
+        self.assertEqual(parsed.columns['date'], [datetime.date(2017, 4, 26)])
+        self.assertEqual([i for i, _ in parsed.errors], [1, 2, 3])
+
+    def test_scene_interpreter_batch_array(self):
+        try:
+            import numpy
+        except ImportError:
+            raise unittest.SkipTest('numpy is not installed')
+
+        parsed = Landsat8.scene_interpreter_batch(self.all_scenes + ['broken'], as_array=True)
+
+        self.assertEqual(list(parsed.columns['row']), [19, 29, 30, 45])
+        self.assertEqual(parsed.columns['date'][0], numpy.datetime64('2017-04-11'))
+        self.assertEqual(parsed.errors[0][0], 4)
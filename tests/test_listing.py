@@ -0,0 +1,150 @@
+import errno
+import shutil
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.errors import RemoteFileDoesntExist
+from sdownloader.landsat8 import Landsat8
+from sdownloader.listing import BucketIndex, list_objects, split_s3_url, folder_url, LISTING
+from sdownloader.sentinel2 import Sentinel2
+
+S3_PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">
+    <Name>sentinel-s2-l1c</Name>
+    {contents}
+    <IsTruncated>{truncated}</IsTruncated>
+    {token}
+</ListBucketResult>"""
+
+S3_CONTENTS = """<Contents>
+        <Key>{key}</Key>
+        <LastModified>2016-03-25T17:01:16.000Z</LastModified>
+        <ETag>&quot;{etag}&quot;</ETag>
+        <Size>{size}</Size>
+    </Contents>"""
+
+
+def s3_page(keys, token=None):
+    contents = ''.join(S3_CONTENTS.format(key=key, etag='%032x' % i, size=1000 + i) for i, key in enumerate(keys))
+    return S3_PAGE.format(
+        contents=contents,
+        truncated='true' if token else 'false',
+        token='<NextContinuationToken>{0}</NextContinuationToken>'.format(token) if token else ''
+    ).encode('utf-8')
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.tile = 'tiles/34/R/CS/2016/3/25/0'
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _session(self, pages):
+        session = mock.Mock()
+        responses = []
+        for content in pages:
+            response = mock.Mock(status_code=200, content=content)
+            response.json.return_value = content
+            responses.append(response)
+        session.get.side_effect = responses
+        return session
+
+    def test_split_s3_url(self):
+        self.assertEqual(split_s3_url(Landsat8.S3_LANDSAT_BASE_URL + 'L8/012/029/'),
+                         ('https://s3-us-west-2.amazonaws.com/landsat-pds/', 'c1/L8/012/029/'))
+        self.assertEqual(split_s3_url(Sentinel2.S3_SENTINEL + self.tile),
+                         ('http://sentinel-s2-l1c.s3.amazonaws.com/', self.tile))
+        self.assertEqual(folder_url([Sentinel2.amazon_s3_url(self.tile, 4), Sentinel2.amazon_s3_url(self.tile, 11)]),
+                         Sentinel2.S3_SENTINEL + self.tile + '/')
+
+    def test_list_s3_pages(self):
+        session = self._session([
+            s3_page([self.tile + '/B01.jp2', self.tile + '/B02.jp2'], token='next'),
+            s3_page([self.tile + '/B03.jp2'])
+        ])
+
+        objects = list_objects(Sentinel2.S3_SENTINEL + self.tile + '/', session=session)
+
+        self.assertEqual(len(objects), 3)
+        remote = objects[Sentinel2.amazon_s3_url(self.tile, 2)]
+        self.assertEqual((remote.content_length, remote.md5), (1001, '%032x' % 1))
+        self.assertEqual(session.get.call_args_list[1][1]['params']['continuation-token'], 'next')
+
+    def test_list_google_storage(self):
+        session = self._session([
+            {'items': [{'name': 'LC08/01/012/029/LC08_L1TP_012029_20170411_20170415_01_T1/'
+                                'LC08_L1TP_012029_20170411_20170415_01_T1_B4.TIF',
+                        'size': '1000', 'md5Hash': 'AAAAAAAAAAAAAAAAAAAAAA==', 'etag': 'CJyq8/mT/NMCEAE='}]}
+        ])
+
+        objects = list_objects(Landsat8.GOOGLE_BASE_URL + 'LC08/01/012/029/', session=session)
+
+        url = Landsat8.google_storage_url(Landsat8.scene_interpreter('LC08_L1TP_012029_20170411_20170415_01_T1'), 4)
+        self.assertEqual(objects[url].content_length, 1000)
+        self.assertEqual(objects[url].md5, '0' * 32)
+        self.assertEqual(objects[url].etag, '0' * 32)
+        self.assertEqual(session.get.call_args[0][0],
+                         'https://storage.googleapis.com/storage/v1/b/gcp-public-data-landsat/o')
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_download_with_listing(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+        session = self._session([s3_page([self.tile + '/B03.jp2', self.tile + '/B04.jp2', self.tile + '/qi/x.gml'])])
+
+        s = Sentinel2(download_dir=self.temp_folder, session=session, discovery=LISTING)
+        results = s.download([self.tile], [4, 3])
+
+        self.assertEqual(session.get.call_count, 1)
+        self.assertFalse(fake_remote_file_exists.called)
+        self.assertEqual(len(results[0].files), 2)
+        self.assertEqual(sorted(c[1]['remote'].content_length for c in fake_fetch.call_args_list), [1000, 1001])
+
+        with self.assertRaises(RemoteFileDoesntExist):
+            s.download([self.tile], [5])
+        self.assertEqual(session.get.call_count, 1)
+
+    @mock.patch('sdownloader.listing.list_objects')
+    def test_bucket_index(self, fake_list_objects):
+        def list_objects(url_prefix, **kwargs):
+            time.sleep(0.05)
+            return dict((url_prefix + name, name) for name in ('B03.jp2', 'B04.jp2', '0/B04.jp2'))
+
+        fake_list_objects.side_effect = list_objects
+        index = BucketIndex()
+        folder = Sentinel2.S3_SENTINEL + self.tile + '/'
+
+        # threads asking for the same folder at once list it once
+        pool = ThreadPool(4)
+        try:
+            listings = pool.map(lambda _: index.list(folder), range(4))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(fake_list_objects.call_count, 1)
+        self.assertEqual([len(listing) for listing in listings], [3] * 4)
+
+        # folders inside a listed one are not listed again
+        self.assertEqual(list(index.list(folder + '0/').values()), ['0/B04.jp2'])
+        self.assertEqual(index.files([folder + '0/B04.jp2', folder + 'B03.jp2']), ['0/B04.jp2', 'B03.jp2'])
+        self.assertEqual(fake_list_objects.call_count, 1)
+        with self.assertRaises(RemoteFileDoesntExist):
+            index.files([folder + 'B05.jp2'])
+
+        # a failed listing is not kept
+        fake_list_objects.side_effect = IOError('connection reset')
+        with self.assertRaises(IOError):
+            index.list(Sentinel2.S3_SENTINEL + 'tiles/37/')
+        fake_list_objects.side_effect = list_objects
+        self.assertEqual(len(index.list(Sentinel2.S3_SENTINEL + 'tiles/37/')), 3)
@@ -0,0 +1,118 @@
+import errno
+import json
+import os
+import shutil
+import threading
+import unittest
+from tempfile import mkdtemp
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import mock
+
+from sdownloader.common import create_session, fetch
+from sdownloader.metrics import Event, Metrics, percentile, PROBE, FETCH, FOLDER
+from sdownloader.sentinel2 import Sentinel2
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.scenes = ['tiles/34/R/CS/2016/3/25/0', 'tiles/37/T/BG/2016/3/20/0']
+        self.url = 'http://sentinel-s2-l1c.s3.amazonaws.com/tiles/34/R/CS/2016/3/25/0/B04.jp2'
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_aggregation_and_export(self):
+        metrics = Metrics()
+        metrics(Event(PROBE, self.url, 0.02, status=200))
+        metrics(Event(PROBE, self.url, 0.2, status=200, retries=2))
+        metrics(Event(FETCH, self.url, 2.0, bytes=4 * 1048576, status=200))
+        metrics(Event(FETCH, self.url, 1.0, error=IOError('connection reset')))
+
+        host = metrics.summary()[FETCH]['sentinel-s2-l1c.s3.amazonaws.com']
+        self.assertEqual(host['count'], 2)
+        self.assertEqual(host['errors'], 1)
+        self.assertAlmostEqual(host['mb_per_second'], 4 / 3.0)
+        self.assertEqual(metrics.summary()[PROBE]['sentinel-s2-l1c.s3.amazonaws.com']['p99'], 0.2)
+        self.assertEqual(json.loads(metrics.to_json())[PROBE]['sentinel-s2-l1c.s3.amazonaws.com']['retries'], 2)
+
+        text = metrics.to_prometheus()
+        labels = 'kind="probe",host="sentinel-s2-l1c.s3.amazonaws.com"'
+        self.assertIn('sdownloader_request_seconds_bucket{{{0},le="0.05"}} 1'.format(labels), text)
+        self.assertIn('sdownloader_request_seconds_count{{{0}}} 2'.format(labels), text)
+        self.assertIn('sdownloader_retries_total{{{0}}} 2'.format(labels), text)
+
+    def test_download_reports_events(self):
+        content = b'sentinel' * 100
+        session = mock.Mock()
+        session.head.return_value.status_code = 200
+        session.head.return_value.headers = {'content-length': str(len(content))}
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {'content-length': str(len(content))}
+        session.get.return_value.iter_content.return_value = [content]
+
+        metrics = Metrics()
+        s = Sentinel2(download_dir=self.temp_folder, session=session, listener=metrics, max_workers=2)
+        s.download(self.scenes, [4, 3])
+
+        summary = metrics.summary()
+        probes = summary[PROBE]['sentinel-s2-l1c.s3.amazonaws.com']
+        fetches = summary[FETCH]['sentinel-s2-l1c.s3.amazonaws.com']
+        self.assertEqual(probes['count'], 4)
+        self.assertEqual(fetches['count'], 4)
+        self.assertEqual(fetches['bytes'], 4 * len(content))
+        self.assertEqual(fetches['sources'], ['amazon'])
+        self.assertEqual(summary[FOLDER]['']['count'], 2)
+
+    def test_fetch_counts_retries(self):
+        content = b'sentinel' * 100
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.path)
+                # the first request fails, urllib3 retries it
+                status = 503 if len(requests) == 1 else 200
+                body = content if status == 200 else b''
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            events = []
+            url = 'http://127.0.0.1:{0}/B04.jp2'.format(server.server_port)
+            path = fetch(url, self.temp_folder, session=create_session(backoff_factor=0), listener=events.append)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(len(requests), 2)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.path.basename(path), 'B04.jp2')
+        self.assertEqual([(e.kind, e.status, e.retries) for e in events], [(FETCH, 200, 1)])
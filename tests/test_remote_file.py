@@ -0,0 +1,151 @@
+import io
+import os
+import re
+import unittest
+
+import mock
+
+from sdownloader.common import RemoteMetadata
+from sdownloader.landsat8 import Landsat8
+from sdownloader.download import GOOGLE_PUBLIC_DATA_STORAGE_SERVICE
+from sdownloader.remote_file import RemoteFile
+from sdownloader.sentinel2 import Sentinel2
+
+try:
+    import numpy
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
+CONTENT = bytes(bytearray(i % 251 for i in range(10000)))
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    """ Serves content in ranges and records the requested ranges """
+
+    def __init__(self, etag='abc', content=CONTENT):
+        self.etag = etag
+        self.content = content
+        self.ranges = []
+
+    def get(self, url, headers=None, stream=False):
+        if headers.get('If-Match') != '"{0}"'.format(self.etag):
+            return FakeResponse(412, b'')
+        start, end = [int(n) for n in re.match(r'bytes=(\d+)-(\d+)', headers['Range']).groups()]
+        self.ranges.append((start, end))
+        return FakeResponse(206, self.content[start:end + 1])
+
+
+def remote(url='http://bucket/B04.TIF', size=len(CONTENT)):
+    return RemoteMetadata(url, 200, size, 'abc', None)
+
+
+class Tests(unittest.TestCase):
+
+    def test_read(self):
+        session = FakeSession()
+        f = RemoteFile('http://bucket/B04.TIF', session=session, remote=remote(), block_size=1000, cache_blocks=3,
+                       read_ahead=0)
+
+        self.assertEqual(f.read(10), CONTENT[:10])
+        f.seek(4990)
+        self.assertEqual(f.read(20), CONTENT[4990:5010])
+        self.assertEqual(session.ranges, [(0, 999), (4000, 5999)])
+
+        # cached blocks aren't fetched again
+        self.assertEqual(f.read_range(5500, 100), CONTENT[5500:5600])
+        self.assertEqual(f.tell(), 5010)
+        self.assertEqual(len(session.ranges), 2)
+
+        f.seek(-5, os.SEEK_END)
+        self.assertEqual(f.read(), CONTENT[-5:])
+        self.assertEqual(f.read(), b'')
+        self.assertEqual(session.ranges[-1], (9000, 9999))
+
+        # the least recently used block is dropped
+        self.assertEqual(f.read_range(0, 10), CONTENT[:10])
+        self.assertEqual(session.ranges[-1], (0, 999))
+        self.assertEqual(f.bytes_fetched, 5000)
+
+        # works with the io buffers raster libraries wrap files in
+        f.seek(0)
+        self.assertEqual(io.BufferedReader(f, 4096).read(), CONTENT)
+
+        f.close()
+        with self.assertRaises(ValueError):
+            f.read(1)
+
+    def test_read_ahead(self):
+        session = FakeSession()
+        f = RemoteFile('http://bucket/B04.TIF', session=session, remote=remote(), block_size=1000, read_ahead=2)
+
+        f.read(500)
+        f.read(1000)
+        self.assertEqual(session.ranges, [(0, 999), (1000, 3999)])
+        self.assertEqual(f.read(2500), CONTENT[1500:4000])
+        self.assertEqual(session.ranges[-1], (4000, 5999))
+        f.seek(9500)
+        self.assertEqual(f.read(), CONTENT[9500:])
+        self.assertEqual(f.requests, 4)
+
+    def test_changed_file(self):
+        f = RemoteFile('http://bucket/B04.TIF', session=FakeSession(etag='new'), remote=remote())
+        with self.assertRaises(IOError):
+            f.read(10)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    def test_open_band(self, fake_remote_file_exists):
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: remote(url)
+        session = FakeSession()
+
+        f = Sentinel2('.', session=session).open_band('tiles/34/R/CS/2016/3/25/0', 4, block_size=100)
+        self.assertEqual(f.url, Sentinel2.S3_SENTINEL + 'tiles/34/R/CS/2016/3/25/0/B04.jp2')
+        self.assertEqual(f.read(10), CONTENT[:10])
+        self.assertEqual(session.ranges, [(0, 99)])
+
+        f = Landsat8('.', session=session).open_band('LC08_L1TP_012029_20170411_20170415_01_T1', 4,
+                                                     source=GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)
+        self.assertTrue(f.url.startswith(Landsat8.GOOGLE_BASE_URL))
+        self.assertTrue(f.url.endswith('_B4.TIF'))
+
+    @unittest.skipIf(rasterio is None or not hasattr(rasterio, 'MemoryFile'), 'rasterio is not installed')
+    def test_rasterio_window(self):
+        data = numpy.arange(2048 * 2048, dtype='uint32').reshape(1, 2048, 2048)
+        with rasterio.MemoryFile() as memory:
+            with memory.open(driver='GTiff', width=2048, height=2048, count=1, dtype='uint32', crs='EPSG:32618',
+                             transform=from_origin(600000, 4900000, 30, 30), tiled=True, blockxsize=256,
+                             blockysize=256) as dataset:
+                dataset.write(data)
+            content = memory.read()
+
+        f = RemoteFile('http://bucket/B04.TIF', session=FakeSession(content=content),
+                       remote=remote(size=len(content)), block_size=64 * 1024)
+        try:
+            with rasterio.open(f.name, opener=f.open) as src:
+                window = src.read(1, window=Window(1024, 1024, 256, 256))
+        except TypeError:
+            self.skipTest('rasterio does not support openers')
+
+        self.assertTrue((window == data[0, 1024:1280, 1024:1280]).all())
+        self.assertLess(f.bytes_fetched, len(content) // 10)
@@ -0,0 +1,88 @@
+import csv
+import datetime
+import errno
+import gzip
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from sdownloader.scene_index import SceneIndex
+
+HEADER = ['productId', 'entityId', 'acquisitionDate', 'cloudCover', 'processingLevel', 'path', 'row']
+
+
+def product_id(path, row, date, category='T1'):
+    return 'LC08_L1TP_{0:03d}{1:03d}_{2:%Y%m%d}_{2:%Y%m%d}_01_{3}'.format(path, row, date, category)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.scene_list = os.path.join(self.temp_folder, 'scene_list.csv')
+        self.day = datetime.date(2017, 4, 11)
+        self.rows = []
+        for days in range(0, 160, 16):
+            date = self.day + datetime.timedelta(days=days)
+            for path, row in ((12, 29), (12, 30), (13, 29)):
+                self.rows.append([product_id(path, row, date), 'LC8', date.isoformat(), str(days % 50), 'L1TP',
+                                  str(path), str(row)])
+        # other missions and broken rows are skipped
+        self.rows.append(['LE07_L1TP_012029_20170419_20170515_01_T1', 'LE7', '2017-04-19', '3', 'L1TP', '12', '29'])
+        self.rows.append(['', 'LC8', '', '', '', '', ''])
+        self.write(self.rows)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def write(self, rows, path=None):
+        path = path or self.scene_list
+        with (gzip.open(path, 'wt') if path.endswith('.gz') else open(path, 'w')) as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+
+    def test_query(self):
+        index = SceneIndex(os.path.join(self.temp_folder, 'index'))
+        self.assertEqual(index.update(self.scene_list), 30)
+
+        found = index.query([(12, 29), (13, 29)], self.day, self.day + datetime.timedelta(days=32))
+        self.assertEqual(found, [product_id(12, 29, self.day + datetime.timedelta(days=d)) for d in (0, 16, 32)] +
+                                [product_id(13, 29, self.day + datetime.timedelta(days=d)) for d in (0, 16, 32)])
+        self.assertEqual(len(index.query([(12, 30)])), 10)
+        self.assertEqual(index.query([(12, 30)], max_cloud_cover=15),
+                         [product_id(12, 30, self.day + datetime.timedelta(days=d)) for d in (0, 64, 112)])
+        self.assertEqual(index.query([(1, 1)]), [])
+
+    def test_update(self):
+        folder = os.path.join(self.temp_folder, 'index')
+        index = SceneIndex(folder)
+        index.update(self.scene_list)
+
+        later = self.day + datetime.timedelta(days=400)
+        new_rows = [[product_id(12, 29, later, 'RT'), 'LC8', later.isoformat(), '1', 'L1TP', '12', '29']]
+        self.write(self.rows + new_rows)
+        self.assertEqual(index.update(self.scene_list), 1)
+        self.assertEqual(index.update(self.scene_list), 0)
+
+        # the columns are memory-mapped by the next process
+        index = SceneIndex(folder)
+        self.assertEqual(len(index), 31)
+        self.assertEqual(index.query([(12, 29)], start=later), [product_id(12, 29, later, 'RT')])
+
+        # another scene list replaces the index
+        gzipped = os.path.join(self.temp_folder, 'scene_list.gz')
+        self.write(new_rows, gzipped)
+        self.assertEqual(index.update(gzipped), 1)
+        self.assertEqual(len(index), 1)
@@ -5,10 +5,14 @@ import unittest
 from tempfile import mkdtemp
 
 import datetime
+import types
+
 import mock
 
+from sdownloader.common import RemoteMetadata
 from sdownloader.download import Scenes
-from sdownloader.errors import IncorrectSentine2SceneId
+from sdownloader.errors import IncorrectSentine2SceneId, RemoteFileDoesntExist
+from sdownloader.listing import LISTING
 from sdownloader.sentinel2 import Sentinel2
 
 
@@ -77,6 +81,72 @@ class Tests(unittest.TestCase):
         total = sum([len(s.files) for s in results])
         self.assertEqual(total, len(self.paths) * 3)
 
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_iter_download(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = self._fake_fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 1, None, None)
+
+        l = Sentinel2(download_dir=self.temp_folder)
+        results = l.iter_download(self.paths, [4, 3, 2])
+
+        self.assertTrue(isinstance(results, types.GeneratorType))
+        self.assertFalse(fake_fetch.called)
+        self.assertEqual([s.name for s in results], self.paths)
+        self.assertEqual(fake_fetch.call_count, len(self.paths) * 3)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_iter_download_concurrently(self, fake_fetch, fake_remote_file_exists):
+        def _fetch(url, path, **kwargs):
+            if url.endswith('B03.jp2') and self.paths[0] in url:
+                raise IOError('Connection reset')
+            return self._fake_fetch(url, path)
+
+        fake_fetch.side_effect = _fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 1, None, None)
+
+        l = Sentinel2(download_dir=self.temp_folder, max_workers=2)
+        results = dict((s.name, s) for s in l.iter_download(self.paths, [4, 3, 2]))
+
+        self.assertEqual(sorted(results.keys()), sorted(self.paths))
+        self.assertEqual(len(results[self.paths[0]].files), 2)
+        self.assertEqual(len(results[self.paths[0]].errors), 1)
+        self.assertEqual(len(results[self.paths[1]].files), 3)
+        self.assertEqual(results[self.paths[1]].errors, [])
+
+        # scenes that fail before their files are fetched don't stop the others
+        def _remote_file_exists(url, **kwargs):
+            if self.paths[0] in url:
+                raise IOError('Connection refused')
+            return RemoteMetadata(url, 200, 1, None, None)
+
+        fake_remote_file_exists.side_effect = _remote_file_exists
+        results = dict((s.name, s) for s in l.iter_download(self.paths + ['garbage'], [4]))
+
+        self.assertEqual(sorted(results.keys()), sorted(self.paths + ['garbage']))
+        self.assertEqual(str(results[self.paths[0]].errors[0][1]), 'Connection refused')
+        self.assertTrue(isinstance(results['garbage'].errors[0][1], IncorrectSentine2SceneId))
+        self.assertEqual(len(results[self.paths[1]].files), 1)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_download_concurrently_reports_missing_scenes(self, fake_fetch, fake_remote_file_exists):
+        def remote_file_exists(url, **kwargs):
+            if self.paths[0] in url and url.endswith('B03.jp2'):
+                raise RemoteFileDoesntExist
+            return RemoteMetadata(url, 200, 1, None, None)
+
+        fake_fetch.side_effect = self._fake_fetch
+        fake_remote_file_exists.side_effect = remote_file_exists
+
+        results = Sentinel2(download_dir=self.temp_folder, max_workers=4).download(self.paths, [4, 3, 2])
+
+        self.assertEqual(results.scenes, self.paths[1:])
+        self.assertEqual(len(results[self.paths[1]].files), 3)
+        self.assertEqual([(scene, url) for scene, url, _ in results.errors], [(self.paths[0], None)])
+        self.assertTrue(isinstance(results.errors[0][2], RemoteFileDoesntExist))
+
     def test_parse_amazon_s3_path(self):
         self.assertTupleEqual(
             ('56', 'W', 'NV', datetime.date(2016, 5, 30), '0'),
@@ -104,7 +174,7 @@ class Tests(unittest.TestCase):
     def _custom_relative_path_builder(self, utm, lat, square, date, seq):
         return os.path.join('test', utm, lat, square, str(date), seq)
 
-    def _fake_fetch(self, url, path, show_progress=False):
+    def _fake_fetch(self, url, path, **kwargs):
         return os.path.join(path, os.path.basename(url))
 
     def test_amazon_s3_url_sentinel2(self):
@@ -134,3 +204,120 @@ class Tests(unittest.TestCase):
         with self.assertRaises(IncorrectSentine2SceneId):
             scene = 'S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.what'
             Sentinel2.scene_interpreter(scene)
+
+    def test_scene_interpreter_batch(self):
+        scenes = self.scenes + self.paths + ['S2A_tile_20160526_1VCH_0', 'tiles/34/R/CS/2016/13/25/0', 42,
+                                             'S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.what']
+        parsed = Sentinel2.scene_interpreter_batch(scenes)
+
+        self.assertEqual(parsed.columns['index'], [0, 1, 2, 3, 4])
+        self.assertEqual(parsed.columns['path'], self.paths + self.paths + ['tiles/1/V/CH/2016/5/26/0'])
+        self.assertEqual(parsed.columns['path'][:2], [Sentinel2.scene_interpreter(s) for s in self.scenes])
+        self.assertEqual(parsed.columns['utm'][:2], [34, 37])
+        self.assertEqual(parsed.columns['date'][0], datetime.date(2016, 3, 25))
+        self.assertEqual([i for i, _ in parsed.errors], [5, 6, 7])
+
+    def test_scene_interpreter_batch_array(self):
+        try:
+            import numpy
+        except ImportError:
+            raise unittest.SkipTest('numpy is not installed')
+
+        parsed = Sentinel2.scene_interpreter_batch(self.scenes, as_array=True)
+
+        self.assertEqual(list(parsed.columns['grid_square']), ['CS', 'BG'])
+        self.assertEqual(parsed.columns['date'][1], numpy.datetime64('2016-03-20'))
+
+    def _metadata_session(self):
+        tile_infos = {
+            self.paths[0]: {'path': self.paths[0], 'dataCoveragePercentage': 100.0, 'cloudyPixelPercentage': 12.5},
+            self.paths[1]: {'path': self.paths[1], 'dataCoveragePercentage': 100.0, 'cloudyPixelPercentage': 80.0},
+        }
+        listing = ''.join('<Contents><Key>{0}/{1}</Key><Size>10</Size></Contents>'.format(self.paths[0], name)
+                          for name in ('B01.jp2', 'B8A.jp2', 'B02.jp2', 'qi/MSK_CLOUDS_B00.gml', 'preview.jp2'))
+
+        def get(url, **kwargs):
+            if url.endswith('tileInfo.json'):
+                path = url[len(Sentinel2.S3_SENTINEL):-len('/tileInfo.json')]
+                response = mock.Mock(status_code=200 if path in tile_infos else 404, content=b'{}')
+                response.json.return_value = tile_infos.get(path)
+            else:
+                response = mock.Mock(status_code=200, content='<ListBucketResult>{0}</ListBucketResult>'.format(
+                    listing).encode('utf-8'))
+            return response
+
+        session = mock.Mock()
+        session.get.side_effect = get
+        return session
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_download_with_tile_info(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = self._fake_fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 1, None, None)
+        session = self._metadata_session()
+
+        l = Sentinel2(download_dir=self.temp_folder, session=session)
+        results = l.download(self.paths, max_cloud_cover=50)
+
+        self.assertEqual(results.scenes, self.paths[:1])
+        self.assertEqual(sorted(os.path.basename(f) for f in results[0].files), ['B01.jp2', 'B02.jp2', 'B8A.jp2'])
+        self.assertEqual(session.get.call_count, 3)
+
+        # tileInfo.json files are read from the download directory, only the tile folders are listed
+        infos = Sentinel2(download_dir=self.temp_folder, session=session).tile_info(self.scenes, discover_bands=True)
+        self.assertEqual(session.get.call_count, 5)
+        self.assertEqual(infos[self.scenes[1]].cloud_cover, 80.0)
+        self.assertEqual(infos[self.scenes[0]].bands, [1, 2, '8A'])
+
+        session.get.reset_mock()
+        missing = 'tiles/34/R/CS/2016/3/26/0'
+        results = l.download([self.paths[0], missing], [4], min_data_coverage=50)
+        self.assertEqual(session.get.call_count, 1)
+        self.assertEqual(results.scenes, self.paths[:1])
+        self.assertEqual(results.errors[0][:2], (missing, None))
+        self.assertTrue(isinstance(results.errors[0][2], RemoteFileDoesntExist))
+
+        # without a filter the bands are found with listings only
+        session.get.reset_mock()
+        results = l.download(self.paths[:1])
+        self.assertEqual(len(results[0].files), 3)
+        self.assertFalse(any(c[0][0].endswith('tileInfo.json') for c in session.get.call_args_list))
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_find_tiles(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = self._fake_fetch
+        keys = ['tiles/34/R/CS/2016/3/{0}/{1}'.format(acquisition, name)
+                for acquisition in ('5/0', '25/1', '25/0') for name in ('B04.jp2', 'tileInfo.json', 'qi/x.gml')]
+
+        def get(url, params=None, **kwargs):
+            listed = [key for key in keys if key.startswith(params['prefix'])]
+            contents = ''.join('<Contents><Key>{0}</Key><Size>10</Size></Contents>'.format(key) for key in listed)
+            return mock.Mock(status_code=200, content='<ListBucketResult>{0}</ListBucketResult>'.format(
+                contents).encode('utf-8'))
+
+        session = mock.Mock()
+        session.get.side_effect = get
+
+        l = Sentinel2(download_dir=self.temp_folder, session=session, discovery=LISTING)
+        paths = l.find_tiles(['34RCS'], datetime.date(2016, 3, 10), datetime.date(2016, 4, 30))
+
+        self.assertEqual(paths, ['tiles/34/R/CS/2016/3/25/0', 'tiles/34/R/CS/2016/3/25/1'])
+        self.assertEqual(sorted(c[1]['params']['prefix'] for c in session.get.call_args_list),
+                         ['tiles/34/R/CS/2016/3/', 'tiles/34/R/CS/2016/4/'])
+
+        # the found tiles are downloaded without any more requests
+        l.download(paths, [4])
+        self.assertEqual(fake_fetch.call_count, 2)
+        self.assertFalse(fake_remote_file_exists.called)
+        self.assertEqual(session.get.call_count, 2)
+
+        # listings of past months are read from the download directory
+        l = Sentinel2(download_dir=self.temp_folder, session=session)
+        self.assertEqual(l.find_tiles(['34RCS'], datetime.date(2016, 3, 1), datetime.date(2016, 3, 31)),
+                         ['tiles/34/R/CS/2016/3/5/0'] + paths)
+        self.assertEqual(session.get.call_count, 2)
+
+        with self.assertRaises(IncorrectSentine2SceneId):
+            l.find_tiles(['34RC'], datetime.date(2016, 3, 1), datetime.date(2016, 3, 31))
@@ -0,0 +1,106 @@
+import errno
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.common import RemoteMetadata
+from sdownloader.download import Scene
+from sdownloader.errors import IncorrectSentine2SceneId, RemoteFileDoesntExist
+from sdownloader.landsat8 import Landsat8
+from sdownloader.sentinel2 import Sentinel2
+from sdownloader.shard import ShardDirectory, download_sharded, partition, shard_index
+
+
+class FakeDownloader(object):
+    """ Downloads nothing, scenes named missing-* don't exist """
+
+    def __init__(self, download_dir, max_workers=1):
+        self.download_dir = download_dir
+        self.max_workers = max_workers
+
+    @classmethod
+    def shard_key(cls, scene):
+        return scene.split('/')[0]
+
+    def iter_download(self, scenes, bands):
+        for scene in scenes:
+            if scene.startswith('missing'):
+                raise RemoteFileDoesntExist
+            yield Scene(scene, [os.path.join(self.download_dir, scene, str(band)) for band in bands], bands=bands)
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.scenes = ['{0}/{1}'.format(tile, day) for tile in ('a', 'b', 'c', 'd') for day in range(3)]
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_shard_keys(self):
+        self.assertEqual(Landsat8.shard_key('LC08_L1TP_012029_20170411_20170415_01_T1'), '012029')
+        self.assertEqual(Sentinel2.shard_key('tiles/34/R/CS/2016/3/25/0'), '34RCS')
+        self.assertEqual(Sentinel2.shard_key('S2A_OPER_MSI_L1C_TL_SGS__20160325T150955_A003951_T34RCS_N02.01'), '34RCS')
+
+        # the hash doesn't depend on the process
+        self.assertEqual(shard_index('012029', 7), shard_index(u'012029', 7))
+
+        parts = partition(FakeDownloader, self.scenes, 3)
+        self.assertEqual(sorted(sum(parts, [])), sorted(self.scenes))
+        for part in parts:
+            self.assertEqual(len(set(scene.split('/')[0] for scene in part)) * 3, len(part))
+
+    def test_download_sharded(self):
+        for processes, max_workers in ((1, 1), (2, 1), (1, 4), (2, 4)):
+            scenes = download_sharded(FakeDownloader, self.scenes + ['missing/0'], [4, 3], self.temp_folder,
+                                      processes=processes, shards=4, max_workers=max_workers)
+
+            self.assertEqual(sorted(scenes.scenes), sorted(self.scenes))
+            self.assertEqual(scenes['b/1'].files, [os.path.join(self.temp_folder, 'b/1', band) for band in '43'])
+            self.assertEqual([(scene, url) for scene, url, _ in scenes.errors], [('missing/0', None)])
+
+    def test_download_sharded_concurrently(self):
+        paths = ['tiles/34/R/CS/2016/3/25/0', 'tiles/37/T/BG/2016/3/20/0']
+
+        with mock.patch('sdownloader.download.remote_file_exists') as fake_remote_file_exists:
+            with mock.patch('sdownloader.download.fetch') as fake_fetch:
+                fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 1, None, None)
+                fake_fetch.side_effect = lambda url, path, **kwargs: os.path.join(path, os.path.basename(url))
+                scenes = download_sharded(Sentinel2, paths + ['garbage'], [4], self.temp_folder, processes=1,
+                                          shards=2, max_workers=4)
+
+        self.assertEqual(sorted(scenes.scenes), paths)
+        self.assertEqual([scene for scene, _, _ in scenes.errors], ['garbage'])
+        self.assertTrue(isinstance(scenes.errors[0][2], IncorrectSentine2SceneId))
+
+    def test_shard_directory(self):
+        shard_dir = os.path.join(self.temp_folder, 'shards')
+        directory = ShardDirectory(shard_dir, stale_after=60)
+        directory.manifest(self.scenes, 4)
+
+        # another host holds the first shard
+        self.assertTrue(directory.claim(0))
+        self.assertFalse(directory.claim(0))
+
+        scenes = download_sharded(FakeDownloader, self.scenes, [4], self.temp_folder, processes=1, shards=8,
+                                  shard_dir=shard_dir)
+        first = partition(FakeDownloader, self.scenes, 4)[0]
+        self.assertEqual(sorted(scenes.scenes + first), sorted(self.scenes))
+
+        # the lock of the first shard became stale
+        os.utime(os.path.join(shard_dir, 'shard-00000.lock'), (0, 0))
+        scenes = download_sharded(FakeDownloader, self.scenes, [4], self.temp_folder, processes=1,
+                                  shard_dir=shard_dir, stale_after=60)
+        self.assertEqual(sorted(scenes.scenes), sorted(first))
+        self.assertEqual(sorted(directory.results(4).scenes), sorted(self.scenes))
+
+        with self.assertRaises(ValueError):
+            directory.manifest(self.scenes[1:], 4)
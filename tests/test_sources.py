@@ -0,0 +1,121 @@
+import errno
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.common import RemoteMetadata
+from sdownloader.errors import RemoteFileDoesntExist
+from sdownloader.landsat8 import Landsat8, Landsat8DownloaderException
+from sdownloader.metrics import Event, FETCH
+from sdownloader.sources import SourceRanker, RANKED, RACE
+from sdownloader.download import AMAZON_S3_STORAGE, GOOGLE_PUBLIC_DATA_STORAGE_SERVICE
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.products = ['LC08_L1TP_136030_20140713_20170421_01_T1', 'LC08_L1TP_181045_20130619_20170503_01_T1']
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _google_only(self, url, **kwargs):
+        if url.startswith(Landsat8.GOOGLE_BASE_URL):
+            return RemoteMetadata(url, 200, 10, None, None)
+        raise RemoteFileDoesntExist
+
+    def test_ranker(self):
+        ranker = SourceRanker()
+        ranker.record_probe('slow', 0.5, True)
+        ranker.record_probe('fast', 0.1, True)
+        ranker.record_probe('missing', 0.01, False)
+
+        self.assertEqual(ranker.rank(['missing', 'slow', 'fast', 'new']), ['new', 'fast', 'slow', 'missing'])
+
+        ranker.record_transfer('fast', 100 * 1024 * 1024, 100)
+        ranker.record_transfer('slow', 100 * 1024 * 1024, 1)
+        self.assertEqual(ranker.rank(['fast', 'slow']), ['slow', 'fast'])
+
+    @mock.patch('sdownloader.download.fetch')
+    @mock.patch('sdownloader.landsat8.remote_file_exists')
+    def test_ranked_selection_prefers_google_after_aws_misses(self, fake_remote_file_exists, fake_fetch):
+        fake_remote_file_exists.side_effect = self._google_only
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+
+        l = Landsat8(download_dir=self.temp_folder, source_selection=RANKED)
+        l.download(self.products[:1], [4])
+        aws_probes = [c for c in fake_remote_file_exists.call_args_list if 'amazonaws' in c[0][0]]
+        self.assertEqual(len(aws_probes), 1)
+
+        fake_remote_file_exists.reset_mock()
+        results = l.download(self.products[1:], [4])
+
+        self.assertFalse([c for c in fake_remote_file_exists.call_args_list if 'amazonaws' in c[0][0]])
+        for f in results[0].files:
+            self.assertTrue(f.startswith(Landsat8.GOOGLE_BASE_URL))
+
+    @mock.patch('sdownloader.download.fetch')
+    @mock.patch('sdownloader.landsat8.remote_file_exists')
+    def test_race_selection(self, fake_remote_file_exists, fake_fetch):
+        def remote_file_exists(url, **kwargs):
+            if url.startswith(Landsat8.S3_LANDSAT_BASE_URL):
+                time.sleep(0.2)
+            return RemoteMetadata(url, 200, 10, None, None)
+
+        fake_remote_file_exists.side_effect = remote_file_exists
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+
+        l = Landsat8(download_dir=self.temp_folder, source_selection=RACE)
+        results = l.download(self.products[:1], [4])
+
+        for f in results[0].files:
+            self.assertTrue(f.startswith(Landsat8.GOOGLE_BASE_URL))
+
+    @mock.patch('sdownloader.download.fetch')
+    @mock.patch('sdownloader.landsat8.remote_file_exists')
+    def test_mixed_sources(self, fake_remote_file_exists, fake_fetch):
+        def remote_file_exists(url, **kwargs):
+            if url.startswith(Landsat8.S3_LANDSAT_BASE_URL) and not url.endswith('_B4.TIF'):
+                raise RemoteFileDoesntExist
+            return RemoteMetadata(url, 200, 10, None, None)
+
+        fake_remote_file_exists.side_effect = remote_file_exists
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+
+        l = Landsat8(download_dir=self.temp_folder, mixed_sources=True)
+        files = l.download(self.products[:1], [4])[0].files
+
+        self.assertEqual(len(files), 4)
+        self.assertEqual([f for f in files if f.startswith(Landsat8.S3_LANDSAT_BASE_URL)],
+                         [Landsat8.amazon_s3_url(Landsat8.scene_interpreter(self.products[0]), 4)])
+        self.assertEqual(l._url_source(files[0]), AMAZON_S3_STORAGE if files[0].endswith('_B4.TIF')
+                         else GOOGLE_PUBLIC_DATA_STORAGE_SERVICE)
+
+    def test_unknown_source_selection(self):
+        with self.assertRaises(Landsat8DownloaderException):
+            Landsat8(download_dir=self.temp_folder, source_selection='fastest')
+
+    @mock.patch('sdownloader.landsat8.remote_file_exists')
+    def test_transfers_on_disk_are_not_ranked(self, fake_remote_file_exists):
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 4, None, None)
+
+        def fetch(url, path, listener=None, **kwargs):
+            # the first band is on disk already, only the second one is downloaded
+            if url.endswith('_B3.TIF'):
+                listener(Event(FETCH, url, 2.0, bytes=4))
+            return url
+
+        l = Landsat8(download_dir=self.temp_folder, source_selection=RANKED)
+        with mock.patch('sdownloader.download.fetch', side_effect=fetch):
+            with mock.patch.object(l.ranker, 'record_transfer') as record_transfer:
+                l.download(self.products[:1], [4, 3])
+
+        record_transfer.assert_called_once_with(AMAZON_S3_STORAGE, 4, 2.0)
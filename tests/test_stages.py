@@ -0,0 +1,99 @@
+import errno
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.catalog import Catalog
+from sdownloader.common import RemoteMetadata
+from sdownloader.sentinel2 import Sentinel2
+from sdownloader.stages import CloudOptimizedGeoTIFF
+
+try:
+    import numpy
+    import rasterio
+    from rasterio.transform import from_origin
+except ImportError:
+    rasterio = None
+
+
+def rename_stage(path, band, scene):
+    if band == 3:
+        raise IOError('broken raster')
+    os.rename(path, path + '.out')
+    return path + '.out'
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.tile = 'tiles/34/R/CS/2016/3/25/0'
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def _fake_fetch(self, url, path, **kwargs):
+        file_path = os.path.join(path, os.path.basename(url))
+        with open(file_path, 'w') as f:
+            f.write('raster')
+        return file_path
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_stages(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = self._fake_fetch
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 10, 'etag', None)
+
+        s = Sentinel2(download_dir=self.temp_folder, stages=[rename_stage])
+        scene = s.download([self.tile], [4, 2])[0]
+        self.assertEqual(sorted(os.path.basename(f) for f in scene.files), ['B02.jp2.out', 'B04.jp2.out'])
+
+        catalog = Catalog(self.temp_folder)
+        s = Sentinel2(download_dir=self.temp_folder, stages=[rename_stage], stage_workers=3, max_workers=4,
+                      catalog=catalog)
+        scenes = s.download([self.tile], [4, 3, 2])
+
+        self.assertEqual(sorted(os.path.basename(f) for f in scenes[0].files), ['B02.jp2.out', 'B04.jp2.out'])
+        self.assertEqual([(url[-7:], str(e)) for _, url, e in scenes.errors], [('B03.jp2', 'broken raster')])
+        self.assertEqual(sorted((band, path[-11:], size) for band, path, size, _, _, _ in catalog.files(self.tile)),
+                         [('2', 'B02.jp2.out', 6), ('4', 'B04.jp2.out', 6)])
+
+        # the threads of the stages stop with the download
+        self.assertIsNone(s._pipeline._pool)
+
+        scenes = s.iter_download([self.tile], [4])
+        scene = next(scenes)
+        self.assertEqual([os.path.basename(f) for f in scene.files], ['B04.jp2.out'])
+        scenes.close()
+        self.assertIsNone(s._pipeline._pool)
+
+    @unittest.skipIf(rasterio is None, 'rasterio is not installed')
+    def test_cloud_optimized_geotiff(self):
+        path = os.path.join(self.temp_folder, 'LC08_L1TP_012029_20170411_20170415_01_T1_B4.TIF')
+        data = numpy.arange(512 * 768, dtype='uint16').reshape(1, 512, 768)
+        with rasterio.open(path, 'w', driver='GTiff', width=768, height=512, count=1, dtype='uint16',
+                           crs='EPSG:32618', transform=from_origin(600000, 4900000, 30, 30)) as dst:
+            dst.write(data)
+
+        stage = CloudOptimizedGeoTIFF(blocksize=128, min_overview_size=100)
+        output = stage(path, 4, 'LC08_L1TP_012029_20170411_20170415_01_T1')
+
+        self.assertTrue(output.endswith('_B4.cog.tif'))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(self.temp_folder), [os.path.basename(output)])
+        with rasterio.open(output) as src:
+            self.assertEqual(src.block_shapes, [(128, 128)])
+            self.assertEqual(src.compression.name.lower(), 'deflate')
+            self.assertEqual(src.overviews(1), [2, 4])
+            self.assertEqual(src.crs.to_epsg(), 32618)
+            self.assertTrue((src.read() == data).all())
+
+        # metadata files are left alone
+        self.assertEqual(stage('scene_MTL.txt', 'MTL', 'scene'), 'scene_MTL.txt')
@@ -0,0 +1,106 @@
+import errno
+import hashlib
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.common import RemoteMetadata, fetch
+from sdownloader.integrity import read_checksum
+from sdownloader.sentinel2 import Sentinel2
+from sdownloader.store import BlobStore, SYMLINK, COPY
+
+CONTENT = b'band data'
+MD5 = hashlib.md5(CONTENT).hexdigest()
+
+
+def fake_fetch_file(url, file_path, remote, **kwargs):
+    with open(file_path, 'wb') as f:
+        f.write(CONTENT)
+    return file_path
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.folders = [os.path.join(self.temp_folder, name) for name in ('a', 'b')]
+        for folder in self.folders:
+            os.makedirs(folder)
+        self.url = 'http://sentinel-s2-l1c.s3.amazonaws.com/tiles/34/R/CS/2016/3/25/0/B04.jp2'
+        self.remote = RemoteMetadata(self.url, 200, len(CONTENT), '"{0}"'.format(MD5), None, md5=MD5)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    @mock.patch('sdownloader.common._fetch_file')
+    def test_fetch_once(self, fake_fetch):
+        fake_fetch.side_effect = fake_fetch_file
+        store = BlobStore(os.path.join(self.temp_folder, 'store'))
+
+        paths = [fetch(self.url, folder, remote=self.remote, store=store) for folder in self.folders]
+        self.assertEqual(fake_fetch.call_count, 1)
+        self.assertTrue(os.path.samefile(paths[0], paths[1]))
+        self.assertEqual(store.blob_path(self.remote)[-32:], MD5)
+
+        # the same content from another source is linked as well
+        mirror = RemoteMetadata('https://storage.googleapis.com/bucket/B04.jp2', 200, len(CONTENT), None, None,
+                                md5=MD5)
+        other = os.path.join(self.temp_folder, 'c')
+        os.makedirs(other)
+        self.assertTrue(fetch(mirror.url, other, remote=mirror, store=store, verify=True))
+        self.assertEqual(fake_fetch.call_count, 1)
+        self.assertEqual(read_checksum(os.path.join(other, 'B04.jp2')), MD5)
+
+        self.assertEqual(store.prune(), 0)
+        for path in paths + [os.path.join(other, 'B04.jp2')]:
+            os.remove(path)
+        self.assertEqual(store.prune(), 1)
+        self.assertFalse(os.path.exists(store.blob_path(self.remote)))
+
+    @mock.patch('sdownloader.common._fetch_file')
+    def test_link_modes(self, fake_fetch):
+        fake_fetch.side_effect = fake_fetch_file
+
+        store = BlobStore(os.path.join(self.temp_folder, 'symlinks'), link=SYMLINK)
+        paths = [fetch(self.url, folder, remote=self.remote, store=store) for folder in self.folders]
+        self.assertFalse(os.path.islink(paths[0]))
+        self.assertTrue(os.path.islink(paths[1]))
+        with self.assertRaises(ValueError):
+            store.prune()
+
+        store = BlobStore(os.path.join(self.temp_folder, 'copies'), link=COPY)
+        for path in paths:
+            os.remove(path)
+        paths = [fetch(self.url, folder, remote=self.remote, store=store) for folder in self.folders]
+        self.assertFalse(os.path.samefile(paths[0], paths[1]))
+        with open(paths[1], 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(fake_fetch.call_count, 2)
+
+        with self.assertRaises(ValueError):
+            BlobStore(self.temp_folder, link='move')
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.common._fetch_file')
+    def test_download_dirs_share_store(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = fake_fetch_file
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, len(CONTENT), None, None)
+        store = BlobStore(os.path.join(self.temp_folder, 'store'))
+
+        first = Sentinel2(self.folders[0], store=store).download(['tiles/34/R/CS/2016/3/25/0'], [4, 3])
+        second = Sentinel2(self.folders[1], store=store, max_workers=2,
+                           relative_product_path_builder=lambda utm, band, square, date, seq: utm + band + square
+                           ).download(['tiles/34/R/CS/2016/3/25/0'], [4, 3])
+
+        self.assertEqual(fake_fetch.call_count, 2)
+        self.assertEqual(sorted(os.path.relpath(f, self.folders[1]) for f in second[0].files),
+                         [os.path.join('34RCS', 'B03.jp2'), os.path.join('34RCS', 'B04.jp2')])
+        for path in first[0].files:
+            self.assertEqual(os.stat(path).st_nlink, 3)
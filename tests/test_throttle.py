@@ -0,0 +1,101 @@
+import errno
+import shutil
+import threading
+import time
+import unittest
+from tempfile import mkdtemp
+
+import mock
+
+from sdownloader.common import RemoteMetadata, fetch
+from sdownloader.landsat8 import Landsat8
+from sdownloader.throttle import TokenBucket, Throttle, HIGH, NORMAL
+
+
+class Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_folder = mkdtemp()
+        self.products = ['LC08_L1TP_012019_20170411_20170415_01_T1', 'LC08_L1TP_012029_20170411_20170415_01_T1']
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(self.temp_folder)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def test_token_bucket_rate(self):
+        bucket = TokenBucket(rate=100, capacity=10)
+        start = time.time()
+        for _ in range(30):
+            bucket.consume(1)
+
+        # 10 tokens are available at once, the other 20 take 0.2 seconds
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+    def test_token_bucket_priority(self):
+        bucket = TokenBucket(rate=20, capacity=1)
+        bucket.consume(1)
+        served = []
+
+        def consume(name, priority):
+            bucket.consume(1, priority)
+            served.append(name)
+
+        threads = [threading.Thread(target=consume, args=('image', NORMAL))]
+        threads[0].start()
+        time.sleep(0.01)
+        threads.append(threading.Thread(target=consume, args=('metadata', HIGH)))
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(served, ['metadata', 'image'])
+
+    def test_throttle_per_host(self):
+        throttle = Throttle(requests_per_second=1000, hosts={'storage.googleapis.com': {'requests_per_second': 2}})
+        s3_bytes, s3_requests = throttle._host_buckets(Landsat8.S3_LANDSAT_BASE_URL)
+        google_bytes, google_requests = throttle._host_buckets(Landsat8.GOOGLE_BASE_URL)
+
+        self.assertIsNone(s3_bytes)
+        self.assertEqual(s3_requests.rate, 1000)
+        self.assertEqual(google_requests.rate, 2)
+
+    @mock.patch('sdownloader.common.download')
+    @mock.patch('sdownloader.common.get_session')
+    def test_bandwidth_limit_without_session(self, fake_get_session, fake_download):
+        fake_download.side_effect = lambda url, path, show_progress=False: open(path, 'wb').close()
+        session = fake_get_session.return_value
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {'content-length': '4'}
+        session.get.return_value.iter_content.return_value = [b'band']
+        throttle = Throttle(hosts={'storage.googleapis.com': {'bytes_per_second': 1000}})
+        download_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, download_dir)
+
+        # homura can't be limited, so the file is streamed over the shared session
+        url = Landsat8.GOOGLE_BASE_URL + 'LC08/B4.TIF'
+        fetch(url, download_dir, throttle=throttle, remote=RemoteMetadata(url, 200, 4, None, None))
+        self.assertTrue(session.get.called)
+        self.assertFalse(fake_download.called)
+
+        fetch(Landsat8.S3_LANDSAT_BASE_URL + 'L8/B5.TIF', download_dir, throttle=throttle)
+        self.assertTrue(fake_download.called)
+
+    @mock.patch('sdownloader.download.remote_file_exists')
+    @mock.patch('sdownloader.download.fetch')
+    def test_metadata_bands_are_fetched_first(self, fake_fetch, fake_remote_file_exists):
+        fake_fetch.side_effect = lambda url, path, **kwargs: url
+        fake_remote_file_exists.side_effect = lambda url, **kwargs: RemoteMetadata(url, 200, 1, None, None)
+
+        l = Landsat8(download_dir=self.temp_folder, max_workers=2)
+        with mock.patch.object(l, '_map', side_effect=lambda func, items: [func(item) for item in items]):
+            results = l.download(self.products, [4, 3])
+
+        fetched = [c[0][0] for c in fake_fetch.call_args_list]
+        priorities = [c[1]['priority'] for c in fake_fetch.call_args_list]
+        self.assertEqual(priorities, [HIGH] * 6 + [NORMAL] * 4)
+        # scenes take turns
+        self.assertTrue(self.products[0] in fetched[0] and self.products[1] in fetched[1])
+        self.assertEqual(len(results[self.products[0]].files), 5)